@@ -6,9 +6,8 @@ from transformers import AutoModelForCausalLM, AutoTokenizer, GPTQConfig, Traini
 from transformers import AutoTokenizer, GenerationConfig
 import os
 import time
-from langchain_community.vectorstores import FAISS  # For working with vector stores
-from langchain_community.embeddings.huggingface import HuggingFaceEmbeddings  # For generating embeddings using Hugging Face models
 from langchain.schema import Document  # For handling document schema
+from Chatbot.retrieval import get_query_embeddings, query_cache, retrieve_faiss, retrieve_context, rank_documents  # Embedding-based document retrieval
 
 # -----------------------------------------------------------------------------------------------------
 # Load the pre-trained Mistral 7B model with quantization configuration
@@ -55,30 +54,6 @@ system_prompt = """
 You are a helpful and informative assistant. Your goal is to answer questions accurately, thoroughly, and naturally. Provide detailed explanations and context when possible. If you do not understand or do not have enough information to answer, simply say - "Sorry, I don't know." Avoid formatting your response as a multiple-choice answer.
 """
 
-# Initialize embeddings using a pre-trained sentence transformer model (`gtr-t5-large`) for query processing and document retrieval.
-embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/gtr-t5-large', 
-                                   model_kwargs={'device': 'cuda'})
-
-# ---------------------------------------------------------------------------------------------------------------
-
-def retrieve_faiss(Db_faiss_path):
-    # Load a FAISS vector database for efficient similarity search, using embeddings generated by the sentence transformer model.
-    db = FAISS.load_local(Db_faiss_path, embeddings, allow_dangerous_deserialization=True)
-    return db
-
-
-
-# Function to retrieve the most relevant documents from the FAISS database given a query, returning the top `k` results.
-def retrieve_context(query, db, k=10):
-    query_embedding = embeddings.embed_query(query)
-    docs = db.similarity_search_by_vector(query_embedding, k)
-    ranked_docs = rank_documents(query, docs)
-    return ranked_docs[:5]
-
-# Function to rank documents based on their relevance to the query; currently a placeholder that returns the docs unmodified.
-def rank_documents(query, docs):
-    return docs 
-
 # Function to generate a response from the model based on the query and retrieved context.
 def generate_answer(query, context, image_context=None):
     # Combine the context documents into a single text block to include in the prompt.
@@ -0,0 +1,72 @@
+import os
+from langchain_community.vectorstores import FAISS  # For working with vector stores
+from bm25_index import load_or_build_bm25, lexical_search, hybrid_search  # For lexical and hybrid retrieval
+from embedding_cache import QueryEmbeddingCache, DEFAULT_PERSIST_PATH  # For skipping the encoder on repeated queries
+from embedding_backend import get_embeddings, embedding_cache_key  # For generating embeddings on GPU or CPU
+from metadata_filter import resolve_filter_ids, filtered_similarity_search  # For scoping retrieval by metadata
+from vector_shards import SHARDED_SEARCH, has_shards, load_sharded_store  # For dense search spread over shard workers
+from chunk_dedup import load_provenance  # For mapping dropped near-duplicate chunks to the chunk that was kept
+
+# -----------------------------------------------------------------------------------------------------
+# Document retrieval shared by the Mistral chatbot and the document pipeline
+# -----------------------------------------------------------------------------------------------------
+# Kept apart from Mistral_7b.py so that importing retrieval does not load the 7B chat model.
+
+# Retrieval mode: "dense" (embeddings only), "lexical" (BM25 only, no encoder pass) or "hybrid" (both, fused by rank).
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+
+# Embeddings from a pre-trained sentence transformer model (`gtr-t5-large`) for query processing and document retrieval.
+# The backend (cuda, cpu or cpu-int8) is selected with EMBEDDING_BACKEND; "auto" falls back to int8 on CPU-only nodes.
+# The model is loaded on the first dense query, so lexical-only processes never load it.
+embeddings = None
+
+def get_query_embeddings():
+    global embeddings
+    if embeddings is None:
+        embeddings = get_embeddings()
+    return embeddings
+
+# Bounded LRU of query embeddings backed by a SQLite file shared across job processes (QUERY_CACHE_PATH, "" disables it).
+query_cache = QueryEmbeddingCache(embedding_cache_key(), max_entries=2048, persist_path=DEFAULT_PERSIST_PATH or None)
+
+# ---------------------------------------------------------------------------------------------------------------
+
+def retrieve_faiss(Db_faiss_path):
+    # Queries are embedded through the query cache, so a lexical-only store needs no embedding model
+    store_embeddings = None if RETRIEVAL_MODE == "lexical" else get_query_embeddings()
+    if SHARDED_SEARCH and has_shards(Db_faiss_path):
+        # Only the docstore is loaded here; dense queries fan out to the shard workers (SHARD_ADDRESSES or the host's shared worker pool).
+        db = load_sharded_store(Db_faiss_path, store_embeddings)
+    else:
+        # Load a FAISS vector database for efficient similarity search, using embeddings generated by the sentence transformer model.
+        db = FAISS.load_local(Db_faiss_path, store_embeddings, allow_dangerous_deserialization=True)
+    # Attach the BM25 index stored next to the FAISS files (rebuilt if stale).
+    load_or_build_bm25(Db_faiss_path, db)
+    # The page join uses this to find the pages of chunks dropped as near-duplicates.
+    db._dedup_provenance = load_provenance(Db_faiss_path)
+    return db
+
+
+# Function to retrieve the most relevant documents from the FAISS database given a query, returning the top `k` results.
+def retrieve_context(query, db, k=10, mode=None, metadata_filter=None):
+    mode = mode or RETRIEVAL_MODE
+    # Resolve the metadata filter (e.g. {"source_name": [...], "year": 2024}) to chunk ids before any scoring.
+    allowed_ids = resolve_filter_ids(db, metadata_filter)
+    if allowed_ids is not None and not allowed_ids:
+        return []
+    if mode == "lexical":
+        docs = lexical_search(query, db, k, allowed_ids=allowed_ids)
+    else:
+        query_embedding = query_cache.embed(query, get_query_embeddings().embed_query)
+        if mode == "hybrid":
+            docs = hybrid_search(query, query_embedding, db, k, allowed_ids=allowed_ids)
+        elif allowed_ids is not None:
+            docs = filtered_similarity_search(db, query_embedding, k, allowed_ids)
+        else:
+            docs = db.similarity_search_by_vector(query_embedding, k)
+    ranked_docs = rank_documents(query, docs)
+    return ranked_docs[:5]
+
+# Function to rank documents based on their relevance to the query; currently a placeholder that returns the docs unmodified.
+def rank_documents(query, docs):
+    return docs
@@ -1,26 +1,29 @@
-import boto3
 import json
 import os
+import time
 from dotenv import load_dotenv
-import botocore.config
-import re
+from bedrock_pool import BedrockClientPool, BEDROCK_STATE_PATH
+from json_repair import extract_json_payload
+from llm_ledger import record_call
 
 def sanitize_claude_output(output_str: str) -> str:
-    output_str = output_str.strip().split("```")[0].strip()
-    output_str = re.sub(r'(?<!\\)\\n', '\\\\n', output_str)
-    output_str = re.sub(r'[\x00-\x1F\x7F]', '', output_str)
-    return output_str
+    # Only strip markdown fences and leading prose; malformed or truncated JSON
+    # is handled by json_repair when the output is parsed.
+    return extract_json_payload(output_str)
 
 load_dotenv()
 
-bedrock_config = botocore.config.Config(
-    connect_timeout=10,
-    read_timeout=300,
-    retries={"max_attempts": 3}
+# Shared, rate-limited client: token buckets for requests and tokens per
+# minute, AIMD concurrency, jittered retries and a circuit breaker. The budget
+# lives in BEDROCK_STATE_PATH, so every job process on the host shares it.
+bedrock_client = BedrockClientPool(
+    region_name="us-east-1",
+    max_pool_connections=int(os.getenv("BEDROCK_MAX_CONNECTIONS", "16")),
+    requests_per_minute=int(os.getenv("BEDROCK_RPM", "50")),
+    tokens_per_minute=int(os.getenv("BEDROCK_TPM", "200000")),
+    state_path=BEDROCK_STATE_PATH
 )
 
-bedrock_client = boto3.client("bedrock-runtime", region_name="us-east-1", config=bedrock_config)
-
 def call_claude(
     query_or_answers,
     context=None,
@@ -28,7 +31,10 @@ def call_claude(
     mode="default",
     template_name=None,
     template_fields=None,
-    debug=False
+    debug=False,
+    raw_output_path=None,
+    job_id=None,
+    deadline=None
 ):
 
     if mode == "slides":
@@ -134,27 +140,40 @@ Begin now.
         print(input_text)
         print("\n=================================================\n")
 
+    model_id = "anthropic.claude-3-sonnet-20240229-v1:0"
     payload = {
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": 4000,
         "messages": [{"role": "user", "content": input_text}]
     }
 
-    response = bedrock_client.invoke_model(
-        body=json.dumps(payload),
-        modelId="anthropic.claude-3-sonnet-20240229-v1:0",
-        contentType="application/json",
-        accept="application/json"
-    )
+    # Every call is timed and recorded in the usage ledger, including failures
+    started = time.monotonic()
+    try:
+        response = bedrock_client.invoke_model(
+            body=json.dumps(payload),
+            modelId=model_id,
+            contentType="application/json",
+            accept="application/json",
+            deadline=deadline
+        )
+        response_body = json.loads(response["body"].read())
+    except Exception as e:
+        record_call(mode, template_name, len(input_text), time.monotonic() - started,
+                    error=f"{type(e).__name__}: {e}", model_id=model_id,
+                    max_tokens=payload["max_tokens"], job_id=job_id)
+        raise
+    record_call(mode, template_name, len(input_text), time.monotonic() - started,
+                response_body=response_body, model_id=model_id,
+                max_tokens=payload["max_tokens"], job_id=job_id)
 
-    response_body = json.loads(response["body"].read())
     raw_text = response_body['content'][0]['text']
 
-    # Save raw output to file
-    with open("claude_raw_output.txt", "w", encoding="utf-8") as f:
+    # Save raw output to file (per job when a checkpoint path is given)
+    with open(raw_output_path or "claude_raw_output.txt", "w", encoding="utf-8") as f:
         f.write(raw_text)
 
-    clean_output = sanitize_claude_output(raw_text)
+    clean_output = sanitize_claude_output(raw_text) if mode in ("slides", "grant") else raw_text.strip()
 
     if debug:
         print("\n================ SANITIZED OUTPUT ================\n")
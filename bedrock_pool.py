@@ -0,0 +1,542 @@
+import io
+import os
+import sys
+import json
+import time
+import fcntl
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+import boto3
+import botocore.config
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, ReadTimeoutError
+
+# ==================================================
+# Shared Bedrock client layer
+# ==================================================
+# One pooled boto3 client per process, guarded by:
+#   - token buckets for requests per minute and tokens per minute,
+#   - an AIMD concurrency limit (additive increase on success, halved on
+#     throttling),
+#   - retries with full-jitter exponential backoff,
+#   - a circuit breaker that fails fast after repeated failures or throttles.
+# Every job runs in its own run_generation.py process, so the buckets, the
+# limit and the breaker live in a state file (BEDROCK_STATE_PATH) that all
+# processes on the host update under flock. Concurrent jobs therefore share
+# one budget and back off together instead of each assuming the full quota.
+# Several jobs throttled at the same moment still back off at different
+# times, thanks to the jitter.
+
+THROTTLING_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+RETRYABLE_CODES = THROTTLING_CODES | {"ModelNotReadyException", "ServiceUnavailableException", "InternalServerException"}
+BEDROCK_STATE_PATH = os.getenv("BEDROCK_STATE_PATH", os.path.join(".cache", "bedrock_pool.json"))
+POLL_SECONDS = 0.05  # Wait between checks for a free concurrency slot
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class DeadlineExceeded(TimeoutError):
+    """The caller's deadline passed while the call waited for capacity or a retry."""
+
+
+class LocalState:
+    """Budget state for one process (tests, in-process load runs)."""
+
+    def __init__(self):
+        self.data = {}
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            yield self.data
+
+
+class SharedState:
+    """
+    Budget state shared by every process on the host: a JSON file read and
+    rewritten under an exclusive flock. time.monotonic() is system-wide on
+    Linux, so timestamps stored here are comparable across processes.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock, open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+            except (FileNotFoundError, ValueError):
+                data = {}
+            yield data
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _holder():
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+class TokenBucket:
+    """Refills `rate_per_minute` units per minute up to `capacity`."""
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic, state=None, key="bucket"):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.clock = clock
+        self.state = state or LocalState()
+        self.key = key
+
+    def _bucket(self, data):
+        # Caller holds the state transaction
+        now = self.clock()
+        bucket = data.setdefault(self.key, {"tokens": float(self.capacity), "updated": now})
+        bucket["tokens"] = min(self.capacity, bucket["tokens"] + max(0.0, now - bucket["updated"]) * self.rate)
+        bucket["updated"] = now
+        return bucket
+
+    @property
+    def tokens(self):
+        with self.state.transaction() as data:
+            return self._bucket(data)["tokens"]
+
+    def try_acquire(self, amount=1.0):
+        """Takes `amount` units if available; otherwise returns the seconds to wait."""
+        amount = min(amount, self.capacity)
+        with self.state.transaction() as data:
+            bucket = self._bucket(data)
+            if bucket["tokens"] >= amount:
+                bucket["tokens"] -= amount
+                return 0.0
+            return (amount - bucket["tokens"]) / self.rate
+
+    def acquire(self, amount=1.0, sleep=time.sleep):
+        while True:
+            wait = self.try_acquire(amount)
+            if wait <= 0:
+                return
+            sleep(wait)
+
+    def refund(self, amount):
+        with self.state.transaction() as data:
+            bucket = self._bucket(data)
+            bucket["tokens"] = min(self.capacity, bucket["tokens"] + min(amount, self.capacity))
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit with additive increase and multiplicative decrease.
+    Slots are counted per process, so slots held by a process that died are
+    given back the next time the state is read.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, increase=1.0, decrease=0.5, state=None, key="limiter"):
+        self.initial = float(min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.state = state or LocalState()
+        self.key = key
+
+    def _limiter(self, data):
+        # Caller holds the state transaction
+        limiter = data.setdefault(self.key, {"limit": self.initial, "in_flight": {}})
+        limiter["in_flight"] = {pid: n for pid, n in limiter["in_flight"].items() if n > 0 and _pid_alive(pid)}
+        return limiter
+
+    @property
+    def limit(self):
+        with self.state.transaction() as data:
+            return self._limiter(data)["limit"]
+
+    @property
+    def in_flight(self):
+        with self.state.transaction() as data:
+            return sum(self._limiter(data)["in_flight"].values())
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pid = str(os.getpid())
+        while True:
+            with self.state.transaction() as data:
+                limiter = self._limiter(data)
+                if sum(limiter["in_flight"].values()) < int(limiter["limit"]):
+                    limiter["in_flight"][pid] = limiter["in_flight"].get(pid, 0) + 1
+                    return
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError("Timed out waiting for a Bedrock concurrency slot.")
+            time.sleep(POLL_SECONDS if deadline is None else max(0.0, min(POLL_SECONDS, deadline - time.monotonic())))
+
+    def release(self, throttled=False):
+        pid = str(os.getpid())
+        with self.state.transaction() as data:
+            limiter = self._limiter(data)
+            limiter["in_flight"][pid] = max(0, limiter["in_flight"].get(pid, 0) - 1)
+            if throttled:
+                limiter["limit"] = max(self.minimum, limiter["limit"] * self.decrease)
+            else:
+                # +1 slot per `limit` successes, i.e. one full window
+                limiter["limit"] = min(self.maximum, limiter["limit"] + self.increase / max(limiter["limit"], 1.0))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures or throttles;
+    half-opens after `reset_seconds`, when a single probe call is let
+    through. A probe that does not close the circuit restarts the wait.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0, clock=time.monotonic, state=None, key="breaker"):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = state or LocalState()
+        self.key = key
+
+    def _breaker(self, data):
+        # Caller holds the state transaction
+        breaker = data.setdefault(self.key, {"failures": 0, "opened_at": None, "probe": None})
+        if breaker["probe"] and not _pid_alive(breaker["probe"].split(":")[0]):
+            breaker["probe"] = None  # The probing process died
+        return breaker
+
+    def before_call(self):
+        """Returns True when this call is the half-open probe; the caller then calls end_probe()."""
+        with self.state.transaction() as data:
+            breaker = self._breaker(data)
+            if breaker["opened_at"] is None:
+                return False
+            if self.clock() - breaker["opened_at"] >= self.reset_seconds and breaker["probe"] is None:
+                breaker["probe"] = _holder()
+                return True
+            raise CircuitOpenError("Bedrock circuit is open after repeated failures; try again shortly.")
+
+    def end_probe(self):
+        with self.state.transaction() as data:
+            breaker = self._breaker(data)
+            if breaker["probe"] == _holder():
+                breaker["probe"] = None
+                if breaker["opened_at"] is not None:
+                    # Failed, throttled or rejected probe: wait a full reset period again
+                    breaker["opened_at"] = self.clock()
+
+    def record_success(self):
+        with self.state.transaction() as data:
+            breaker = self._breaker(data)
+            breaker["failures"] = 0
+            breaker["opened_at"] = None
+
+    def record_failure(self):
+        with self.state.transaction() as data:
+            breaker = self._breaker(data)
+            breaker["failures"] += 1
+            if breaker["failures"] >= self.failure_threshold:
+                breaker["opened_at"] = self.clock()
+
+
+def _error_code(error):
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code", "")
+    return type(error).__name__
+
+
+def _is_retryable(error):
+    return isinstance(error, (BotoConnectionError, ReadTimeoutError)) or _error_code(error) in RETRYABLE_CODES
+
+
+def estimate_tokens(body):
+    """Input tokens ~ chars / 4, plus the requested max_tokens for the output."""
+    payload = json.loads(body)
+    chars = sum(len(m.get("content", "")) if isinstance(m.get("content"), str) else 0
+                for m in payload.get("messages", []))
+    return chars // 4 + payload.get("max_tokens", 0)
+
+
+class BedrockClientPool:
+    def __init__(
+        self,
+        client=None,
+        region_name="us-east-1",
+        max_pool_connections=16,
+        requests_per_minute=50,
+        tokens_per_minute=200000,
+        max_attempts=6,
+        base_backoff=1.0,
+        max_backoff=30.0,
+        limiter=None,
+        breaker=None,
+        sleep=time.sleep,
+        state_path=None,
+    ):
+        """`state_path` shares the budget with other processes; without it the budget is per process."""
+        if client is None:
+            config = botocore.config.Config(
+                connect_timeout=10,
+                read_timeout=300,
+                max_pool_connections=max_pool_connections,
+                retries={"max_attempts": 1, "mode": "standard"}  # Retries are handled here
+            )
+            client = boto3.client("bedrock-runtime", region_name=region_name, config=config)
+        self.client = client
+        self.state = SharedState(state_path) if state_path else LocalState()
+        self.request_bucket = TokenBucket(requests_per_minute, state=self.state, key="requests")
+        self.token_bucket = TokenBucket(tokens_per_minute, state=self.state, key="tokens")
+        self.limiter = limiter or AIMDLimiter(maximum=max_pool_connections, state=self.state)
+        self.breaker = breaker or CircuitBreaker(state=self.state)
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.stats = {"calls": 0, "attempts": 0, "throttled": 0, "failed": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _backoff(self, attempt):
+        # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+
+    def invoke_model(self, deadline=None, **kwargs):
+        """
+        Drop-in replacement for client.invoke_model with rate limiting and
+        retries. `deadline` (epoch seconds) stops retrying and waiting for
+        capacity once the caller's job has run out of time.
+        """
+        self._count("calls")
+        estimated = estimate_tokens(kwargs.get("body", "{}"))
+        last_error = None
+
+        def check_deadline():
+            if deadline is not None and time.time() >= deadline:
+                raise DeadlineExceeded("Bedrock call abandoned: the job deadline has passed.")
+
+        def bounded_sleep(seconds):
+            if deadline is not None:
+                seconds = min(seconds, max(0.0, deadline - time.time()))
+            self.sleep(seconds)
+            check_deadline()
+
+        for attempt in range(self.max_attempts):
+            check_deadline()
+            probe = self.breaker.before_call()
+            try:
+                self.request_bucket.acquire(1, sleep=bounded_sleep)
+                self.token_bucket.acquire(estimated, sleep=bounded_sleep)
+                try:
+                    response = self._send(kwargs, deadline)
+                except Exception:
+                    # Throttled or failed calls use no tokens; return the estimate to the other jobs sharing the budget
+                    self.token_bucket.refund(estimated)
+                    raise
+            except Exception as e:
+                if not _is_retryable(e):
+                    self._count("failed")
+                    raise
+                last_error = e
+            else:
+                self.breaker.record_success()
+                return self._settle_tokens(response, estimated)
+            finally:
+                if probe:
+                    self.breaker.end_probe()
+
+            delay = self._backoff(attempt)
+            print(f"[WARN] Bedrock {_error_code(last_error)}; retry {attempt + 1}/{self.max_attempts} in {delay:.1f}s")
+            bounded_sleep(delay)
+
+        self._count("failed")
+        raise last_error
+
+    def _send(self, kwargs, deadline):
+        try:
+            self.limiter.acquire(timeout=None if deadline is None else max(0.0, deadline - time.time()))
+        except TimeoutError as e:
+            # The wait is only bounded by the deadline, so running out of it means the deadline passed
+            raise DeadlineExceeded("Bedrock call abandoned: the job deadline passed waiting for a slot.") from e
+        throttled = False
+        try:
+            self._count("attempts")
+            return self.client.invoke_model(**kwargs)
+        except Exception as e:
+            throttled = _error_code(e) in THROTTLING_CODES
+            if throttled:
+                self._count("throttled")
+            if _is_retryable(e):
+                # Sustained throttling opens the circuit too, so jobs stop hammering a saturated quota
+                self.breaker.record_failure()
+            raise
+        finally:
+            self.limiter.release(throttled=throttled)
+
+    def _settle_tokens(self, response, estimated):
+        # Refund the part of the token estimate the call did not use. The body
+        # stream is read once and replaced so callers can still read it.
+        raw = response["body"].read()
+        response["body"] = io.BytesIO(raw)
+        try:
+            usage = json.loads(raw).get("usage", {})
+            used = usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+            if used and used < estimated:
+                self.token_bucket.refund(estimated - used)
+        except ValueError:
+            pass
+        return response
+
+
+# ==================================================
+# Local stub for tests and load runs
+# ==================================================
+class StubBedrockClient:
+    """
+    Mimics bedrock-runtime invoke_model without AWS. Raises ThrottlingException
+    with probability `throttle_rate` or whenever more than `max_concurrency`
+    calls are in flight, and returns `response_text` after `latency` seconds.
+    """
+
+    def __init__(self, response_text="[]", latency=0.0, throttle_rate=0.0, max_concurrency=None, seed=None):
+        self.response_text = response_text
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.max_concurrency = max_concurrency
+        self.random = random.Random(seed)
+        self.in_flight = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _throttle(self):
+        return ClientError(
+            {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded (stub)"}}, "InvokeModel"
+        )
+
+    def invoke_model(self, body, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            over_limit = self.max_concurrency is not None and self.in_flight > self.max_concurrency
+            throttled = over_limit or self.random.random() < self.throttle_rate
+        try:
+            if throttled:
+                raise self._throttle()
+            time.sleep(self.latency)
+            text = self.response_text(json.loads(body)) if callable(self.response_text) else self.response_text
+            response_body = {
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": len(body) // 4, "output_tokens": len(text) // 4},
+            }
+            return {"body": io.BytesIO(json.dumps(response_body).encode("utf-8"))}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def _check_worker(state_path, calls, limit, latency, throttle_rate, log_path):
+    """One job process of `check_shared_budget`: logs (start, end) of every stub call it makes."""
+    stub = StubBedrockClient(response_text='[{"id": "slide-0"}]', latency=latency, throttle_rate=throttle_rate)
+    invoke = stub.invoke_model
+
+    def logged_invoke(**kwargs):
+        start = time.monotonic()
+        try:
+            return invoke(**kwargs)
+        finally:
+            # One O_APPEND write per line, so processes never interleave
+            with open(log_path, "a") as f:
+                f.write(f"{start} {time.monotonic()}\n")
+
+    stub.invoke_model = logged_invoke
+    pool = BedrockClientPool(client=stub, max_pool_connections=limit, requests_per_minute=6000,
+                             base_backoff=0.05, max_backoff=0.5, state_path=state_path)
+    body = json.dumps({"max_tokens": 100, "messages": [{"role": "user", "content": "x" * 400}]})
+    threads = [threading.Thread(target=pool.invoke_model, kwargs={"body": body, "modelId": "stub"}) for _ in range(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(json.dumps(pool.stats))
+
+
+def _max_overlap(log_path):
+    events = []
+    with open(log_path, "r") as f:
+        for line in f:
+            start, end = map(float, line.split())
+            events += [(start, 1), (end, -1)]
+    in_flight = peak = 0
+    for _, change in sorted(events, key=lambda event: (event[0], event[1])):
+        in_flight += change
+        peak = max(peak, in_flight)
+    return peak
+
+
+def check_shared_budget(processes=4, calls=6, limit=2, latency=0.2, throttle_rate=0.0):
+    """
+    Starts `processes` job processes against the stub, each making `calls`
+    concurrent calls, first with one shared state file and then with a
+    budget per process. With the shared state, no more than `limit` calls
+    are ever in flight across all processes. Returns False otherwise.
+    """
+    folder = tempfile.mkdtemp(prefix="mmdoc-bedrock-check-")
+    peaks = {}
+    for label, shared in (("shared", True), ("per-process", False)):
+        log_path = os.path.join(folder, f"{label}.log")
+        state_path = os.path.join(folder, "state.json") if shared else ""
+        workers = [subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "worker", "--state_path", state_path,
+             "--calls", str(calls), "--limit", str(limit), "--latency", str(latency),
+             "--throttle_rate", str(throttle_rate), "--log", log_path],
+            stdout=subprocess.PIPE, text=True
+        ) for _ in range(processes)]
+        stats = [json.loads(worker.communicate()[0].strip().splitlines()[-1]) for worker in workers]
+        peaks[label] = _max_overlap(log_path)
+        print(f"{label}: at most {peaks[label]} calls in flight across {processes} processes "
+              f"(limit {limit}); stats {stats}")
+    return peaks["shared"] <= limit
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that job processes share one Bedrock budget (stub client).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_check = sub.add_parser("check", help="Run stub job processes with and without the shared state")
+    p_check.add_argument("--processes", type=int, default=4)
+    p_check.add_argument("--calls", type=int, default=6)
+    p_check.add_argument("--limit", type=int, default=2)
+    p_check.add_argument("--latency", type=float, default=0.2)
+    p_check.add_argument("--throttle_rate", type=float, default=0.0)
+    p_worker = sub.add_parser("worker", help=argparse.SUPPRESS)
+    p_worker.add_argument("--state_path", default="")
+    p_worker.add_argument("--calls", type=int, required=True)
+    p_worker.add_argument("--limit", type=int, required=True)
+    p_worker.add_argument("--latency", type=float, required=True)
+    p_worker.add_argument("--throttle_rate", type=float, required=True)
+    p_worker.add_argument("--log", required=True)
+    args = parser.parse_args()
+    if args.command == "worker":
+        _check_worker(args.state_path or None, args.calls, args.limit, args.latency, args.throttle_rate, args.log)
+    else:
+        sys.exit(0 if check_shared_budget(args.processes, args.calls, args.limit, args.latency, args.throttle_rate) else 1)
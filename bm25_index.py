@@ -0,0 +1,180 @@
+import os
+import re
+import math
+import pickle
+from array import array
+from collections import Counter, OrderedDict
+from langchain_community.vectorstores import FAISS
+from metadata_filter import filtered_similarity_search
+
+# ==================================================
+# Lexical (BM25) index kept next to the FAISS store
+# ==================================================
+BM25_FILENAME = "bm25.pkl"
+
+# Keeps identifiers such as "IC-2024-017" or "snap_ed" as a single token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+""".split())
+
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Compact inverted index over the chunks of one FAISS store.
+
+    Postings are stored per term as two parallel `array`s (chunk positions and
+    term frequencies). Chunk positions follow `db.index_to_docstore_id`, so a
+    hit resolves to the same docstore entry the dense search would return.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docstore_ids = []
+        self.doc_lengths = array("I")
+        self.postings = {}
+        self.total_length = 0
+        self.avg_length = 0.0
+
+    def __len__(self):
+        return len(self.docstore_ids)
+
+    def add(self, docstore_id, text):
+        position = len(self.docstore_ids)
+        counts = Counter(tokenize(text))
+        self.docstore_ids.append(docstore_id)
+        length = sum(counts.values())
+        self.doc_lengths.append(length)
+        self.total_length += length
+        for term, tf in counts.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = (array("I"), array("H"))
+            entry[0].append(position)
+            entry[1].append(min(tf, 65535))
+        self.avg_length = self.total_length / len(self.doc_lengths)
+
+    def search(self, query, k=10, allowed=None):
+        """
+        Returns up to k (docstore_id, score) pairs, best first. `allowed` is an
+        optional set of chunk positions; other chunks are skipped before scoring.
+        """
+        n_docs = len(self.docstore_ids)
+        if n_docs == 0:
+            return []
+        scores = {}
+        for term in set(tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            positions, tfs = entry
+            idf = math.log(1 + (n_docs - len(positions) + 0.5) / (len(positions) + 0.5))
+            for position, tf in zip(positions, tfs):
+                if allowed is not None and position not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / (self.avg_length or 1.0))
+                scores[position] = scores.get(position, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.docstore_ids[position], score) for position, score in best]
+
+    def save(self, folder):
+        with open(os.path.join(folder, BM25_FILENAME), "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(folder):
+        with open(os.path.join(folder, BM25_FILENAME), "rb") as f:
+            return pickle.load(f)
+
+
+def build_bm25_from_db(db):
+    """Indexes every chunk in the FAISS docstore, in FAISS index order."""
+    bm25 = BM25Index()
+    for position in sorted(db.index_to_docstore_id):
+        docstore_id = db.index_to_docstore_id[position]
+        bm25.add(docstore_id, db.docstore.search(docstore_id).page_content)
+    return bm25
+
+
+def is_in_sync(bm25, db):
+    """
+    True when `bm25` indexes exactly the chunks of `db`, position for position.
+    Docstore ids are new for every build, so a rebuilt store with the same
+    number of chunks is still detected.
+    """
+    ids = db.index_to_docstore_id
+    return len(bm25) == len(ids) and all(bm25.docstore_ids[position] == ids.get(position) for position in range(len(ids)))
+
+
+def load_or_build_bm25(folder, db):
+    """
+    Loads the BM25 index saved next to the FAISS files. If it is missing or
+    was built from other chunks, it is rebuilt from the docstore and saved.
+    """
+    bm25 = None
+    if os.path.exists(os.path.join(folder, BM25_FILENAME)):
+        bm25 = BM25Index.load(folder)
+    if bm25 is None or not is_in_sync(bm25, db):
+        print("[INFO] BM25 index missing or stale; rebuilding from docstore.")
+        bm25 = build_bm25_from_db(db)
+        bm25.save(folder)
+    db._bm25 = bm25
+    return bm25
+
+
+def get_bm25(db):
+    bm25 = getattr(db, "_bm25", None)
+    if bm25 is None:
+        bm25 = db._bm25 = build_bm25_from_db(db)
+    return bm25
+
+
+def load_lexical_store(folder):
+    """
+    Loads the docstore and BM25 index of a saved FAISS store without an
+    embedding model, for CPU-only nodes that only serve lexical queries.
+    """
+    db = FAISS.load_local(folder, None, allow_dangerous_deserialization=True)
+    load_or_build_bm25(folder, db)
+    return db
+
+
+# ==================================================
+# Query paths
+# ==================================================
+def lexical_search(query, db, k=10, allowed_ids=None):
+    """BM25-only retrieval. Needs no embedding model, only the loaded docstore."""
+    hits = get_bm25(db).search(query, k, allowed=allowed_ids)
+    return [db.docstore.search(docstore_id) for docstore_id, _ in hits]
+
+
+def _doc_key(doc):
+    return (doc.metadata.get("source"), doc.metadata.get("page"), doc.page_content)
+
+
+def reciprocal_rank_fusion(result_lists, k, rrf_k=60, weights=None):
+    """Fuses ranked document lists by reciprocal rank; returns the top k documents."""
+    weights = weights or [1.0] * len(result_lists)
+    scores = OrderedDict()
+    docs = {}
+    for weight, results in zip(weights, result_lists):
+        for rank, doc in enumerate(results):
+            key = _doc_key(doc)
+            docs[key] = doc
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank + 1)
+    best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+    return [docs[key] for key, _ in best]
+
+
+def hybrid_search(query, query_embedding, db, k=10, lexical_weight=1.0, dense_weight=1.0, allowed_ids=None):
+    if allowed_ids is None:
+        dense_docs = db.similarity_search_by_vector(query_embedding, k)
+    else:
+        dense_docs = filtered_similarity_search(db, query_embedding, k, allowed_ids)
+    lexical_docs = lexical_search(query, db, k, allowed_ids=allowed_ids)
+    return reciprocal_rank_fusion([dense_docs, lexical_docs], k, weights=[dense_weight, lexical_weight])
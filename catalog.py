@@ -0,0 +1,275 @@
+# ==================================================
+# Fixed catalog behind the Streamlit forms
+# ==================================================
+# Purposes, subtypes and guided questions offered by app.py. Kept in a module
+# of its own so the offline retrieval warm-up (warm_cache.py) sees exactly
+# the entries the app can submit.
+
+# --- Slides ---
+SLIDE_PURPOSES = [
+    "Program Reporting",
+    "Strategic Planning",
+    "Fundraising & Outreach",
+    "Partnership Engagement",
+    "Food Access & Hunger Relief",
+    "Health Equity & Wellness",
+    "Youth & Education Outreach"
+]
+
+SLIDE_SUBTYPES = {
+    "Program Reporting": [
+        "Impact Report",
+        "Annual Outcomes",
+        "Evaluation Summary"
+    ],
+    "Strategic Planning": [
+        "Vision & Mission Review",
+        "Roadmap Presentation"
+    ],
+    "Fundraising & Outreach": [
+        "Donor Pitch",
+        "Awareness Campaign",
+        "Community Outreach"
+    ],
+    "Partnership Engagement": [
+        "Joint Initiatives",
+        "Stakeholder Update"
+    ],
+    "Food Access & Hunger Relief": [
+        "Hunger Landscape Report",
+        "Regional Network Strategy",
+        "Advocacy & Public Policy"
+    ],
+    "Health Equity & Wellness": [
+        "Nutrition + Health Services Integration",
+        "Mental Health & Trauma Support"
+    ],
+    "Youth & Education Outreach": [
+        "School Nutrition Program",
+        "Community Learning Initiatives"
+    ]
+}
+
+SLIDE_QUESTIONS = {
+    "Impact Report": [
+        "What program or initiative are you reporting on?",
+        "What are the key outcomes or impact metrics?",
+        "Who is the target audience for this presentation?",
+        "What success stories or highlights would you like to include?",
+        "What challenges or lessons should be addressed?"
+    ],
+    "Annual Outcomes": [
+        "What were your organization's key accomplishments this year?",
+        "What data or KPIs do you want to showcase?",
+        "Who is the audience (e.g., board, public)?",
+        "Are there any standout achievements to emphasize?",
+        "Any improvements or goals for next year?"
+    ],
+    "Evaluation Summary": [
+        "What was the scope of the evaluation?",
+        "What methodologies or tools were used?",
+        "What key findings or trends emerged?",
+        "How are you using these insights?",
+        "What are the next steps?"
+    ],
+    "Donor Pitch": [
+        "What cause or program are you raising funds for?",
+        "What problem does your initiative solve?",
+        "Who benefits from your work?",
+        "What has been your impact so far?",
+        "What do you need support for next?"
+    ],
+    "Awareness Campaign": [
+        "What is the central theme or cause?",
+        "Who is the target audience for outreach?",
+        "What types of media or channels will be used?",
+        "What outcomes are you aiming for?",
+        "How are you measuring engagement or success?"
+    ],
+    "Community Outreach": [
+        "What neighborhood or community are you engaging?",
+        "What are the primary needs or concerns there?",
+        "How will your team connect with them?",
+        "What activities or materials will you include?",
+        "How will feedback or participation be captured?"
+    ],
+    "Vision & Mission Review": [
+        "What is your current mission and vision?",
+        "Why is there a need to revise or realign them?",
+        "What are your long-term goals?",
+        "Who are your core stakeholders?",
+        "How does this presentation fit into your strategic planning?"
+    ],
+    "Roadmap Presentation": [
+        "What major initiatives are on the horizon?",
+        "What milestones or phases are planned?",
+        "Who is responsible for what?",
+        "What risks or challenges are anticipated?",
+        "How will you track progress?"
+    ],
+    "Joint Initiatives": [
+        "Who are your partners or collaborators?",
+        "What shared goals are driving this initiative?",
+        "What resources or responsibilities are being shared?",
+        "What timelines or deliverables are expected?",
+        "How will success be evaluated collaboratively?"
+    ],
+    "Stakeholder Update": [
+        "Who is the stakeholder group you are updating?",
+        "What initiatives or progress should they know about?",
+        "What decisions or support do you need from them?",
+        "What risks or concerns should be surfaced?",
+        "What next steps or calls to action will you include?"
+    ],
+    "Hunger Landscape Report": [
+        "What regions or populations are covered in your report?",
+        "What are the most critical hunger metrics?",
+        "What are the root causes or contributing factors?",
+        "What stories or case studies illustrate the impact?",
+        "What policy or programmatic recommendations are included?"
+    ],
+    "Regional Network Strategy": [
+        "What is the scope of your regional food bank network?",
+        "What are the shared strategic priorities?",
+        "What infrastructure, logistics, or gaps are being addressed?",
+        "How are local agencies contributing to this vision?",
+        "What goals and metrics are being tracked collectively?"
+    ],
+    "Advocacy & Public Policy": [
+        "What issue or legislation are you advocating for?",
+        "How does it relate to food security or health equity?",
+        "Who are your coalition partners?",
+        "What outreach efforts or lobbying are underway?",
+        "What outcome or impact do you seek?"
+    ],
+    "Nutrition + Health Services Integration": [
+        "What health partners are involved?",
+        "What nutrition programs are being embedded or expanded?",
+        "How is patient screening or referral handled?",
+        "What are your health outcome goals?",
+        "How is data being collected and shared?"
+    ],
+    "Mental Health & Trauma Support": [
+        "What populations are affected by trauma or instability?",
+        "What services are being offered?",
+        "Who delivers these services and how are they trained?",
+        "What outcomes are expected for individuals served?",
+        "How is follow-up care or case management structured?"
+    ],
+    "School Nutrition Program": [
+        "What student group is being served?",
+        "What meals or resources are provided?",
+        "How does this fit within broader school services?",
+        "What are your nutritional or wellness benchmarks?",
+        "How is family engagement incorporated?"
+    ],
+    "Community Learning Initiatives": [
+        "What topics or skills are covered in the curriculum?",
+        "Who are the facilitators or educators?",
+        "What population is the initiative targeting?",
+        "How are workshops or sessions structured?",
+        "What success metrics are you using?"
+    ]
+}
+
+# --- Grant proposals ---
+GRANT_PURPOSES = [
+    "Health & Wellness",
+    "Youth Development & Education",
+    "Food & Basic Needs",
+    "Community Empowerment & Infrastructure"
+]
+
+GRANT_SUBTYPES = {
+    "Health & Wellness": [
+        "Mobile Clinics",
+        "Public Health Outreach",
+        "Caregiver Lodging",
+        "Trauma-Informed Services"
+    ],
+    "Youth Development & Education": [
+        "Preschool Programs",
+        "Creative Arts / Media",
+        "Juvenile Reentry",
+        "Youth Transitional Living"
+    ],
+    "Food & Basic Needs": [
+        "Urban Farming",
+        "Emergency Financial Relief"
+    ],
+    "Community Empowerment & Infrastructure": [
+        "Facility Upgrade",
+        "Neighborhood Revitalization",
+        "General Operating Support"
+    ]
+}
+
+GRANT_TEMPLATE_MAPPING = {
+    "Mobile Clinics": "IC-Grant-Application",
+    "Public Health Outreach": "IC-Grant-Application",
+    "Caregiver Lodging": "Non-Profit-Grant-Proposal",
+    "Trauma-Informed Services": "IC-Grant-Application",
+    "Preschool Programs": "Non-Profit-Grant-Proposal",
+    "Creative Arts / Media": "IC-Technology-Grant-Proposal",
+    "Juvenile Reentry": "IC-Grant-Application",
+    "Youth Transitional Living": "IC-Grant-Application",
+    "Urban Farming": "Generic-Grant-Proposal",
+    "Emergency Financial Relief": "Generic-Grant-Proposal",
+    "Facility Upgrade": "IC-Technology-Grant-Proposal",
+    "Neighborhood Revitalization": "IC-Grant-Application",
+    "General Operating Support": "Generic-Grant-Proposal"
+}
+
+GRANT_QUESTIONS = {
+    "IC-Grant-Application": [
+        "Summarize your project in 1–2 sentences.",
+        "What problem or need does this project address?",
+        "Who is the target population or community you will serve?",
+        "What are the main goals and measurable objectives?",
+        "How will you achieve these goals? Describe your approach.",
+        "How will you track progress and evaluate success?",
+        "What impact do you expect this project to have?",
+        "How will you ensure the project continues after the grant period?"
+    ],
+    "IC-Technology-Grant-Proposal": [
+        "Describe the core idea and vision for this technology project.",
+        "What educational or social issue is this project solving?",
+        "List the main goals and measurable outcomes for this year.",
+        "Who is the intended audience or user of this technology?",
+        "What makes this project sustainable and technically feasible?"
+    ],
+    "Non-Profit-Grant-Proposal": [
+        "What specific problem or issue are you addressing?",
+        "What are the key goals and expected outcomes?",
+        "Who is the target population you aim to serve?",
+        "What are the core activities you plan to undertake?",
+        "Who are the staff or team members involved, and what are their roles?"
+    ],
+    "Generic-Grant-Proposal": [
+        "Briefly describe your project’s main purpose.",
+        "Why is this project important — what need does it address?",
+        "What activities will be conducted as part of the project?",
+        "What are your main goals or milestones?",
+        "How will success be evaluated or measured?"
+    ]
+}
+
+
+def catalog_key(mode, *parts):
+    return "|".join([mode, *parts])
+
+
+def slide_catalog_entries():
+    """Yields (key, text) for every slide purpose/subtype with its questions."""
+    for purpose in SLIDE_PURPOSES:
+        for subtype in SLIDE_SUBTYPES.get(purpose, []):
+            text = "\n".join([purpose, subtype] + SLIDE_QUESTIONS.get(subtype, []))
+            yield catalog_key("slides", purpose, subtype), text
+
+
+def grant_catalog_entries(template_fields):
+    """Yields (key, text) for every grant template with its fields and questions."""
+    for template in sorted(set(GRANT_TEMPLATE_MAPPING.values())):
+        fields = [f.replace("_", " ") for f in template_fields.get(template, [])]
+        text = "\n".join([template.replace("-", " "), ", ".join(fields)] + GRANT_QUESTIONS.get(template, []))
+        yield catalog_key("grant", template), text
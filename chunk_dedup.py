@@ -0,0 +1,177 @@
+import os
+import re
+import sys
+import json
+import zlib
+import argparse
+from collections import defaultdict
+import numpy as np
+
+# ==================================================
+# Near-duplicate chunk elimination (MinHash + LSH)
+# ==================================================
+# Sits between splitting and embedding in text_retrieval.create_vector_db.
+# Each chunk gets a MinHash signature over its word shingles; LSH banding
+# finds earlier chunks that are likely similar, and the signature agreement
+# (an estimate of Jaccard similarity) decides. Chunks are only compared with
+# chunks of the same source: the metadata filter and the page join select by
+# source, so a chunk dropped for another document's copy would vanish from
+# them. Only the first chunk of a cluster is embedded; where its duplicates came from is saved next to the
+# FAISS files in dedup_provenance.json, keyed by the kept chunk's docstore id.
+# Kept chunks are embedded in the order the filter yields them, so the n-th
+# kept chunk is FAISS position n.
+
+PROVENANCE_FILENAME = "dedup_provenance.json"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))  # 0 disables dedup
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingles(text, size=5):
+    """Word n-gram shingles of normalized text, hashed to 32-bit ints."""
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.array(sorted({zlib.crc32(g.encode("utf-8")) for g in grams}), dtype=np.uint64)
+
+
+def choose_bands(num_perm, threshold):
+    """
+    Picks (bands, rows) with bands * rows == num_perm whose LSH threshold
+    (1/bands) ** (1/rows) is closest to the requested similarity.
+    """
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(options, key=lambda br: abs((1.0 / br[0]) ** (1.0 / br[1]) - threshold))
+
+
+def chunk_key(chunk):
+    metadata = chunk.metadata
+    return {"source": metadata.get("source_name") or metadata.get("source"), "page": metadata.get("page")}
+
+
+class NearDuplicateFilter:
+    """
+    Streaming MinHash/LSH filter. `filter(chunks)` yields the chunks to keep
+    and records every dropped chunk under the representative it matched.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=64, shingle_size=5, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, _MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, _MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self.buckets = [defaultdict(list) for _ in range(self.bands)]
+        self.signatures = []      # One per kept chunk
+        self.representatives = [] # chunk_key of each kept chunk; the list index is its FAISS position
+        self.duplicates = defaultdict(list)
+        self.seen = 0
+
+    def signature(self, text):
+        hashes = shingles(text, self.shingle_size)
+        # (a * x + b) mod p for every permutation and shingle; a, x < 2**32 so no uint64 overflow
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) % _MERSENNE_PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature, source):
+        # Keyed by source as well, so buckets never mix documents
+        return [(source, signature[i * self.rows:(i + 1) * self.rows].tobytes()) for i in range(self.bands)]
+
+    def match(self, signature, source=None):
+        """Returns (representative index, estimated similarity) among chunks of `source`, or (None, 0.0)."""
+        best, best_similarity = None, 0.0
+        candidates = set()
+        for band, key in zip(self.buckets, self._band_keys(signature, source)):
+            candidates.update(band.get(key, ()))
+        for index in candidates:
+            similarity = float(np.mean(self.signatures[index] == signature))
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = index, similarity
+        return best, best_similarity
+
+    def add(self, signature, key):
+        index = len(self.signatures)
+        self.signatures.append(signature)
+        self.representatives.append(key)
+        for band, band_key in zip(self.buckets, self._band_keys(signature, key["source"])):
+            band[band_key].append(index)
+        return index
+
+    def filter(self, chunks):
+        for chunk in chunks:
+            self.seen += 1
+            key = chunk_key(chunk)
+            signature = self.signature(chunk.page_content)
+            index, similarity = self.match(signature, key["source"])
+            if index is None:
+                self.add(signature, key)
+                yield chunk
+            else:
+                self.duplicates[index].append(dict(key, similarity=round(similarity, 3)))
+
+    @property
+    def dropped(self):
+        return self.seen - len(self.signatures)
+
+    def provenance(self, index_to_docstore_id):
+        return [
+            {
+                "kept": dict(self.representatives[index], position=index, docstore_id=index_to_docstore_id[index]),
+                "duplicates": duplicates,
+            }
+            for index, duplicates in sorted(self.duplicates.items())
+        ]
+
+    def save(self, folder, index_to_docstore_id):
+        """`index_to_docstore_id` is the FAISS store's, built from the chunks this filter kept."""
+        with open(os.path.join(folder, PROVENANCE_FILENAME), "w", encoding="utf-8") as f:
+            json.dump({
+                "threshold": self.threshold,
+                "num_perm": self.num_perm,
+                "chunks_seen": self.seen,
+                "chunks_dropped": self.dropped,
+                "clusters": self.provenance(index_to_docstore_id),
+            }, f, indent=2)
+
+
+def load_provenance(folder):
+    """Maps the docstore id of each kept chunk to the near-duplicates it stands for."""
+    path = os.path.join(folder, PROVENANCE_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    # Files written before chunks were keyed by docstore id have no usable key
+    return {
+        cluster["kept"]["docstore_id"]: cluster["duplicates"]
+        for cluster in data.get("clusters", []) if "docstore_id" in cluster["kept"]
+    }
+
+
+# ==================================================
+# CLI
+# ==================================================
+def main():
+    parser = argparse.ArgumentParser(description="Show which chunks were dropped as near-duplicates.")
+    parser.add_argument("--db_root", required=True, help="Store root (FAISS_DB_PATH or a tenant folder)")
+    parser.add_argument("--limit", type=int, default=20, help="Largest clusters to print")
+    args = parser.parse_args()
+
+    from snapshot_store import current_snapshot_path
+    folder = current_snapshot_path(args.db_root) or args.db_root
+    provenance = load_provenance(folder)
+    if not provenance:
+        sys.exit(f"No near-duplicate provenance in {folder}.")
+    print(f"{sum(len(d) for d in provenance.values())} chunks dropped into {len(provenance)} kept chunks.")
+    for docstore_id, duplicates in sorted(provenance.items(), key=lambda item: -len(item[1]))[:args.limit]:
+        sources = ", ".join(f"{d['source']} p.{d['page']}" for d in duplicates[:5])
+        print(f"{docstore_id}: {len(duplicates)} duplicates ({sources}{', ...' if len(duplicates) > 5 else ''})")
+
+
+if __name__ == "__main__":
+    main()
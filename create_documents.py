@@ -1,14 +1,28 @@
 import os
 import json
-from pptx import Presentation
-from pptx.util import Inches
+import shutil
 from text_retrieval import create_vector_db
 from image_retrieval import convert_pdfs_to_images, load_existing_image_mappings
-from Chatbot.Mistral_7b import retrieve_faiss, retrieve_context
+from Chatbot.retrieval import retrieve_faiss, retrieve_context
 from transformers import pipeline, AutoProcessor
 from byaldi import RAGMultiModalModel
 from bedrock_handler import call_claude
-from docx import Document
+from bedrock_pool import DeadlineExceeded
+from json_repair import parse_slides, parse_grant
+from document_renderer import render_presentation, render_presentations, render_grant, save_buffer
+from page_join import join_cross_modal, get_colpali_file_names, get_colpali_page_count
+from page_triage import triage_page
+from warm_cache import get_warm_entry, warm_candidates, merge_candidates, merge_pages
+from catalog import catalog_key
+from prefetch import reuse_prefetched_stages
+from metadata_filter import resolve_filter_ids, matching_sources
+from tenant_store import TenantStoreCache, tenant_paths, tenant_image_paths, DEFAULT_TENANT
+from snapshot_store import build_snapshot, current_version, lease_current_snapshot, release_lease
+from job_service import update_status, CancellationToken, JobCancelled
+from job_checkpoint import (
+    JobCheckpoint, serialize_documents, deserialize_documents,
+    serialize_colpali_results, deserialize_colpali_results
+)
 from typing import Dict, List
 
 
@@ -54,22 +68,63 @@ def index_documents_if_needed(model, data_path, index_name, force_reindex=False)
 # 3. Vector Database Creation/Loading Caching
 # ==================================================
 def create_or_load_vector_db(data_path, faiss_db_path, force_rebuild=False):
-    if force_rebuild or not os.path.exists(faiss_db_path) or not os.listdir(faiss_db_path):
+    # Builds go into a new versioned snapshot and are published by an atomic
+    # pointer swap, so concurrent readers never see a half-written index.
+    # The snapshot is leased (and CURRENT re-checked) before it is opened, so
+    # garbage collection cannot remove it underneath this process.
+    snapshot_path, lease = (None, None) if force_rebuild else lease_current_snapshot(faiss_db_path)
+    if snapshot_path is None:
         os.makedirs(faiss_db_path, exist_ok=True)
-        create_vector_db(data_path, faiss_db_path)
+        build_snapshot(data_path, faiss_db_path, create_vector_db)
+        snapshot_path, lease = lease_current_snapshot(faiss_db_path)
         print("Vector database created.")
     else:
         print("Using existing vector database.")
 
-    db = retrieve_faiss(faiss_db_path)
-
-    if hasattr(db, "index") and hasattr(db.index, "ntotal"):
-        print(f"[INFO] FAISS DB contains {db.index.ntotal} vectors.")
-        if db.index.ntotal == 0:
-            raise ValueError("FAISS index is empty. Re-index with non-empty PDFs.")
+    try:
+        db = retrieve_faiss(snapshot_path)
+        db._snapshot_version = None if snapshot_path == faiss_db_path else os.path.basename(snapshot_path)
+        db._snapshot_path = snapshot_path
+        db._snapshot_lease = lease
+
+        if hasattr(db, "index") and hasattr(db.index, "ntotal"):
+            print(f"[INFO] FAISS DB contains {db.index.ntotal} vectors.")
+            if db.index.ntotal == 0:
+                raise ValueError("FAISS index is empty. Re-index with non-empty PDFs.")
+    except BaseException:
+        release_lease(lease)
+        raise
 
     return db
 
+def release_tenant_db(db):
+    """
+    Called once a store is evicted or replaced by a newer snapshot and its
+    last holder is done with it; lets GC collect its snapshot.
+    """
+    release_lease(getattr(db, "_snapshot_lease", None))
+    if hasattr(db, "index") and hasattr(db.index, "close"):
+        # Sharded stores hold connections to the shard workers
+        db.index.close()
+
+def load_tenant_db(tenant_id):
+    data_path, faiss_db_path = tenant_paths(tenant_id, DATA_PATH, FAISS_DB_PATH)
+    return create_or_load_vector_db(data_path, faiss_db_path, force_rebuild=False)
+
+def tenant_snapshot_version(tenant_id):
+    return current_version(tenant_paths(tenant_id, DATA_PATH, FAISS_DB_PATH)[1])
+
+# Loaded stores are kept per tenant so a long-running process only holds the
+# most recently used corpora in memory. A newly published snapshot is picked
+# up on the next request without restarting.
+tenant_stores = TenantStoreCache(
+    load_tenant_db,
+    max_stores=int(os.getenv("TENANT_STORE_MAX", "4")),
+    max_bytes=int(os.environ["TENANT_STORE_MAX_BYTES"]) if os.getenv("TENANT_STORE_MAX_BYTES") else None,
+    version_fn=tenant_snapshot_version,
+    on_evict=release_tenant_db
+)
+
 # ==================================================
 # 4. Model and Pipeline Initialization (Without Caching)
 # ==================================================
@@ -83,12 +138,43 @@ def initialize_models():
 # ==================================================
 # 5. Text Context Retrieval
 # ==================================================
-def retrieve_text_context(slide_headings_text, db, docs_retrieval_model):
-    text_context = retrieve_context(slide_headings_text, db)
-    colpali_docs = docs_retrieval_model.search(slide_headings_text, k=3)
+def retrieve_text_context(slide_headings_text, db, docs_retrieval_model, metadata_filter=None, warm_entry=None,
+                          page_query=None):
+    doc_id_to_file = get_colpali_file_names(docs_retrieval_model)
+    # Keep ColPali pages (and precomputed candidates) inside the same document scope as the text hits
+    allowed_files = matching_sources(db, resolve_filter_ids(db, metadata_filter)) if metadata_filter else None
+
+    text_context, colpali_docs = [], []
+    if slide_headings_text.strip():
+        text_context = retrieve_context(slide_headings_text, db, metadata_filter=metadata_filter)
+    page_query = page_query or slide_headings_text
+    if page_query.strip():
+        if allowed_files is not None:
+            # ColPali scores every indexed page for a query anyway, so ranking all of them
+            # and keeping the in-scope ones never misses a page that a top-10 cut would
+            n_pages = get_colpali_page_count(docs_retrieval_model) or 10
+            colpali_docs = [
+                r for r in docs_retrieval_model.search(page_query, k=n_pages)
+                if doc_id_to_file.get(int(r.doc_id)) in allowed_files
+            ][:3]
+        else:
+            colpali_docs = docs_retrieval_model.search(page_query, k=3)
+
+    if warm_entry:
+        # The catalog part of the request was retrieved offline for this snapshot (see warm_cache)
+        warm_docs, warm_pages = warm_candidates(warm_entry, doc_id_to_file, allowed_files)
+        text_context = merge_candidates(text_context, warm_docs)
+        colpali_docs = merge_pages(colpali_docs, warm_pages)
 
     if not colpali_docs:
-        raise ValueError("No documents retrieved by Colpali. Try revising the input content.")
+        if allowed_files is None:
+            raise ValueError("No documents retrieved by Colpali. Try revising the input content.")
+        # The scope may hold text-only files; continue without page images
+        print("[WARN] No ColPali pages inside the metadata filter; continuing without image context.")
+
+    # Link both result sets on (document, page): page hits pull their own text
+    # chunks, and text hits boost the pages they came from.
+    text_context, colpali_docs = join_cross_modal(text_context, colpali_docs, db, doc_id_to_file)
 
     return text_context, colpali_docs
 
@@ -106,31 +192,139 @@ def generate_image_description(img, pipe, processor):
     outputs = pipe(img, prompt=prompt, generate_kwargs={"max_new_tokens": 200})
     return outputs[0]["generated_text"].split("ASSISTANT:")[-1].strip()
 
-def get_combined_image_context(colpali_docs, all_images, pipe, processor):
+def get_combined_image_context(colpali_docs, all_images, pipe, processor, cancel_token=None,
+                               doc_id_to_file=None, query=None, data_path=DATA_PATH):
+    """
+    Describes each ColPali page. When the page's PDF is known (`doc_id_to_file`),
+    text-dominant pages are summarized from their text layer and only
+    figure-heavy pages are captioned by LLaVA (see page_triage).
+    """
     image_contexts = []
     image_path_map = {}
+    captioned = summarized = 0
     for idx, result in enumerate(colpali_docs):
+        if cancel_token:
+            cancel_token.check("captions")
         doc_id, page_num = result.doc_id, result.page_num
         image_files = all_images.get(doc_id, [])
         if page_num - 1 < len(image_files):
             img_path = image_files[page_num - 1]
-            description = generate_image_description(img_path, pipe, processor)
+            file_name = (doc_id_to_file or {}).get(int(doc_id))
+            pdf_path = os.path.join(data_path, file_name) if file_name else None
+            kind, summary = triage_page(pdf_path, page_num - 1, query=query)
+            if kind == "text":
+                description = summary
+                summarized += 1
+            else:
+                description = generate_image_description(img_path, pipe, processor)
+                captioned += 1
             image_contexts.append(description)
             image_path_map[idx] = img_path  # Associate slide index with image path
 
+    print(f"[INFO] Page descriptions: {captioned} captioned by LLaVA, {summarized} summarized from text.")
     return " ".join(image_contexts), image_path_map
 
 # ==================================================
 # 7. Slide JSON Generation via Claude
 # ==================================================
-def generate_slides_json(structured_input, text_context, image_context):
-    slides_json = call_claude(
-        query_or_answers=structured_input,
-        context=text_context,
-        image_context=image_context,
-        mode="slides"
-    )
-    return json.loads(slides_json)
+def ask_claude(cancel_token, stage, **kwargs):
+    """
+    call_claude bounded by the job's deadline. A call abandoned because the
+    deadline passed stops the job as cancelled, not as a failure.
+    """
+    try:
+        return call_claude(deadline=cancel_token.deadline if cancel_token else None, **kwargs)
+    except DeadlineExceeded as e:
+        job_id = cancel_token.job_id if cancel_token else None
+        raise JobCancelled(f"Job {job_id} stopped during '{stage}': deadline exceeded") from e
+
+
+def generate_slides_json(structured_input, text_context, image_context, checkpoint=None, cancel_token=None):
+    if checkpoint and checkpoint.has("llm_output"):
+        slides_json = checkpoint.load("llm_output")["text"]
+    else:
+        slides_json = ask_claude(
+            cancel_token, "llm",
+            query_or_answers=structured_input,
+            context=text_context,
+            image_context=image_context,
+            mode="slides",
+            raw_output_path=checkpoint.path("llm_raw.txt") if checkpoint else None,
+            job_id=checkpoint.job_id if checkpoint else None
+        )
+        if checkpoint:
+            checkpoint.save("llm_output", {"text": slides_json})
+
+    slides, report = parse_slides(slides_json)
+    if report["truncated"] or report["repairs"] or report["incomplete_slides"]:
+        print(f"[WARN] Slide JSON repaired: {json.dumps(report)}")
+    if (report["truncated"] or report["incomplete_slides"]) and not (cancel_token and cancel_token.cancelled_reason()):
+        slides = request_missing_slides(structured_input, text_context, image_context, slides, report,
+                                        checkpoint=checkpoint, cancel_token=cancel_token)
+    if not slides:
+        raise ValueError("No complete slides could be recovered from the Claude output.")
+    return slides
+
+
+def request_missing_slides(structured_input, text_context, image_context, slides, report,
+                           checkpoint=None, cancel_token=None):
+    """
+    Asks once more for what the first reply lacked: the slides listed as
+    incomplete, and the rest of the deck when the reply was cut off. Returned
+    slides replace incomplete ones by id; new ids are appended in order.
+    """
+    instructions = []
+    if report["incomplete_slides"]:
+        instructions.append(
+            "Return these slides again, complete, with the same ids: "
+            + json.dumps(report["incomplete_slides"])
+        )
+    if report["truncated"]:
+        done = [s.get("title_text") or s.get("section_title") for s in slides]
+        instructions.append(
+            f"The previous answer was cut off after {len(slides)} slides ({json.dumps(done)}). "
+            f"Continue the deck from slide-{len(slides)}; do not repeat earlier slides."
+        )
+    print(f"[INFO] Requesting missing slides: {' '.join(instructions)}")
+    try:
+        retry_json = ask_claude(
+            cancel_token, "llm retry",
+            query_or_answers=dict(structured_input, instructions=" ".join(instructions)),
+            context=text_context,
+            image_context=image_context,
+            mode="slides",
+            raw_output_path=checkpoint.path("llm_raw_missing_slides.txt") if checkpoint else None,
+            job_id=checkpoint.job_id if checkpoint else None
+        )
+    except JobCancelled:
+        raise
+    except Exception as e:
+        # The retry is best effort: keep the slides already recovered
+        print(f"[WARN] Missing-slide retry failed: {type(e).__name__}: {e}")
+        return slides
+    try:
+        extra_slides, retry_report = parse_slides(retry_json)
+    except ValueError as e:
+        print(f"[WARN] Could not parse missing-slide retry: {e}")
+        return slides
+
+    by_id = {s.get("id"): i for i, s in enumerate(slides)}
+    for slide in extra_slides:
+        if slide.get("id") in retry_report["incomplete_slides"]:
+            continue  # Still incomplete; keep whatever the first reply had
+        if slide.get("id") in by_id:
+            slides[by_id[slide.get("id")]] = slide
+        else:
+            by_id[slide.get("id")] = len(slides)
+            slides.append(slide)
+    still_incomplete = [
+        i for i in report["incomplete_slides"]
+        if i not in retry_report["recovered_slides"] or i in retry_report["incomplete_slides"]
+    ]
+    if still_incomplete or retry_report["truncated"]:
+        print(f"[WARN] Slides still incomplete after retry: {still_incomplete}; "
+              f"retry truncated: {retry_report['truncated']}")
+    return slides
 
 # ==================================================
 # 8. PowerPoint Presentation Creation
@@ -148,41 +342,9 @@ def create_presentation_from_json(json_slides, output_folder, image_path_map=Non
     Returns:
         str: Path to generated presentation.
     """
-    prs = Presentation()
-
-    for slide in json_slides:
-        is_title = slide.get("is_title_slide") == "yes"
-        layout = prs.slide_layouts[0] if is_title else prs.slide_layouts[1]
-        s = prs.slides.add_slide(layout)
-
-        # --- Title Slide ---
-        if is_title:
-            s.shapes.title.text = slide.get("title_text", "")
-            if len(s.placeholders) > 1:
-                s.placeholders[1].text = slide.get("subtitle_text", "")
-
-        # --- Content Slide ---
-        else:
-            s.shapes.title.text = slide.get("title_text", "")
-            if len(s.placeholders) > 1:
-                body = s.placeholders[1].text_frame
-                body.clear()
-                for bullet in slide.get("text", []):
-                    p = body.add_paragraph()
-                    p.text = bullet
-                    p.level = 0
-
-            # --- Image Insertion ---
-            image_index = slide.get("image_index")
-            if image_path_map and image_index is not None:
-                img_path = image_path_map.get(image_index)
-                if img_path and os.path.exists(img_path):
-                    # You can adjust placement here
-                    s.shapes.add_picture(img_path, Inches(5.5), Inches(1.5), width=Inches(3))
-
-    os.makedirs(output_folder, exist_ok=True)
-    output_path = os.path.join(output_folder, "Generated_Presentation.pptx")
-    prs.save(output_path)
+    # Rendered in memory from the cached base template (see document_renderer)
+    buffer = render_presentation(json_slides, image_path_map)
+    output_path = save_buffer(buffer, os.path.join(output_folder, "Generated_Presentation.pptx"))
     print(f"Presentation saved to {output_path}")
     return output_path
 
@@ -200,73 +362,101 @@ def create_universal_grant_docx(
     if not output_filename.endswith(".docx"):
         output_filename += ".docx"
 
-    doc = Document()
-    doc.add_heading(title, level=0)
-
-    roman_numerals = [
-        "I", "II", "III", "IV", "V", "VI", "VII",
-        "VIII", "IX", "X", "XI", "XII", "XIII", "XIV"
-    ]
-    ordered_fields = field_ordering.get(template_name, [])
-
-    for idx, field_key in enumerate(ordered_fields):
-        content = filled_fields.get(field_key, "")
-        if not content:
-            continue
-
-        section_num = roman_numerals[idx] if idx < len(roman_numerals) else str(idx + 1)
-        section_title = field_key.replace("_", " ").title()
-
-        doc.add_heading(f"{section_num}. {section_title}", level=1)
-
-        if isinstance(content, str):
-            doc.add_paragraph(content)
-        elif isinstance(content, list):
-            for item in content:
-                if isinstance(item, dict):
-                    for k, v in item.items():
-                        doc.add_paragraph(k.replace("_", " ").title(), style="Heading 2")
-                        doc.add_paragraph(str(v))
-        elif isinstance(content, dict):
-            for k, v in content.items():
-                doc.add_paragraph(k.replace("_", " ").title(), style="Heading 2")
-                doc.add_paragraph(str(v))
-
-    doc.save(output_filename)
-    return os.path.abspath(output_filename)
+    buffer = render_grant(field_ordering.get(template_name, []), filled_fields, title=title)
+    return save_buffer(buffer, output_filename)
 
 # ==================================================
-# MAIN SLIDE GENERATION FUNCTION
+# 10. Checkpointed Retrieval & Captioning Stages
 # ==================================================
-def generate_slides_from_headings(structured_input):
-    all_images, file_names = convert_pdfs_if_needed(DATA_PATH, IMAGES_FOLDER)
+def gather_context(checkpoint, query_string, payload, cancel_token, warm_key=None, free_text=None):
+    """
+    Runs retrieval and captioning, or loads them from the job checkpoint.
+    Models are only initialized when a stage actually has to run, and the
+    cancellation token is checked before each expensive step.
+    When the snapshot has precomputed candidates for `warm_key`, only
+    `free_text` is searched live and merged with them.
+    Returns (text_context, image_context, image_path_map).
+    """
+    if checkpoint.has("retrieval") and checkpoint.has("captions"):
+        retrieval = checkpoint.load("retrieval")
+        captions = checkpoint.load("captions")
+        print(f"[INFO] Job {checkpoint.job_id}: reusing retrieval and captions.")
+        image_path_map = {int(k): v for k, v in captions["image_path_map"].items()}
+        return deserialize_documents(retrieval["text_context"]), captions["image_context"], image_path_map
+
+    update_status(checkpoint.job_id, "running", stage="loading_models")
+    cancel_token.check("rasterization")
+    # Page images, the ColPali index and the PDFs for triage all come from the tenant's own corpus
+    tenant_id = payload.get("tenant", DEFAULT_TENANT)
+    data_path, _ = tenant_paths(tenant_id, DATA_PATH, FAISS_DB_PATH)
+    images_folder, image_index_name = tenant_image_paths(tenant_id, IMAGES_FOLDER)
+    all_images, _ = convert_pdfs_if_needed(data_path, images_folder)
+    cancel_token.check("loading_models")
     docs_retrieval_model, pipe, processor = initialize_models()
-    docs_retrieval_model = index_documents_if_needed(docs_retrieval_model, DATA_PATH, "image_index", force_reindex=True)
-    db = create_or_load_vector_db(DATA_PATH, FAISS_DB_PATH, force_rebuild=False)
 
+    if checkpoint.has("retrieval"):
+        retrieval = checkpoint.load("retrieval")
+        text_context = deserialize_documents(retrieval["text_context"])
+        colpali_docs = deserialize_colpali_results(retrieval["colpali_docs"])
+        doc_id_to_file = {int(k): v for k, v in retrieval.get("doc_id_to_file", {}).items()}
+    else:
+        update_status(checkpoint.job_id, "running", stage="retrieval")
+        cancel_token.check("indexing")
+        docs_retrieval_model = index_documents_if_needed(docs_retrieval_model, data_path, image_index_name, force_reindex=True)
+        cancel_token.check("retrieval")
+        # Held until retrieval is done: an eviction meanwhile cannot close the store under us
+        with tenant_stores.hold(tenant_id) as db:
+            warm_entry = get_warm_entry(db, warm_key) if warm_key else None
+            if warm_entry:
+                print(f"[INFO] Using precomputed candidates for '{warm_key}'.")
+            text_context, colpali_docs = retrieve_text_context(
+                free_text if warm_entry and free_text is not None else query_string,
+                db, docs_retrieval_model, metadata_filter=payload.get("filters"), warm_entry=warm_entry,
+                # Warm-ups built without ColPali pages still need the full query for the page search
+                page_query=query_string if warm_entry and not warm_entry.get("pages") else None
+            )
+        doc_id_to_file = get_colpali_file_names(docs_retrieval_model)
+        checkpoint.save("retrieval", {
+            "text_context": serialize_documents(text_context),
+            "colpali_docs": serialize_colpali_results(colpali_docs),
+            "doc_id_to_file": doc_id_to_file
+        })
+    print("Retrieved Colpali docs:", len(colpali_docs))
+
+    update_status(checkpoint.job_id, "running", stage="captions")
+    image_context, image_path_map = get_combined_image_context(
+        colpali_docs, all_images, pipe, processor, cancel_token=cancel_token,
+        doc_id_to_file=doc_id_to_file, query=query_string, data_path=data_path
+    )
+    image_path_map = {idx: page_image_path(image, checkpoint, idx) for idx, image in image_path_map.items()}
+    checkpoint.save("captions", {"image_context": image_context, "image_path_map": image_path_map})
+    return text_context, image_context, image_path_map
+
+
+def page_image_path(image, checkpoint, idx):
+    """
+    Checkpoints hold file paths. Right after rasterization the pages are PIL
+    images, which are saved into the job folder.
+    """
+    if isinstance(image, (str, os.PathLike)):
+        return os.fspath(image)
+    path = checkpoint.path(f"page_image_{idx}.png")
+    image.save(path, "PNG")
+    return path
+
+
+def slide_retrieval_inputs(structured_input):
+    """Returns (query_string, warm_key, free_text) for a slides payload."""
     purpose = structured_input.get("category", "")
     subtype = structured_input.get("subtype", "")
     answers = structured_input.get("answers", {})
 
     query_string = f"{purpose}\n{subtype}\n" + "\n".join(answers.values())
+    return query_string, catalog_key("slides", purpose, subtype), "\n".join(answers.values())
 
-    text_context, colpali_docs = retrieve_text_context(query_string, db, docs_retrieval_model)
-    image_context, image_path_map = get_combined_image_context(colpali_docs, all_images, pipe, processor)
-
-    slides_data = generate_slides_json(structured_input, text_context, image_context)
-    output_path = create_presentation_from_json(slides_data, OUTPUT_FOLDER, image_path_map=image_path_map)
-    return output_path
-
-
-# ==================================================
-# MAIN GRANT JSON GENERATION FUNCTION
-# ==================================================
-def generate_grant_from_inputs(user_prompt_json):
-    all_images, _ = convert_pdfs_if_needed(DATA_PATH, IMAGES_FOLDER)
-    docs_retrieval_model, pipe, processor = initialize_models()
-    docs_retrieval_model = index_documents_if_needed(docs_retrieval_model, DATA_PATH, "image_index", force_reindex=True)
-    db = create_or_load_vector_db(DATA_PATH, FAISS_DB_PATH, force_rebuild=False)
 
+def grant_retrieval_inputs(user_prompt_json):
+    """Returns (query_string, warm_key, free_text) for a grant payload."""
     field_values = list(user_prompt_json.get("fields", {}).values())
 
     if not field_values or all(v == "" for v in field_values):
@@ -279,14 +469,125 @@ def generate_grant_from_inputs(user_prompt_json):
 
     if not query_string.strip():
         raise ValueError("Query string for retrieval is empty.")
+    return query_string, catalog_key("grant", user_prompt_json.get("template_name", "")), query_string
 
-    print("[DEBUG] Query string preview:", query_string[:200])
 
-    text_context, colpali_docs = retrieve_text_context(query_string, db, docs_retrieval_model)
-    print("Query string:", query_string[:200])
-    print("Retrieved Colpali docs:", len(colpali_docs))
+def prefetch_context(mode, payload, job_id):
+    """
+    Speculative job (see prefetch.py): runs only retrieval and captioning so
+    the real job can copy the checkpoints.
+    """
+    checkpoint = JobCheckpoint(job_id)
+    cancel_token = CancellationToken(job_id, deadline=payload.get("deadline"))
+    inputs = slide_retrieval_inputs(payload) if mode == "slides" else grant_retrieval_inputs(payload)
+    query_string, warm_key, free_text = inputs
+    gather_context(checkpoint, query_string, payload, cancel_token, warm_key=warm_key, free_text=free_text)
+    return checkpoint
 
-    image_context, _ = get_combined_image_context(colpali_docs, all_images, pipe, processor)
+
+def load_finished_output(checkpoint):
+    if checkpoint.has("output"):
+        output_path = checkpoint.load("output")["path"]
+        if os.path.exists(output_path):
+            print(f"[INFO] Job {checkpoint.job_id} already finished: {output_path}")
+            return output_path
+    return None
+
+
+def clean_up_cancelled_job(checkpoint):
+    """
+    Removes the partial output of a cancelled job and any half-written
+    checkpoint. Finished stage checkpoints, page images and raw LLM replies
+    are kept, so `run_generation.py --job_id <id> --no_deadline` resumes it.
+    """
+    shutil.rmtree(job_output_folder(checkpoint), ignore_errors=True)
+    for name in os.listdir(checkpoint.dir):
+        if name.endswith(".tmp"):
+            os.remove(checkpoint.path(name))
+
+
+def job_output_folder(checkpoint):
+    # Every job renders into its own folder, so concurrent users never
+    # overwrite each other and a stale file is never mistaken for a result.
+    return os.path.join(OUTPUT_FOLDER, checkpoint.job_id)
+
+# ==================================================
+# MAIN SLIDE GENERATION FUNCTION
+# ==================================================
+def prepare_slides(checkpoint, structured_input):
+    """Runs every stage before rendering; returns (slides_data, image_path_map)."""
+    cancel_token = CancellationToken(checkpoint.job_id, deadline=structured_input.get("deadline"))
+
+    if checkpoint.has("parsed"):
+        slides_data = checkpoint.load("parsed")
+        image_path_map = {int(k): v for k, v in checkpoint.load("captions")["image_path_map"].items()}
+    else:
+        reuse_prefetched_stages(checkpoint, "slides", structured_input, cancel_token)
+        query_string, warm_key, free_text = slide_retrieval_inputs(structured_input)
+        text_context, image_context, image_path_map = gather_context(
+            checkpoint, query_string, structured_input, cancel_token, warm_key=warm_key, free_text=free_text
+        )
+        update_status(checkpoint.job_id, "running", stage="llm")
+        cancel_token.check("llm")
+        slides_data = generate_slides_json(
+            structured_input, text_context, image_context, checkpoint=checkpoint, cancel_token=cancel_token
+        )
+        checkpoint.save("parsed", slides_data)
+
+    update_status(checkpoint.job_id, "running", stage="rendering")
+    cancel_token.check("rendering")
+    return slides_data, image_path_map
+
+def generate_slides_from_headings(structured_input, job_id=None, restart_from=None):
+    checkpoint = JobCheckpoint(job_id or structured_input.get("job_id"), restart_from=restart_from)
+    print(f"[INFO] Slide job id: {checkpoint.job_id}")
+    finished = load_finished_output(checkpoint)
+    if finished:
+        return finished
+    slides_data, image_path_map = prepare_slides(checkpoint, structured_input)
+    output_path = create_presentation_from_json(slides_data, job_output_folder(checkpoint), image_path_map=image_path_map)
+    checkpoint.save("output", {"path": output_path})
+    return output_path
+
+def generate_slide_batch(jobs):
+    """
+    Bulk mode for batch submissions: runs each job up to its parsed slides,
+    then renders every deck in one pass with render_presentations. `jobs` is
+    a list of (structured_input, job_id). Returns {job_id: output path or the
+    exception that stopped the job}; one failing job does not stop the batch.
+    """
+    results, prepared = {}, []
+    for structured_input, job_id in jobs:
+        try:
+            checkpoint = JobCheckpoint(job_id)
+            finished = load_finished_output(checkpoint)
+            if finished:
+                results[job_id] = finished
+                continue
+            update_status(job_id, "running", mode="slides", stage="starting")
+            prepared.append((checkpoint, *prepare_slides(checkpoint, structured_input)))
+        except Exception as e:
+            results[job_id] = e
+
+    buffers = render_presentations((slides_data, image_path_map) for _, slides_data, image_path_map in prepared)
+    for (checkpoint, _, _), buffer in zip(prepared, buffers):
+        output_path = save_buffer(buffer, os.path.join(job_output_folder(checkpoint), "Generated_Presentation.pptx"))
+        checkpoint.save("output", {"path": output_path})
+        results[checkpoint.job_id] = output_path
+    print(f"[INFO] Batch: rendered {len(prepared)} decks in one pass; {len(results)} jobs done.")
+    return results
+
+
+# ==================================================
+# MAIN GRANT JSON GENERATION FUNCTION
+# ==================================================
+def generate_grant_from_inputs(user_prompt_json, job_id=None, restart_from=None):
+    checkpoint = JobCheckpoint(job_id or user_prompt_json.get("job_id"), restart_from=restart_from)
+    cancel_token = CancellationToken(checkpoint.job_id, deadline=user_prompt_json.get("deadline"))
+    print(f"[INFO] Grant job id: {checkpoint.job_id}")
+    finished = load_finished_output(checkpoint)
+    if finished:
+        return finished
 
     template_name = user_prompt_json.get("template_name", "")
     if not template_name:
@@ -295,32 +596,86 @@ def generate_grant_from_inputs(user_prompt_json):
     with open("template_fields.json") as f:
         template_fields = json.load(f)
 
-    output_json = call_claude(
-        query_or_answers=user_prompt_json["fields"],
-        template_name=template_name,
-        template_fields=template_fields,
-        context=text_context,
-        image_context=image_context,
-        mode="grant",
-        debug=os.getenv("DEBUG", "False") == "True"
-    )
-
-    if not output_json:
-        raise ValueError("Claude did not return any output. Please retry.")
-
-    try:
-        filled_fields = json.loads(output_json)
-    except json.JSONDecodeError as e:
-        print("[ERROR] JSON decode failed. Raw response:")
-        print(output_json)
-        raise e
-
+    if checkpoint.has("parsed"):
+        filled_fields = checkpoint.load("parsed")
+    else:
+        query_string, warm_key, free_text = grant_retrieval_inputs(user_prompt_json)
+        print("[DEBUG] Query string preview:", query_string[:200])
+
+        reuse_prefetched_stages(checkpoint, "grant", user_prompt_json, cancel_token)
+        text_context, image_context, _ = gather_context(
+            checkpoint, query_string, user_prompt_json, cancel_token, warm_key=warm_key, free_text=free_text
+        )
+
+        update_status(checkpoint.job_id, "running", stage="llm")
+        cancel_token.check("llm")
+        if checkpoint.has("llm_output"):
+            output_json = checkpoint.load("llm_output")["text"]
+        else:
+            output_json = ask_claude(
+                cancel_token, "llm",
+                query_or_answers=user_prompt_json["fields"],
+                template_name=template_name,
+                template_fields=template_fields,
+                context=text_context,
+                image_context=image_context,
+                mode="grant",
+                debug=os.getenv("DEBUG", "False") == "True",
+                raw_output_path=checkpoint.path("llm_raw.txt"),
+                job_id=checkpoint.job_id
+            )
+
+            if not output_json:
+                raise ValueError("Claude did not return any output. Please retry.")
+            checkpoint.save("llm_output", {"text": output_json})
+
+        expected_fields = template_fields.get(template_name, [])
+        filled_fields, missing, report = parse_grant(output_json, expected_fields)
+        if report["truncated"] or report["repairs"]:
+            print(f"[WARN] Grant JSON repaired: {json.dumps(report)}")
+
+        if missing and cancel_token.cancelled_reason() is None:
+            # Ask again for the missing fields only, instead of regenerating everything
+            print(f"[INFO] Requesting {len(missing)} missing field(s): {missing}")
+            try:
+                retry_json = ask_claude(
+                    cancel_token, "llm retry",
+                    query_or_answers=user_prompt_json["fields"],
+                    template_name=template_name,
+                    template_fields={template_name: missing},
+                    context=text_context,
+                    image_context=image_context,
+                    mode="grant",
+                    raw_output_path=checkpoint.path("llm_raw_missing_fields.txt"),
+                    job_id=checkpoint.job_id
+                )
+            except JobCancelled:
+                raise
+            except Exception as e:
+                # The retry is best effort: render the fields already filled
+                print(f"[WARN] Missing-field retry failed: {type(e).__name__}: {e}")
+                retry_json = None
+            if retry_json is not None:
+                try:
+                    extra_fields, still_missing, _ = parse_grant(retry_json, missing)
+                    filled_fields.update({k: v for k, v in extra_fields.items() if k in missing})
+                    if still_missing:
+                        print(f"[WARN] Fields still missing after retry: {still_missing}")
+                except ValueError as e:
+                    print(f"[WARN] Could not parse missing-field retry: {e}")
+
+        checkpoint.save("parsed", filled_fields)
+
+    update_status(checkpoint.job_id, "running", stage="rendering")
+    cancel_token.check("rendering")
+    os.makedirs(job_output_folder(checkpoint), exist_ok=True)
     docx_path = create_universal_grant_docx(
         template_name=template_name,
         field_ordering=template_fields,
         filled_fields=filled_fields,
         title="GRANT PROPOSAL",
-        output_filename="Final_Grant_Proposal.docx"
+        output_filename=os.path.join(job_output_folder(checkpoint), "Final_Grant_Proposal.docx")
     )
+    checkpoint.save("output", {"path": docx_path})
 
     return docx_path
@@ -0,0 +1,160 @@
+import os
+import io
+import threading
+from pptx import Presentation
+from pptx.util import Inches
+from docx import Document
+from render_assets import display_image_path
+
+# ==================================================
+# In-memory document rendering with cached base templates
+# ==================================================
+# Base templates are read from disk (or produced from the library default)
+# once per process and kept as bytes. Each job deserializes its own copy from
+# memory, since python-pptx and python-docx objects cannot be safely shared
+# or deep-copied, and renders into a BytesIO. Generation runs in the worker
+# process (scheduler or tmux pane), not in the app, so the buffer is still
+# written to the job's output folder and the app reads it back from there.
+# Interactive jobs get one process each, so the cached template pays off in
+# batch runs, where one process renders every deck of the batch.
+
+PPTX_TEMPLATE_PATH = os.getenv("PPTX_TEMPLATE_PATH")
+DOCX_TEMPLATE_PATH = os.getenv("DOCX_TEMPLATE_PATH")
+
+ROMAN_NUMERALS = [
+    "I", "II", "III", "IV", "V", "VI", "VII",
+    "VIII", "IX", "X", "XI", "XII", "XIII", "XIV"
+]
+
+_template_bytes = {}
+_template_lock = threading.Lock()
+
+
+def _load_template_bytes(kind, path):
+    key = (kind, path)
+    with _template_lock:
+        if key not in _template_bytes:
+            if path:
+                with open(path, "rb") as f:
+                    data = f.read()
+            else:
+                buffer = io.BytesIO()
+                (Presentation() if kind == "pptx" else Document()).save(buffer)
+                data = buffer.getvalue()
+            _template_bytes[key] = data
+        return _template_bytes[key]
+
+
+def new_presentation(template_path=None):
+    """A fresh Presentation cloned from the cached base template."""
+    return Presentation(io.BytesIO(_load_template_bytes("pptx", template_path or PPTX_TEMPLATE_PATH)))
+
+
+def new_document(template_path=None):
+    """A fresh Document cloned from the cached base template."""
+    return Document(io.BytesIO(_load_template_bytes("docx", template_path or DOCX_TEMPLATE_PATH)))
+
+
+def to_buffer(document):
+    buffer = io.BytesIO()
+    document.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def save_buffer(buffer, output_path):
+    """Writes a rendered buffer to disk atomically; returns the absolute path."""
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(buffer.getvalue())
+    os.replace(tmp_path, output_path)
+    return os.path.abspath(output_path)
+
+
+# ==================================================
+# Slides
+# ==================================================
+def build_slides(prs, json_slides, image_path_map=None):
+    for slide in json_slides:
+        is_title = slide.get("is_title_slide") == "yes"
+        layout = prs.slide_layouts[0] if is_title else prs.slide_layouts[1]
+        s = prs.slides.add_slide(layout)
+
+        # --- Title Slide ---
+        if is_title:
+            s.shapes.title.text = slide.get("title_text", "")
+            if len(s.placeholders) > 1:
+                s.placeholders[1].text = slide.get("subtitle_text", "")
+
+        # --- Content Slide ---
+        else:
+            s.shapes.title.text = slide.get("title_text", "")
+            if len(s.placeholders) > 1:
+                body = s.placeholders[1].text_frame
+                body.clear()
+                for bullet in slide.get("text", []):
+                    p = body.add_paragraph()
+                    p.text = bullet
+                    p.level = 0
+
+            # --- Image Insertion ---
+            image_index = slide.get("image_index")
+            if image_path_map and image_index is not None:
+                img_path = image_path_map.get(image_index)
+                if img_path and os.path.exists(img_path):
+                    # Insert a cached, display-sized JPEG instead of the full 200-DPI page render
+                    # (python-pptx cannot embed WEBP). You can adjust placement here
+                    s.shapes.add_picture(display_image_path(img_path, 3), Inches(5.5), Inches(1.5), width=Inches(3))
+    return prs
+
+
+def render_presentation(json_slides, image_path_map=None, template_path=None):
+    """Renders a slide JSON array to an in-memory .pptx (BytesIO)."""
+    return to_buffer(build_slides(new_presentation(template_path), json_slides, image_path_map))
+
+
+def render_presentations(jobs, template_path=None):
+    """
+    Bulk mode: renders many decks in one pass from one cached template.
+    `jobs` is an iterable of (json_slides, image_path_map) pairs; yields one
+    BytesIO per deck. Used for batch submissions (see generate_slide_batch).
+    """
+    for json_slides, image_path_map in jobs:
+        yield render_presentation(json_slides, image_path_map, template_path)
+
+
+# ==================================================
+# Grant proposals
+# ==================================================
+def build_grant(doc, ordered_fields, filled_fields, title="GRANT PROPOSAL"):
+    doc.add_heading(title, level=0)
+
+    for idx, field_key in enumerate(ordered_fields):
+        content = filled_fields.get(field_key, "")
+        if not content:
+            continue
+
+        section_num = ROMAN_NUMERALS[idx] if idx < len(ROMAN_NUMERALS) else str(idx + 1)
+        section_title = field_key.replace("_", " ").title()
+
+        doc.add_heading(f"{section_num}. {section_title}", level=1)
+
+        if isinstance(content, str):
+            doc.add_paragraph(content)
+        elif isinstance(content, list):
+            for item in content:
+                if isinstance(item, dict):
+                    for k, v in item.items():
+                        doc.add_paragraph(k.replace("_", " ").title(), style="Heading 2")
+                        doc.add_paragraph(str(v))
+        elif isinstance(content, dict):
+            for k, v in content.items():
+                doc.add_paragraph(k.replace("_", " ").title(), style="Heading 2")
+                doc.add_paragraph(str(v))
+    return doc
+
+
+def render_grant(ordered_fields, filled_fields, title="GRANT PROPOSAL", template_path=None):
+    """Renders grant fields to an in-memory .docx (BytesIO)."""
+    return to_buffer(build_grant(new_document(template_path), ordered_fields, filled_fields, title))
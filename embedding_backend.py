@@ -0,0 +1,199 @@
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings.huggingface import HuggingFaceEmbeddings
+
+# ==================================================
+# Embedding backends (GPU, CPU, CPU int8)
+# ==================================================
+# EMBEDDING_BACKEND selects how gtr-t5-large is run:
+#   "cuda"     -> full precision on the GPU (previous behaviour)
+#   "cpu"      -> full precision on the CPU
+#   "cpu-int8" -> Linear layers dynamically quantized to int8 on the CPU
+#   "auto"     -> "cuda" when a GPU is visible, otherwise "cpu-int8" (default)
+#
+# The CPU backends sort texts by length and encode them in fixed-size batches,
+# so each forward pass pads to similar lengths. With EMBED_WORKERS > 1,
+# batches are spread over worker processes that each load the model once and
+# split the cores between them.
+
+EMBEDDING_MODEL_ID = "sentence-transformers/gtr-t5-large"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "auto")
+CPU_BATCH_SIZE = int(os.getenv("EMBED_CPU_BATCH_SIZE", "64"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+
+
+def resolve_backend(backend=None):
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu-int8"
+    if backend not in ("cuda", "cpu", "cpu-int8"):
+        raise ValueError(f"Unknown embedding backend '{backend}'. Expected auto, cuda, cpu or cpu-int8.")
+    return backend
+
+
+def load_cpu_model(model_id=EMBEDDING_MODEL_ID, quantize=True):
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(model_id, device="cpu")
+    model.eval()
+    if quantize:
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def length_batches(texts, batch_size):
+    """Index batches of `texts`, grouped by length to minimize padding."""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+# --- Worker processes ---
+_worker_model = None
+
+
+def _init_worker(model_id, quantize, threads):
+    global _worker_model
+    torch.set_num_threads(threads)
+    _worker_model = load_cpu_model(model_id, quantize)
+
+
+def _encode_in_worker(texts):
+    with torch.inference_mode():
+        return _worker_model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+
+
+class CPUEmbeddings(Embeddings):
+    """LangChain embeddings running gtr-t5-large on the CPU, optionally int8-quantized."""
+
+    def __init__(self, model_id=EMBEDDING_MODEL_ID, quantize=True, batch_size=CPU_BATCH_SIZE, workers=EMBED_WORKERS):
+        self.model_id = model_id
+        self.quantize = quantize
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self._model = None
+        self._pool = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = load_cpu_model(self.model_id, self.quantize)
+        return self._model
+
+    def _get_pool(self):
+        if self._pool is None:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_id, self.quantize, threads)
+            )
+        return self._pool
+
+    def encode(self, texts):
+        """float32 array of shape (len(texts), dim), in input order."""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        batches = length_batches(texts, self.batch_size)
+        groups = [[texts[i] for i in batch] for batch in batches]
+        if self.workers > 1 and len(groups) > 1:
+            encoded = list(self._get_pool().map(_encode_in_worker, groups))
+        else:
+            with torch.inference_mode():
+                encoded = [self.model.encode(group, batch_size=len(group), convert_to_numpy=True) for group in groups]
+
+        vectors = np.empty((len(texts), encoded[0].shape[1]), dtype=np.float32)
+        for batch, batch_vectors in zip(batches, encoded):
+            vectors[batch] = batch_vectors
+        return vectors
+
+    def embed_documents(self, texts):
+        return self.encode(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def get_embeddings(backend=None, model_id=EMBEDDING_MODEL_ID):
+    """LangChain embeddings object for the selected backend."""
+    backend = resolve_backend(backend)
+    print(f"[INFO] Embedding backend: {backend}")
+    if backend == "cuda":
+        return HuggingFaceEmbeddings(model_name=model_id, model_kwargs={'device': 'cuda'})
+    return CPUEmbeddings(model_id, quantize=(backend == "cpu-int8"))
+
+
+def embedding_cache_key(backend=None, model_id=EMBEDDING_MODEL_ID):
+    # Quantized vectors differ slightly, so query caches are kept per backend
+    backend = resolve_backend(backend)
+    return model_id if backend in ("cuda", "cpu") else f"{model_id}:{backend}"
+
+
+# ==================================================
+# Drift against full precision
+# ==================================================
+def measure_drift(texts, reference, candidate, k=10):
+    """
+    Compares two backends on the same texts: cosine similarity between the
+    vectors each produces for a text, and how many of each text's k nearest
+    neighbours (within the sample) stay the same.
+    """
+    ref = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    start = time.perf_counter()
+    cand = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    candidate_seconds = time.perf_counter() - start
+
+    ref /= np.linalg.norm(ref, axis=1, keepdims=True)
+    cand /= np.linalg.norm(cand, axis=1, keepdims=True)
+    cosines = np.sum(ref * cand, axis=1)
+
+    k = min(k, len(texts) - 1)
+    overlap = None
+    if k > 0:
+        ref_sims, cand_sims = ref @ ref.T, cand @ cand.T
+        np.fill_diagonal(ref_sims, -np.inf)
+        np.fill_diagonal(cand_sims, -np.inf)
+        ref_top = np.argsort(-ref_sims, axis=1)[:, :k]
+        cand_top = np.argsort(-cand_sims, axis=1)[:, :k]
+        overlap = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)]))
+
+    return {
+        "texts": len(texts),
+        "cosine_mean": float(cosines.mean()),
+        "cosine_p5": float(np.percentile(cosines, 5)),
+        "cosine_min": float(cosines.min()),
+        f"neighbour_overlap@{k}": overlap,
+        "candidate_chunks_per_sec": len(texts) / candidate_seconds if candidate_seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check CPU embedding backends against full precision.")
+    parser.add_argument("command", choices=["drift"])
+    parser.add_argument("--db_path", required=True, help="Saved FAISS store (or snapshot) to sample chunks from")
+    parser.add_argument("--sample", type=int, default=500)
+    parser.add_argument("--reference", default="cpu", choices=["cuda", "cpu"])
+    parser.add_argument("--candidate", default="cpu-int8", choices=["cpu", "cpu-int8"])
+    args = parser.parse_args()
+
+    from bm25_index import load_lexical_store
+    db = load_lexical_store(args.db_path)
+    ids = [db.index_to_docstore_id[i] for i in sorted(db.index_to_docstore_id)][:args.sample]
+    texts = [db.docstore.search(i).page_content for i in ids]
+    report = measure_drift(texts, get_embeddings(args.reference), get_embeddings(args.candidate))
+    for key, value in report.items():
+        print(f"{key:>28}: {value}")
+
+
+if __name__ == "__main__":
+    main()
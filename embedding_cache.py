@@ -0,0 +1,137 @@
+import os
+import re
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+
+# ==================================================
+# Query embedding cache (in-process LRU + SQLite tier)
+# ==================================================
+# Each job runs in its own short-lived process, so the in-process LRU mostly
+# helps within one job; repeats across jobs are served by the SQLite file,
+# which every job process on the host shares. Vectors are stored as packed float32 bytes: a gtr-t5-large query vector
+# takes 3 KB instead of ~24 KB as a Python list of floats. Hits and misses
+# both return the float32 values, so a query gets the same vector either way.
+
+# gtr-t5 is case-sensitive, so only whitespace is normalized. Rows written
+# by earlier versions used lowercased keys and live in another table.
+PERSIST_TABLE = "query_embeddings_v2"
+# Shared SQLite tier; set QUERY_CACHE_PATH to "" to keep the cache in memory only
+DEFAULT_PERSIST_PATH = os.getenv("QUERY_CACHE_PATH", os.path.join(".cache", "query_embeddings.sqlite"))
+LOG_EVERY = int(os.getenv("QUERY_CACHE_LOG_EVERY", "500"))  # Lookups between hit-rate log lines; 0 disables
+
+
+def normalize_query(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class QueryEmbeddingCache:
+    def __init__(self, model_id, max_entries=2048, persist_path=None, log_every=LOG_EVERY):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.log_every = log_every
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+        if persist_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(persist_path)), exist_ok=True)
+                with self._connect() as conn:
+                    # WAL lets concurrent job processes read while one of them writes
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        f"CREATE TABLE IF NOT EXISTS {PERSIST_TABLE} ("
+                        "model_id TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL, "
+                        "PRIMARY KEY (model_id, query))"
+                    )
+            except (OSError, sqlite3.Error) as e:
+                print(f"[WARN] Query embedding cache: SQLite tier disabled ({e}).")
+                self.persist_path = None
+
+    def _connect(self):
+        return sqlite3.connect(self.persist_path, timeout=5)
+
+    # A busy or broken SQLite file only costs a cache miss; it never fails a query.
+    def _get_persistent(self, key):
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    f"SELECT vector FROM {PERSIST_TABLE} WHERE model_id = ? AND query = ?",
+                    (self.model_id, key)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"[WARN] Query embedding cache read failed: {e}")
+            return None
+        return row[0] if row else None
+
+    def _put_persistent(self, key, packed):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {PERSIST_TABLE} (model_id, query, vector) VALUES (?, ?, ?)",
+                    (self.model_id, key, packed)
+                )
+        except sqlite3.Error as e:
+            print(f"[WARN] Query embedding cache write failed: {e}")
+
+    def _remember(self, key, packed):
+        # Caller holds the lock
+        self._entries[key] = packed
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def embed(self, query, embed_fn):
+        """Returns the embedding for `query`, calling `embed_fn` only on a cache miss."""
+        key = normalize_query(query)
+        with self._lock:
+            packed = self._entries.get(key)
+            if packed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self._maybe_log()
+                return array("f", packed).tolist()
+
+        if self.persist_path:
+            packed = self._get_persistent(key)
+            if packed is not None:
+                with self._lock:
+                    self.persistent_hits += 1
+                    self._remember(key, packed)
+                    self._maybe_log()
+                return array("f", packed).tolist()
+
+        vector = array("f", embed_fn(query))
+        packed = vector.tobytes()
+        with self._lock:
+            self.misses += 1
+            self._remember(key, packed)
+            self._maybe_log()
+        if self.persist_path:
+            self._put_persistent(key, packed)
+        return vector.tolist()
+
+    def _maybe_log(self):
+        # Caller holds the lock
+        lookups = self.hits + self.persistent_hits + self.misses
+        if self.log_every and lookups % self.log_every == 0:
+            print(f"[INFO] Query embedding cache: {lookups} lookups, "
+                  f"hit rate {(self.hits + self.persistent_hits) / lookups:.1%} "
+                  f"({self.persistent_hits} from SQLite), {len(self._entries)} entries.")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+                "bytes": sum(len(v) for v in self._entries.values()),
+            }
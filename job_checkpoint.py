@@ -0,0 +1,113 @@
+import os
+import re
+import json
+import time
+import uuid
+from types import SimpleNamespace
+from langchain.schema import Document
+
+# ==================================================
+# Per-job checkpoints
+# ==================================================
+# Every job writes its intermediate results under .jobs/<job_id>/ :
+#
+#   retrieval.json  -> text chunks and ColPali page hits
+#   captions.json   -> combined image context and image_path_map
+#   llm_raw.txt     -> raw Claude response
+#   llm_output.json -> sanitized Claude response
+#   parsed.json     -> parsed slide array / grant fields
+#   output.json     -> path of the rendered document
+#
+# Re-running a job with the same id skips every stage whose checkpoint exists,
+# so a failed JSON parse or render costs seconds instead of a full run.
+
+JOBS_ROOT = os.getenv("JOBS_DIR", ".jobs")
+STAGES = ["retrieval", "captions", "llm_output", "parsed", "output"]
+# Ids become directory and socket names, so only what new_job_id() produces is accepted
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f][0-9a-f-]{0,63}$")
+
+
+def new_job_id():
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+
+def validate_job_id(job_id):
+    if not isinstance(job_id, str) or not JOB_ID_PATTERN.match(job_id):
+        raise ValueError(f"Invalid job id: {job_id!r}")
+    return job_id
+
+
+def serialize_documents(docs):
+    return [{"page_content": d.page_content, "metadata": d.metadata} for d in docs]
+
+
+def deserialize_documents(items):
+    return [Document(page_content=i["page_content"], metadata=i["metadata"]) for i in items]
+
+
+def serialize_colpali_results(results):
+    return [
+        {"doc_id": r.doc_id, "page_num": r.page_num, "score": float(getattr(r, "score", 0.0) or 0.0)}
+        for r in results
+    ]
+
+
+def deserialize_colpali_results(items):
+    return [SimpleNamespace(**i) for i in items]
+
+
+class JobCheckpoint:
+    def __init__(self, job_id=None, root=JOBS_ROOT, restart_from=None):
+        """
+        `restart_from` discards the checkpoint of that stage and every later one,
+        e.g. restart_from="llm_output" keeps retrieval and captions but asks
+        Claude again.
+        """
+        self.job_id = validate_job_id(job_id) if job_id else new_job_id()
+        self.dir = os.path.join(root, self.job_id)
+        os.makedirs(self.dir, exist_ok=True)
+        if restart_from:
+            if restart_from not in STAGES:
+                raise ValueError(f"Unknown stage '{restart_from}'. Expected one of {STAGES}.")
+            for stage in STAGES[STAGES.index(restart_from):]:
+                self.discard(stage)
+            if restart_from in ("retrieval", "captions", "llm_output"):
+                self._remove(self.path("llm_raw.txt"))
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def _stage_path(self, stage):
+        return self.path(f"{stage}.json")
+
+    def has(self, stage):
+        return os.path.exists(self._stage_path(stage))
+
+    def load(self, stage):
+        with open(self._stage_path(stage), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, stage, data):
+        # Write then rename, so an interrupted job never leaves a truncated checkpoint
+        target = self._stage_path(stage)
+        tmp = target + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, target)
+        print(f"[INFO] Job {self.job_id}: checkpointed '{stage}'.")
+
+    def discard(self, stage):
+        self._remove(self._stage_path(stage))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def first_missing_stage(self):
+        for stage in STAGES:
+            if not self.has(stage):
+                return stage
+        return None
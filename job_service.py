@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import socket
+import tempfile
+from job_checkpoint import JOBS_ROOT, new_job_id, validate_job_id
+
+# ==================================================
+# Job status API
+# ==================================================
+# Status lives next to the job's checkpoints:
+#
+#   .jobs/<job_id>/payload.json  -> input written by the app
+#   .jobs/<job_id>/status.json   -> latest state (queued/running/succeeded/failed/cancelled)
+#   .jobs/<job_id>/events.jsonl  -> every status change, in order
+#
+# Status changes are also pushed to subscribers over a Unix datagram socket,
+# so the app blocks on the socket until something happens instead of polling
+# the filesystem for an output file.
+
+TERMINAL_STATES = {"succeeded", "failed", "cancelled"}
+RESULT_FIELDS = ("error", "output_path")  # Set when a run ends; cleared when the job runs again
+
+
+def job_dir(job_id, root=JOBS_ROOT):
+    return os.path.join(root, validate_job_id(job_id))
+
+
+def notify_socket_path(job_id):
+    # Kept short and outside the jobs folder: Unix socket paths are limited to ~100 bytes
+    return os.path.join(tempfile.gettempdir(), f"mmdoc-job-{validate_job_id(job_id)}.sock")
+
+
+def create_job(mode, payload, job_id=None, root=JOBS_ROOT):
+    """Registers a job and writes its payload. Returns (job_id, payload_path)."""
+    job_id = job_id or new_job_id()
+    os.makedirs(job_dir(job_id, root), exist_ok=True)
+    payload = dict(payload, job_id=job_id)
+    payload_path = os.path.abspath(os.path.join(job_dir(job_id, root), "payload.json"))
+    with open(payload_path, "w") as f:
+        json.dump(payload, f, indent=2)
+    update_status(job_id, "queued", root=root, mode=mode)
+    return job_id, payload_path
+
+
+def get_status(job_id, root=JOBS_ROOT):
+    try:
+        with open(os.path.join(job_dir(job_id, root), "status.json"), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def update_status(job_id, state, root=JOBS_ROOT, **fields):
+    """
+    Persists a status change and pushes it to any subscriber. The result
+    fields of a previous run are dropped once the job is queued or running again.
+    """
+    os.makedirs(job_dir(job_id, root), exist_ok=True)
+    previous = get_status(job_id, root) or {}
+    if state in ("queued", "running"):
+        previous = {key: value for key, value in previous.items() if key not in RESULT_FIELDS}
+    status = dict(previous, job_id=job_id, state=state, updated_at=time.time(), **fields)
+    status.setdefault("created_at", status["updated_at"])
+
+    status_path = os.path.join(job_dir(job_id, root), "status.json")
+    tmp_path = status_path + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(status, f)
+    os.replace(tmp_path, status_path)
+    with open(os.path.join(job_dir(job_id, root), "events.jsonl"), "a") as f:
+        f.write(json.dumps(status) + "\n")
+
+    _notify(job_id, status)
+    return status
+
+
+def _notify(job_id, status):
+    path = notify_socket_path(job_id)
+    if not os.path.exists(path):
+        return
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(json.dumps(status).encode("utf-8"), path)
+    except OSError:
+        pass  # Subscriber went away; status.json still has the state
+
+
+class JobSubscription:
+    """
+    Receives pushed status events for one job. Bind it before starting the job:
+
+        with JobSubscription(job_id) as sub:
+            start_job(...)
+            status = sub.wait(timeout=30)
+    """
+
+    def __init__(self, job_id, root=JOBS_ROOT):
+        self.job_id = job_id
+        self.root = root
+        self.path = notify_socket_path(job_id)
+        self.sock = None
+
+    def __enter__(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def wait(self, timeout=None):
+        """Blocks until the next status event; returns None on timeout."""
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(65536)
+        except socket.timeout:
+            return None
+        return json.loads(data.decode("utf-8"))
+
+    def wait_for_completion(self, timeout, on_event=None):
+        """Waits for a terminal state, calling `on_event(status)` for each change."""
+        deadline = time.monotonic() + timeout
+        status = get_status(self.job_id, self.root)
+        while status is None or status.get("state") not in TERMINAL_STATES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return status
+            event = self.wait(timeout=remaining)
+            if event is None:
+                return get_status(self.job_id, self.root)
+            status = event
+            if on_event:
+                on_event(status)
+        return status
+
+
+# ==================================================
+# Cancellation and deadlines
+# ==================================================
+class JobCancelled(Exception):
+    """Raised at a stage boundary once a job is cancelled or past its deadline."""
+
+
+def request_cancel(job_id, reason="cancelled by user", root=JOBS_ROOT):
+    """Asks a running job to stop; it notices at its next stage boundary."""
+    marker = os.path.join(job_dir(job_id, root), "cancel")
+    with open(marker, "w") as f:
+        f.write(reason)
+
+
+def clear_cancel(job_id, root=JOBS_ROOT):
+    """Removes a cancel marker so the job can be resumed by hand."""
+    try:
+        os.remove(os.path.join(job_dir(job_id, root), "cancel"))
+    except FileNotFoundError:
+        pass
+
+
+class CancellationToken:
+    """
+    Carried through a job's stages. `check(stage)` costs one stat() call and
+    raises JobCancelled when a cancel marker exists or the deadline (epoch
+    seconds) has passed.
+    """
+
+    def __init__(self, job_id, deadline=None, root=JOBS_ROOT):
+        self.job_id = job_id
+        self.deadline = deadline
+        self.marker = os.path.join(job_dir(job_id, root), "cancel")
+
+    def remaining(self):
+        """Seconds left before the deadline, or None without a deadline."""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.time()
+
+    def cancelled_reason(self):
+        if os.path.exists(self.marker):
+            with open(self.marker, "r") as f:
+                return f.read().strip() or "cancelled"
+        if self.deadline is not None and time.time() >= self.deadline:
+            return "deadline exceeded"
+        return None
+
+    def check(self, stage):
+        reason = self.cancelled_reason()
+        if reason:
+            raise JobCancelled(f"Job {self.job_id} stopped before '{stage}': {reason}")
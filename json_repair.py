@@ -0,0 +1,333 @@
+import re
+import json
+
+# ==================================================
+# Tolerant JSON parsing for LLM output
+# ==================================================
+# Claude output regularly breaks json.loads: it is cut off at max_tokens,
+# contains trailing commas, raw newlines, or unescaped quotes inside strings.
+# The parser below accepts all of these, keeps every container element that
+# was fully emitted, drops a truncated trailing element and reports what was
+# lost, so only the missing slides or fields have to be requested again. A
+# dropped object is kept aside (with the field that was cut off), so callers
+# can still accept it when only an optional field was lost.
+
+FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL)
+LITERAL_PATTERN = re.compile(r"-?\d+(\.\d+)?([eE][+-]?\d+)?|true|false|null")
+# Everything a number can look like before it is complete ("-", "1.", "1.5e", "1.5e-")
+PARTIAL_NUMBER_PATTERN = re.compile(r"-?(\d+(\.\d*)?([eE][+-]?\d*)?)?")
+BARE_KEY_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_\-]*")
+# What may follow the comma after a string that really ends there: another
+# key or element, a closing bracket, or a bare key
+VALUE_START_PATTERN = re.compile(r'["{\[\]}\-0-9]|(true|false|null)\b|[A-Za-z_][A-Za-z0-9_\-]*\s*:')
+# A quoted key right after a string (`"x" "b": ...`): the comma between members is missing
+NEXT_KEY_PATTERN = re.compile(r'"(?:[^"\\\n]|\\.)*"\s*:')
+PARTIAL_KEY_PATTERN = re.compile(r'"?([A-Za-z0-9_\-]*)')
+
+
+class _Truncated(Exception):
+    """Raised when the input ends in the middle of a value."""
+
+
+class RepairResult:
+    def __init__(self, value, truncated, repairs, dropped=None):
+        self.value = value
+        self.truncated = truncated
+        self.repairs = repairs  # Human-readable list of what was fixed
+        # (object, key of the field cut off) for a trailing object dropped as truncated
+        self.dropped = dropped
+
+    def __repr__(self):
+        return f"RepairResult(truncated={self.truncated}, repairs={self.repairs})"
+
+
+def extract_json_payload(text):
+    """Strips markdown fences and any prose before the first '[' or '{'."""
+    text = text.strip()
+    match = FENCE_PATTERN.search(text)
+    if match and match.group(1).strip():
+        text = match.group(1).strip()
+    starts = [i for i in (text.find("["), text.find("{")) if i != -1]
+    return text[min(starts):] if starts else text
+
+
+class _TolerantParser:
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.repairs = []
+        self.truncated = False
+        self.lost_key = None  # Field cut off most recently, outermost last
+        self.dropped = None   # (object, lost_key) of the last truncated object dropped from an array
+
+    # --- helpers ---
+    def _skip_ws(self):
+        while self.pos < len(self.text) and self.text[self.pos] in " \t\r\n":
+            self.pos += 1
+
+    def _peek(self):
+        self._skip_ws()
+        if self.pos >= len(self.text):
+            raise _Truncated()
+        return self.text[self.pos]
+
+    # --- values ---
+    def parse_value(self):
+        ch = self._peek()
+        if ch == "{":
+            return self.parse_object()
+        if ch == "[":
+            return self.parse_array()
+        if ch == '"':
+            return self.parse_string()
+        return self.parse_literal()
+
+    def parse_object(self):
+        self.pos += 1  # '{'
+        result = {}
+        while True:
+            try:
+                ch = self._peek()
+            except _Truncated:
+                self.truncated = True
+                self.lost_key = None
+                self.repairs.append("closed truncated object")
+                return result
+            if ch == "}":
+                self.pos += 1
+                return result
+            if ch == ",":
+                self.pos += 1
+                if self._peek_is("}"):
+                    self.repairs.append("removed trailing comma")
+                continue
+
+            start = self.pos
+            key = None
+            try:
+                key = self.parse_string() if ch == '"' else self._parse_bare_key()
+                if self._peek() != ":":
+                    raise ValueError(f"Expected ':' after key {key!r} at offset {self.pos}")
+                self.pos += 1
+                value = self.parse_value()
+            except _Truncated:
+                self.truncated = True
+                self.lost_key = key if key is not None else PARTIAL_KEY_PATTERN.match(self.text, start).group(1)
+                self.repairs.append(f"dropped truncated field starting at offset {start}")
+                self.pos = len(self.text)
+                return result
+            if self.truncated:
+                self.lost_key = key
+                self.repairs.append(f"dropped truncated field {key!r}")
+                return result
+            result[key] = value
+            if not self._peek_is(",") and not self._peek_is("}") and self.pos < len(self.text):
+                self.repairs.append(f"inserted missing comma at offset {self.pos}")
+
+    def parse_array(self):
+        self.pos += 1  # '['
+        result = []
+        while True:
+            try:
+                ch = self._peek()
+            except _Truncated:
+                self.truncated = True
+                self.lost_key = None
+                self.repairs.append("closed truncated array")
+                return result
+            if ch == "]":
+                self.pos += 1
+                return result
+            if ch == ",":
+                self.pos += 1
+                if self._peek_is("]"):
+                    self.repairs.append("removed trailing comma")
+                continue
+
+            start = self.pos
+            try:
+                value = self.parse_value()
+            except _Truncated:
+                self.truncated = True
+                self.lost_key = None
+                self.repairs.append(f"dropped truncated element starting at offset {start}")
+                self.pos = len(self.text)
+                return result
+            if self.truncated and isinstance(value, (dict, list)):
+                # The element itself was closed by repair, so it is incomplete
+                self.repairs.append(f"dropped truncated element starting at offset {start}")
+                if isinstance(value, dict):
+                    self.dropped = (value, self.lost_key)
+                return result
+            result.append(value)
+
+    def _peek_is(self, char):
+        self._skip_ws()
+        return self.pos < len(self.text) and self.text[self.pos] == char
+
+    def _parse_bare_key(self):
+        match = BARE_KEY_PATTERN.match(self.text, self.pos)
+        if not match:
+            raise ValueError(f"Unexpected character {self.text[self.pos]!r} at offset {self.pos}")
+        self.pos = match.end()
+        self.repairs.append(f"quoted bare key {match.group(0)!r}")
+        return match.group(0)
+
+    def parse_string(self):
+        self.pos += 1  # opening quote
+        chars = []
+        text = self.text
+        while self.pos < len(text):
+            ch = text[self.pos]
+            if ch == "\\":
+                if self.pos + 1 >= len(text):
+                    raise _Truncated()
+                chars.append(self._parse_escape())
+                continue
+            if ch == '"':
+                # A quote only closes the string if structure follows it;
+                # otherwise it is an unescaped quote inside the text.
+                if self._closes_string(self.pos):
+                    self.pos += 1
+                    return "".join(chars)
+                self.repairs.append(f"escaped inner quote at offset {self.pos}")
+                chars.append('"')
+                self.pos += 1
+                continue
+            if ch in "\n\r\t" or ord(ch) < 0x20:
+                if ch not in "\n\t":
+                    self.pos += 1
+                    continue
+            chars.append(ch)
+            self.pos += 1
+        raise _Truncated()
+
+    def _closes_string(self, quote_pos):
+        rest = self.text[quote_pos + 1:].lstrip(" \t\r\n")
+        if not rest or rest[0] in ":}]":
+            return True
+        if rest[0] == '"':
+            return NEXT_KEY_PATTERN.match(rest) is not None
+        if rest[0] != ",":
+            return False
+        # `"he said "hi", then"`: a comma followed by prose is still inside the string
+        after = rest[1:].lstrip(" \t\r\n")
+        return not after or VALUE_START_PATTERN.match(after) is not None
+
+    def _parse_escape(self):
+        esc = self.text[self.pos + 1]
+        simple = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+        if esc in simple:
+            self.pos += 2
+            return simple[esc]
+        if esc == "u":
+            digits = self.text[self.pos + 2:self.pos + 6]
+            if len(digits) < 4:
+                raise _Truncated()
+            self.pos += 6
+            return chr(int(digits, 16))
+        # Invalid escape such as "\d": keep both characters literally
+        self.repairs.append(f"kept invalid escape \\{esc}")
+        self.pos += 2
+        return "\\" + esc
+
+    def parse_literal(self):
+        tail = self.text[self.pos:].rstrip(" \t\r\n")
+        if any(word.startswith(tail) for word in ("true", "false", "null")) or PARTIAL_NUMBER_PATTERN.fullmatch(tail):
+            # A number or keyword at the very end ("nul", "-", "1.5e") may itself be cut off
+            raise _Truncated()
+        match = LITERAL_PATTERN.match(self.text, self.pos)
+        end = match.end() if match else self.pos
+        if not match or (end < len(self.text) and (self.text[end].isalnum() or self.text[end] in ".+-")):
+            raise ValueError(f"Unexpected character {self.text[end]!r} at offset {end}")
+        self.pos = end
+        return json.loads(match.group(0))
+
+
+def repair_json(text):
+    """
+    Parses possibly broken JSON. Tries json.loads first and only falls back to
+    the tolerant parser when that fails.
+    """
+    payload = extract_json_payload(text)
+    try:
+        return RepairResult(json.loads(payload), truncated=False, repairs=[])
+    except json.JSONDecodeError:
+        pass
+    parser = _TolerantParser(payload)
+    try:
+        value = parser.parse_value()
+    except _Truncated:
+        raise ValueError("LLM output contains no recoverable JSON value.")
+    return RepairResult(value, parser.truncated, parser.repairs, dropped=parser.dropped)
+
+
+# ==================================================
+# Document-specific validation
+# ==================================================
+SLIDE_REQUIRED_FIELDS = {
+    "title": ["title_text"],
+    "section": ["section_title"],
+    "content": ["title_text", "text"],
+}
+SLIDE_OPTIONAL_FIELDS = ["image_index"]
+SLIDE_FIELDS = ["id", "type", "title_text", "subtitle_text", "section_title", "text"] + SLIDE_OPTIONAL_FIELDS
+
+
+def _lost_only_optional_field(lost_key):
+    # A key cut off mid-name ("image_in") counts if it can only be an optional field
+    if not lost_key:
+        return False
+    candidates = [f for f in SLIDE_FIELDS if f.startswith(lost_key)]
+    return bool(candidates) and all(f in SLIDE_OPTIONAL_FIELDS for f in candidates)
+
+
+def parse_slides(text):
+    """
+    Returns (slides, report). `slides` holds every complete slide object;
+    `report` lists repairs, whether the array was truncated and which slides
+    lack required fields.
+    """
+    result = repair_json(text)
+    slides = result.value
+    if isinstance(slides, dict):
+        slides = slides.get("slides", [slides])
+    if not isinstance(slides, list):
+        raise ValueError("Expected a JSON array of slides.")
+
+    slides = [s for s in slides if isinstance(s, dict)]
+    if result.dropped and _lost_only_optional_field(result.dropped[1]):
+        # The last slide was only cut off in an optional field: keep it without that field
+        slide = result.dropped[0]
+        required = SLIDE_REQUIRED_FIELDS.get(slide.get("type", "content"), [])
+        if all(slide.get(f) for f in required):
+            slides.append(slide)
+            result.repairs.append(f"kept slide {slide.get('id', '?')!r} without truncated field {result.dropped[1]!r}")
+    incomplete = {}
+    for slide in slides:
+        required = SLIDE_REQUIRED_FIELDS.get(slide.get("type", "content"), [])
+        missing = [f for f in required if not slide.get(f)]
+        if missing:
+            incomplete[slide.get("id", "?")] = missing
+
+    report = {
+        "truncated": result.truncated,
+        "repairs": result.repairs,
+        "recovered_slides": [s.get("id") for s in slides],
+        "incomplete_slides": incomplete,
+    }
+    return slides, report
+
+
+def parse_grant(text, expected_fields):
+    """
+    Returns (fields, missing, report): every complete top-level field, the
+    expected fields that are absent or empty, and the repair report.
+    """
+    result = repair_json(text)
+    fields = result.value
+    if not isinstance(fields, dict):
+        raise ValueError("Expected a JSON object of grant fields.")
+    missing = [f for f in expected_fields if not fields.get(f)]
+    report = {"truncated": result.truncated, "repairs": result.repairs, "missing_fields": missing}
+    return fields, missing, report
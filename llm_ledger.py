@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import argparse
+import threading
+from collections import defaultdict
+
+# ==================================================
+# Append-only ledger of LLM calls (JSONL)
+# ==================================================
+# One line per call_claude invocation. Each record is written with a single
+# write() on a file opened in append mode, so concurrent jobs can share the
+# ledger without interleaving lines.
+
+LEDGER_PATH = os.getenv("LLM_LEDGER_PATH", os.path.join(".cache", "llm_ledger.jsonl"))
+_write_lock = threading.Lock()
+
+
+def cache_status(usage):
+    """Summarizes Bedrock prompt-cache usage as 'hit', 'write' or 'none'."""
+    if usage.get("cache_read_input_tokens"):
+        return "hit"
+    if usage.get("cache_creation_input_tokens"):
+        return "write"
+    return "none"
+
+
+def record_call(mode, template_name, prompt_chars, latency_s, response_body=None, error=None,
+                model_id=None, max_tokens=None, job_id=None, path=None):
+    response_body = response_body or {}
+    usage = response_body.get("usage", {})
+    entry = {
+        "ts": time.time(),
+        "job_id": job_id,
+        "mode": mode,
+        "template": template_name,
+        "model_id": model_id,
+        "prompt_chars": prompt_chars,
+        "input_tokens": usage.get("input_tokens"),
+        "output_tokens": usage.get("output_tokens"),
+        "max_tokens": max_tokens,
+        "latency_s": round(latency_s, 3),
+        "cache": cache_status(usage),
+        "stop_reason": response_body.get("stop_reason"),
+        "error": error,
+    }
+    path = path or LEDGER_PATH
+    line = json.dumps(entry) + "\n"
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with _write_lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+    except OSError as e:
+        # The ledger is for reporting only; a full disk or read-only path must not fail the Bedrock call
+        print(f"[WARN] Could not write the LLM ledger {path}: {e}")
+    return entry
+
+
+def read_ledger(path=None, since=None):
+    path = path or LEDGER_PATH
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Partial line from a crashed writer
+            if since is None or entry.get("ts", 0) >= since:
+                entries.append(entry)
+    return entries
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100.0 * (len(values) - 1)))))
+    return values[index]
+
+
+def summarize(entries):
+    """Aggregates calls by (mode, template)."""
+    groups = defaultdict(list)
+    for entry in entries:
+        groups[(entry.get("mode"), entry.get("template"))].append(entry)
+
+    rows = []
+    for (mode, template), calls in sorted(groups.items(), key=lambda item: str(item[0])):
+        ok = [c for c in calls if not c.get("error")]
+        latencies = [c["latency_s"] for c in ok]
+        outputs = [c["output_tokens"] for c in ok if c.get("output_tokens") is not None]
+        inputs = [c["input_tokens"] for c in ok if c.get("input_tokens") is not None]
+        rows.append({
+            "mode": mode,
+            "template": template or "-",
+            "calls": len(calls),
+            "errors": len(calls) - len(ok),
+            "p50_latency_s": percentile(latencies, 50),
+            "p95_latency_s": percentile(latencies, 95),
+            "input_tokens": sum(inputs),
+            "output_tokens": sum(outputs),
+            "p95_output_tokens": percentile(outputs, 95),
+            "hit_max_tokens": sum(1 for c in ok if c.get("stop_reason") == "max_tokens"),
+            "cache_hits": sum(1 for c in ok if c.get("cache") == "hit"),
+        })
+    return rows
+
+
+def print_report(rows):
+    columns = ["mode", "template", "calls", "errors", "p50_latency_s", "p95_latency_s",
+               "input_tokens", "output_tokens", "p95_output_tokens", "hit_max_tokens", "cache_hits"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) if rows else len(c) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report LLM latency and token usage from the ledger.")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--path", default=LEDGER_PATH, help="Ledger file")
+    parser.add_argument("--hours", type=float, help="Only include calls from the last N hours")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    since = time.time() - args.hours * 3600 if args.hours else None
+    rows = summarize(read_ledger(args.path, since=since))
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_report(rows)
+
+
+if __name__ == "__main__":
+    main()
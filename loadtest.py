@@ -0,0 +1,499 @@
+import os
+import re
+import ast
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import traceback
+from collections import Counter, defaultdict
+
+# ==================================================
+# End-to-end load test with stubbed models and Bedrock
+# ==================================================
+# Runs generate_slides_from_headings / generate_grant_from_inputs in-process
+# against a synthetic corpus. ColPali, LLaVA, the embedding model and the
+# Bedrock client are replaced by deterministic stubs with configurable
+# latency. Everything else (retrieval, BM25 fusion, checkpoints, JSON repair,
+# rate limiting, rendering) is the production code path. Requests arrive
+# open-loop at a target rate and are dispatched through the same
+# FairScheduler as real jobs, with `--workers` jobs running at once:
+#
+#   python loadtest.py --rate 0.5 --duration 120 --workers 2 --llm_latency 8
+#
+# By default jobs run as threads of this process. They share one Bedrock
+# pool, one query-embedding cache and one loaded store, which production
+# job processes do not. With --processes every job runs in its own Python
+# process instead, like under scheduler.run_job. Each one loads the corpus,
+# shares the Bedrock budget through a state file and shares the query cache
+# through SQLite. Those numbers include the per-process start-up cost.
+#
+# All job, ledger and render files go to a temporary folder.
+
+
+def stable_hash(text):
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:12], 16)
+
+
+# ==================================================
+# Stubs
+# ==================================================
+class StubEmbeddings:
+    """Hashed bag-of-words vectors: similar texts get similar vectors."""
+
+    def __init__(self, dim=64, latency=0.0, per_text_latency=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+
+    def _vector(self, text):
+        vector = [0.0] * self.dim
+        for word in re.findall(r"\w+", text.lower()):
+            vector[stable_hash(word) % self.dim] += 1.0
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self._vector(text)
+
+    def __call__(self, text):
+        return self.embed_query(text)
+
+
+class StubPage:
+    def __init__(self, doc_id, page_num, score):
+        self.doc_id = doc_id
+        self.page_num = page_num
+        self.score = score
+
+
+class StubColPali:
+    """Returns the same pages for the same query after `latency` seconds."""
+
+    def __init__(self, n_docs, pages_per_doc, latency=0.0):
+        self.n_docs = n_docs
+        self.pages_per_doc = pages_per_doc
+        self.latency = latency
+        # Matches the chunk metadata of the synthetic corpus, so the cross-modal page join is exercised
+        self.doc_ids_to_file_names = {doc_id: f"report_{doc_id}.pdf" for doc_id in range(n_docs)}
+
+    def index(self, **kwargs):
+        return None
+
+    def search(self, query, k=3):
+        time.sleep(self.latency)
+        rng = random.Random(stable_hash(query))
+        return [
+            StubPage(rng.randrange(self.n_docs), rng.randrange(self.pages_per_doc) + 1, 20.0 - i)
+            for i in range(k)
+        ]
+
+
+class StubCaptioner:
+    """Stands in for the LLaVA image-to-text pipeline."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, img, prompt=None, generate_kwargs=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return [{"generated_text": f"USER: {prompt} ASSISTANT: A chart from {os.path.basename(str(img))}."}]
+
+
+class StubProcessor:
+    def apply_chat_template(self, chat_template, add_generation_prompt=True):
+        return "USER: <image> Briefly describe the image. ASSISTANT:"
+
+
+def stub_claude_response(body):
+    """Valid slide or grant JSON for the prompt in an invoke_model body."""
+    prompt = body["messages"][0]["content"]
+    match = re.search(r"top-level keys \*\*exactly\*\*: (\[.*?\])", prompt)
+    if match:
+        fields = ast.literal_eval(match.group(1))
+        return json.dumps({f: f"Stub {f.replace('_', ' ')} drawn from the retrieved context." for f in fields})
+    slides = [{"id": "slide-0", "type": "title", "is_title_slide": "yes",
+               "title_text": "Load Test Deck", "subtitle_text": "Stubbed generation"}]
+    for i in range(1, 6):
+        slides.append({"id": f"slide-{i}", "type": "content", "is_title_slide": "no",
+                       "title_text": f"Finding {i}", "text": [f"Point {i}.{j}" for j in range(1, 4)],
+                       "image_index": (i - 1) % 3})
+    return json.dumps(slides)
+
+
+# ==================================================
+# Synthetic corpus and requests
+# ==================================================
+VOCABULARY = """
+food bank pantry nutrition hunger meals families children seniors county volunteers donors grant
+outcomes program partners distribution health clinic school community budget evaluation impact
+warehouse logistics farm produce outreach policy advocacy region network screening referral youth
+""".split()
+
+
+def build_corpus(workdir, embeddings, n_docs, pages_per_doc, chunks_per_page, seed):
+    from PIL import Image
+    from langchain_community.vectorstores import FAISS
+    from bm25_index import build_bm25_from_db
+
+    rng = random.Random(seed)
+    texts, metadatas = [], []
+    for doc_id in range(n_docs):
+        for page in range(pages_per_doc):
+            for _ in range(chunks_per_page):
+                texts.append(" ".join(rng.choice(VOCABULARY) for _ in range(80)))
+                metadatas.append({"source": f"/stub/report_{doc_id}.pdf", "source_name": f"report_{doc_id}.pdf",
+                                  "page": page, "year": 2020 + doc_id % 5})
+    db = FAISS.from_embeddings(list(zip(texts, embeddings.embed_documents(texts))), embeddings, metadatas=metadatas)
+    db._bm25 = build_bm25_from_db(db)
+
+    images_dir = os.path.join(workdir, "images")
+    os.makedirs(images_dir, exist_ok=True)
+    all_images = {}
+    for doc_id in range(n_docs):
+        all_images[doc_id] = []
+        for page in range(pages_per_doc):
+            path = os.path.join(images_dir, f"report_{doc_id}_page_{page + 1}.png")
+            Image.new("RGB", (1700, 2200), (40 * doc_id % 255, 90, 160)).save(path)
+            all_images[doc_id].append(path)
+    return db, all_images
+
+
+def save_corpus(workdir, db, all_images):
+    db.save_local(os.path.join(workdir, "store"))
+    with open(os.path.join(workdir, "images.json"), "w") as f:
+        json.dump(all_images, f)
+
+
+def load_corpus(workdir, embeddings):
+    """What a job process does: load the store from disk and build its BM25 index."""
+    from langchain_community.vectorstores import FAISS
+    from bm25_index import build_bm25_from_db
+
+    db = FAISS.load_local(os.path.join(workdir, "store"), embeddings, allow_dangerous_deserialization=True)
+    db._bm25 = build_bm25_from_db(db)
+    with open(os.path.join(workdir, "images.json"), "r") as f:
+        all_images = {int(doc_id): paths for doc_id, paths in json.load(f).items()}
+    return db, all_images
+
+
+def make_request(mode, rng, template_fields):
+    from catalog import SLIDE_PURPOSES, SLIDE_SUBTYPES, SLIDE_QUESTIONS, GRANT_TEMPLATE_MAPPING
+    words = lambda n: " ".join(rng.choice(VOCABULARY) for _ in range(n))
+    if mode == "slides":
+        purpose = rng.choice(SLIDE_PURPOSES)
+        subtype = rng.choice(SLIDE_SUBTYPES[purpose])
+        return {"tenant": "default", "filters": {}, "category": purpose, "subtype": subtype,
+                "answers": {q: words(12) for q in SLIDE_QUESTIONS.get(subtype, [])}}
+    template = rng.choice(sorted(set(GRANT_TEMPLATE_MAPPING.values())))
+    fields = template_fields.get(template, [])[:5]
+    return {"tenant": "default", "filters": {}, "template_name": template, "fields": {f: words(12) for f in fields}}
+
+
+# ==================================================
+# Harness
+# ==================================================
+def install_stubs(args, workdir, processes=False):
+    """
+    Points the pipeline at the stubs. Must run before create_documents is
+    imported. With `processes`, this is one job process of a --processes run:
+    the corpus is loaded from `workdir`, and the Bedrock budget and query
+    cache are shared with the other job processes through files there.
+    """
+    os.environ["JOBS_DIR"] = os.path.join(workdir, "jobs")
+    os.environ["LLM_LEDGER_PATH"] = os.path.join(workdir, "llm_ledger.jsonl")
+    os.environ["RENDER_CACHE_DIR"] = os.path.join(workdir, "render_assets")
+    os.environ["EMBEDDING_BACKEND"] = "cpu"  # Never touches CUDA; the model itself is replaced below
+    os.environ["CAPTION_TRIAGE"] = "0"  # There are no PDFs to triage; every page goes to the stub captioner
+
+    import create_documents
+    import bedrock_handler
+    import Chatbot.retrieval as retrieval
+    from bedrock_pool import BedrockClientPool, StubBedrockClient
+    from embedding_cache import QueryEmbeddingCache
+    from tenant_store import TenantStoreCache
+
+    embeddings = StubEmbeddings(latency=args.embed_latency)
+    if processes:
+        db, all_images = load_corpus(workdir, embeddings)
+        state_path = os.path.join(workdir, "bedrock_pool.json")
+        cache_path = os.path.join(workdir, "query_embeddings.sqlite")
+    else:
+        db, all_images = build_corpus(workdir, embeddings, args.docs, args.pages, 3, args.seed)
+        state_path = cache_path = None
+    colpali = StubColPali(args.docs, args.pages, latency=args.colpali_latency)
+    captioner = StubCaptioner(latency=args.caption_latency)
+    # The stub's own concurrency limit only sees the calls of its process
+    stub_client = StubBedrockClient(stub_claude_response, latency=args.llm_latency, throttle_rate=args.throttle_rate,
+                                    max_concurrency=args.bedrock_concurrency,
+                                    seed=args.seed + os.getpid() if processes else args.seed)
+
+    retrieval.embeddings = embeddings
+    retrieval.query_cache = QueryEmbeddingCache("stub", max_entries=2048, persist_path=cache_path)
+    bedrock_handler.bedrock_client = BedrockClientPool(client=stub_client, requests_per_minute=args.rpm,
+                                                      base_backoff=0.2, max_backoff=5.0, state_path=state_path)
+    create_documents.initialize_models = lambda: (colpali, captioner, StubProcessor())
+    create_documents.convert_pdfs_if_needed = lambda data_path, images_folder: (all_images, list(all_images))
+    create_documents.index_documents_if_needed = lambda model, *a, **k: model
+    create_documents.tenant_stores = TenantStoreCache(lambda tenant_id: db)
+    create_documents.OUTPUT_FOLDER = os.path.join(workdir, "output")
+    return create_documents, {"bedrock": bedrock_handler.bedrock_client, "stub": stub_client, "captioner": captioner,
+                              "query_cache": retrieval.query_cache}
+
+
+def summarize_durations(values):
+    from llm_ledger import percentile
+    rounded = lambda v: None if v is None else round(v, 3)
+    return {"p50": rounded(percentile(values, 50)), "p95": rounded(percentile(values, 95)),
+            "p99": rounded(percentile(values, 99)), "max": rounded(max(values) if values else None)}
+
+
+def generate_job(create_documents, job):
+    if job["mode"] == "slides":
+        return create_documents.generate_slides_from_headings(job["payload"], job_id=job["job_id"])
+    return create_documents.generate_grant_from_inputs(job["payload"], job_id=job["job_id"])
+
+
+def process_usage(components):
+    """Bedrock, captioner and query-cache counters of one process."""
+    return {
+        "bedrock": dict(components["bedrock"].stats, stub_calls=components["stub"].calls),
+        "concurrency_limit": round(components["bedrock"].limiter.limit, 2),
+        "captioner_calls": components["captioner"].calls,
+        "query_cache": components["query_cache"].stats(),
+    }
+
+
+def run_job_process(workdir, job_id):
+    """Entry point of one job process in a --processes run (`loadtest.py --run_job`)."""
+    with open(os.path.join(workdir, "config.json"), "r") as f:
+        args = argparse.Namespace(**json.load(f))
+    create_documents, components = install_stubs(args, workdir, processes=True)
+    with open(os.path.join(workdir, "requests", f"{job_id}.json"), "r") as f:
+        job = json.load(f)
+    error = None
+    try:
+        generate_job(create_documents, job)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if args.verbose:
+            traceback.print_exc()
+    with open(os.path.join(workdir, "results", f"{job_id}.json"), "w") as f:
+        json.dump(dict(process_usage(components), error=error), f)
+
+
+def run_in_process(workdir, job):
+    """Runs a job as its own Python process; returns (error, usage)."""
+    with open(os.path.join(workdir, "requests", f"{job['job_id']}.json"), "w") as f:
+        json.dump({k: job[k] for k in ("job_id", "mode", "payload")}, f)
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run_job", job["job_id"], "--workdir", workdir],
+        cwd=os.path.dirname(os.path.abspath(__file__)), check=False
+    )
+    result_path = os.path.join(workdir, "results", f"{job['job_id']}.json")
+    if not os.path.exists(result_path):
+        return f"ProcessError: job process exited with code {completed.returncode}", None
+    with open(result_path, "r") as f:
+        result = json.load(f)
+    return result.pop("error"), result
+
+
+def combine_usage(usages):
+    """Adds up the counters reported by the job processes of a --processes run."""
+    usages = [u for u in usages if u]
+    bedrock = Counter()
+    cache = Counter()
+    for usage in usages:
+        bedrock.update(usage["bedrock"])
+        cache.update({k: usage["query_cache"][k] for k in ("hits", "persistent_hits", "misses")})
+    lookups = sum(cache.values())
+    return {
+        "bedrock": dict(bedrock),
+        # The limit lives in the shared state; the last process to finish saw the latest value
+        "concurrency_limit": usages[-1]["concurrency_limit"] if usages else None,
+        "captioner_calls": sum(u["captioner_calls"] for u in usages),
+        "query_cache": dict(cache, hit_rate=(cache["hits"] + cache["persistent_hits"]) / lookups if lookups else 0.0),
+    }
+
+
+def run_load(args):
+    workdir = tempfile.mkdtemp(prefix="mmdoc-loadtest-")
+    if args.processes:
+        # Built once here; every job process loads it from disk, as real jobs do
+        with open(os.path.join(workdir, "config.json"), "w") as f:
+            json.dump({k: v for k, v in vars(args).items() if k not in ("run_job", "workdir")}, f)
+        os.makedirs(os.path.join(workdir, "requests"))
+        os.makedirs(os.path.join(workdir, "results"))
+        save_corpus(workdir, *build_corpus(workdir, StubEmbeddings(), args.docs, args.pages, 3, args.seed))
+        create_documents = components = None
+    else:
+        create_documents, components = install_stubs(args, workdir)
+    from scheduler import FairScheduler
+    from job_checkpoint import new_job_id
+
+    with open("template_fields.json", "r") as f:
+        template_fields = json.load(f)
+
+    scheduler = FairScheduler(max_running=args.workers)
+    results = []
+    results_lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker():
+        while not stop.is_set():
+            job = scheduler.take()
+            started = time.monotonic()
+            error = usage = None
+            if args.processes:
+                error, usage = run_in_process(workdir, job)
+            else:
+                try:
+                    generate_job(create_documents, job)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    if args.verbose:
+                        traceback.print_exc()
+            finished = time.monotonic()
+            with results_lock:
+                results.append({"mode": job["mode"], "queue_wait_s": job["wait_s"], "service_s": finished - started,
+                                "latency_s": finished - job["arrived"], "error": error, "usage": usage})
+            scheduler.finish(job)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.workers)]
+    for thread in threads:
+        thread.start()
+
+    # Open-loop arrivals: requests keep coming whether or not earlier ones finished
+    rng = random.Random(args.seed)
+    total = args.requests or max(1, int(args.rate * args.duration))
+    start = time.monotonic()
+    next_arrival = start
+    for _ in range(total):
+        delay = next_arrival - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        mode = "slides" if rng.random() < args.slides_fraction else "grant"
+        scheduler.submit({"job_id": new_job_id(), "mode": mode, "user": f"user-{rng.randrange(args.users)}",
+                          "payload": make_request(mode, rng, template_fields), "arrived": time.monotonic()})
+        gap = rng.expovariate(args.rate) if args.arrivals == "poisson" else 1.0 / args.rate
+        next_arrival += gap
+
+    deadline = time.monotonic() + args.drain_timeout
+    while time.monotonic() < deadline:
+        with results_lock:
+            if len(results) >= total:
+                break
+        time.sleep(0.1)
+    elapsed = time.monotonic() - start
+    stop.set()
+
+    with results_lock:
+        usage = combine_usage([r["usage"] for r in results]) if args.processes else process_usage(components)
+    report = build_report(results, total, elapsed, args, usage)
+    report["workdir"] = workdir
+    return report
+
+
+def build_report(results, total, elapsed, args, usage):
+    def section(rows):
+        ok = [r for r in rows if not r["error"]]
+        return {
+            "completed": len(ok),
+            "errors": len(rows) - len(ok),
+            "throughput_per_min": round(len(ok) / elapsed * 60, 2) if elapsed else None,
+            "latency_s": summarize_durations([r["latency_s"] for r in ok]),
+            "service_s": summarize_durations([r["service_s"] for r in ok]),
+            "queue_wait_s": summarize_durations([r["queue_wait_s"] for r in rows]),
+        }
+
+    by_mode = defaultdict(list)
+    for row in results:
+        by_mode[row["mode"]].append(row)
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "verbose", "run_job", "workdir")},
+        "submitted": total,
+        "finished": len(results),
+        "unfinished": total - len(results),
+        "elapsed_s": round(elapsed, 2),
+        "overall": section(results),
+        "by_mode": {mode: section(rows) for mode, rows in sorted(by_mode.items())},
+        "error_types": dict(Counter(r["error"].split(":")[0] for r in results if r["error"])),
+        "bedrock": dict(usage["bedrock"], concurrency_limit=usage["concurrency_limit"]),
+        "captioner_calls": usage["captioner_calls"],
+        "query_cache": usage["query_cache"],
+    }
+
+
+def print_report(report):
+    print(f"\nSubmitted {report['submitted']}, finished {report['finished']}, "
+          f"unfinished {report['unfinished']} in {report['elapsed_s']}s")
+    columns = ["completed", "errors", "throughput_per_min"]
+    for name, section in [("overall", report["overall"])] + list(report["by_mode"].items()):
+        print(f"\n[{name}] " + "  ".join(f"{c}={section[c]}" for c in columns))
+        for metric in ("latency_s", "service_s", "queue_wait_s"):
+            print(f"  {metric:<13}" + "  ".join(f"{k}={v}" for k, v in section[metric].items()))
+    if report["error_types"]:
+        print(f"\nErrors: {report['error_types']}")
+    print(f"Bedrock: {report['bedrock']}")
+    print(f"Captioner calls: {report['captioner_calls']}")
+    print(f"Query embedding cache: {report['query_cache']}")
+    print(f"Artifacts: {report['workdir']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the generation path with stubbed models and Bedrock.")
+    parser.add_argument("--rate", type=float, default=0.5, help="Target arrivals per second")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of arrivals (ignored with --requests)")
+    parser.add_argument("--requests", type=int, help="Exact number of requests to submit")
+    parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson")
+    parser.add_argument("--workers", type=int, default=1, help="Jobs running at once (scheduler max_running)")
+    parser.add_argument("--processes", action="store_true",
+                        help="Run every job in its own Python process, as the scheduler does, instead of a thread")
+    parser.add_argument("--users", type=int, default=10, help="Distinct users the requests are spread over")
+    parser.add_argument("--slides_fraction", type=float, default=0.7)
+    parser.add_argument("--docs", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=6)
+    parser.add_argument("--embed_latency", type=float, default=0.01)
+    parser.add_argument("--colpali_latency", type=float, default=0.2)
+    parser.add_argument("--caption_latency", type=float, default=1.0)
+    parser.add_argument("--llm_latency", type=float, default=5.0)
+    parser.add_argument("--throttle_rate", type=float, default=0.0, help="Share of Bedrock calls throttled by the stub")
+    parser.add_argument("--bedrock_concurrency", type=int,
+                        help="Stub throttles above this many calls in flight (per job process with --processes)")
+    parser.add_argument("--rpm", type=int, default=600, help="Client-side Bedrock requests per minute")
+    parser.add_argument("--drain_timeout", type=float, default=600, help="Seconds to wait for queued jobs after arrivals stop")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Print tracebacks of failed jobs")
+    parser.add_argument("--run_job", help=argparse.SUPPRESS)  # Internal: one job process of a --processes run
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_job:
+        run_job_process(args.workdir, args.run_job)
+        return
+
+    report = run_load(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    sys.exit(1 if report["overall"]["errors"] or report["unfinished"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import os
+import re
+import json
+import datetime
+from collections import defaultdict
+import numpy as np
+import faiss
+
+# ==================================================
+# Metadata annotation at ingest
+# ==================================================
+# Optional sidecar in the data folder, keyed by file name:
+#   {"annual_report_2024.pdf": {"category": "annual_report", "date": "2024-06-30"}}
+METADATA_SIDECAR = "metadata.json"
+YEAR_PATTERN = re.compile(r"\b(1[89]\d\d|2\d\d\d)\b")
+
+
+def load_metadata_sidecar(data_path):
+    sidecar_path = os.path.join(data_path, METADATA_SIDECAR)
+    if not os.path.exists(sidecar_path):
+        return {}
+    with open(sidecar_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def date_year(date):
+    """Year of an ISO date, or of the first four-digit year in a free-form one ("June 2024"); None if absent."""
+    try:
+        return datetime.date.fromisoformat(str(date)[:10]).year
+    except ValueError:
+        match = YEAR_PATTERN.search(str(date))
+        return int(match.group(1)) if match else None
+
+
+def annotate_documents(documents, data_path, sidecar=None):
+    """
+    Adds filterable metadata to loaded documents before splitting, so every
+    chunk inherits it: `source_name`, `date` (sidecar date or file mtime),
+    `year`, plus any extra sidecar fields such as `category`. Pass `sidecar`
+    to reuse an already loaded sidecar when annotating file by file.
+    """
+    if sidecar is None:
+        sidecar = load_metadata_sidecar(data_path)
+    for doc in documents:
+        source = doc.metadata.get("source", "")
+        source_name = os.path.basename(source)
+        extra = sidecar.get(source_name, {})
+        date = extra.get("date")
+        if not date and os.path.exists(source):
+            date = datetime.date.fromtimestamp(os.path.getmtime(source)).isoformat()
+        doc.metadata["source_name"] = source_name
+        if date:
+            doc.metadata["date"] = date
+            year = date_year(date)
+            if year is not None:
+                doc.metadata["year"] = year
+            else:
+                print(f"[WARN] Unrecognized date {date!r} for {source_name}; no year recorded.")
+        for key, value in extra.items():
+            doc.metadata.setdefault(key, value)
+    return documents
+
+
+# ==================================================
+# Pre-filtered search
+# ==================================================
+def build_metadata_postings(db):
+    """
+    field -> value -> list of FAISS positions, built once per loaded store.
+    Only scalar metadata values are indexed.
+    """
+    cached = getattr(db, "_metadata_postings", None)
+    if cached is not None:
+        return cached
+
+    postings = defaultdict(lambda: defaultdict(list))
+    for position in sorted(db.index_to_docstore_id):
+        doc = db.docstore.search(db.index_to_docstore_id[position])
+        metadata = dict(doc.metadata or {})
+        if "source_name" not in metadata and metadata.get("source"):
+            # Stores built before annotation at ingest still have the file path
+            metadata["source_name"] = os.path.basename(metadata["source"])
+        for field, value in metadata.items():
+            if isinstance(value, (str, int, float, bool)):
+                postings[field][value].append(position)
+
+    postings = {field: dict(values) for field, values in postings.items()}
+    db._metadata_postings = postings
+    return postings
+
+
+def _matches_condition(value, condition):
+    if isinstance(condition, dict):
+        if "gte" in condition and not value >= condition["gte"]:
+            return False
+        if "lte" in condition and not value <= condition["lte"]:
+            return False
+        if "in" in condition and value not in condition["in"]:
+            return False
+        return True
+    if isinstance(condition, (list, tuple, set)):
+        return value in condition
+    return value == condition
+
+
+def resolve_filter_ids(db, metadata_filter):
+    """
+    Resolves a filter such as
+        {"source_name": ["annual_report_2024.pdf"], "date": {"gte": "2024-01-01"}}
+    to the set of FAISS positions matching every field (AND across fields,
+    OR within a list). Returns None when there is no filter.
+    """
+    if not metadata_filter:
+        return None
+    postings = build_metadata_postings(db)
+    allowed = None
+    for field, condition in metadata_filter.items():
+        if field not in postings:
+            # Every chunk lacks the field: usually a store built before this
+            # metadata existed, not a filter that legitimately matches nothing
+            warned = getattr(db, "_missing_metadata_warned", None)
+            if warned is None:
+                warned = db._missing_metadata_warned = set()
+            if field not in warned:
+                warned.add(field)
+                snapshot = getattr(db, "_snapshot_path", None) or "this store"
+                print(f"[WARN] No chunk in {snapshot} has metadata field '{field}'; "
+                      f"rebuild the snapshot (snapshot_store.py rebuild) to filter on it.")
+        field_ids = set()
+        for value, positions in postings.get(field, {}).items():
+            try:
+                if _matches_condition(value, condition):
+                    field_ids.update(positions)
+            except TypeError:
+                continue  # Value type not comparable with the condition
+        allowed = field_ids if allowed is None else allowed & field_ids
+        if not allowed:
+            return set()
+    return allowed
+
+
+def matching_sources(db, allowed_ids):
+    """File names that own at least one allowed chunk."""
+    sources = set()
+    for position in allowed_ids:
+        doc = db.docstore.search(db.index_to_docstore_id[position])
+        sources.add(os.path.basename(doc.metadata.get("source", "")))
+    return sources
+
+
+def filtered_similarity_search(db, query_embedding, k, allowed_ids):
+    """
+    Dense search restricted to `allowed_ids` inside FAISS itself, through an
+    IDSelector, so excluded vectors are never scored and no over-fetching is
+    needed.
+    """
+    if not allowed_ids:
+        return []
+    query = np.asarray([query_embedding], dtype=np.float32)
+    if getattr(db, "_normalize_L2", False):
+        faiss.normalize_L2(query)
+    if getattr(db.index, "is_sharded", False):
+        # Shard workers apply the same selector to their own slice of positions
+        _, positions = db.index.search(query, min(k, len(allowed_ids)), allowed=allowed_ids)
+    else:
+        ids = np.fromiter(sorted(allowed_ids), dtype=np.int64)
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids))
+        _, positions = db.index.search(query, min(k, len(ids)), params=params)
+    return [
+        db.docstore.search(db.index_to_docstore_id[int(position)])
+        for position in positions[0] if position != -1
+    ]
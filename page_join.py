@@ -0,0 +1,127 @@
+import os
+from collections import defaultdict, OrderedDict
+
+
+# ==================================================
+# Cross-modal join between ColPali page hits and FAISS text chunks
+# ==================================================
+# PyPDFLoader stores `source` (file path) and a 0-indexed `page` on every chunk,
+# while ColPali returns a `doc_id` and a 1-indexed `page_num`. Both are reduced
+# to a (file name, 0-indexed page) key so that a page hit can pull its text
+# chunks with a dictionary lookup instead of another vector search.
+
+def page_key(source, page):
+    return (os.path.basename(str(source)), int(page))
+
+
+def build_page_chunk_index(db):
+    """
+    Builds a mapping from (file name, page) to the docstore ids of the chunks on
+    that page, in index order, including kept chunks standing in for the page's
+    near-duplicates. The result is cached on the FAISS store object.
+    """
+    cached = getattr(db, "_page_chunk_index", None)
+    if cached is not None:
+        return cached
+
+    page_index = defaultdict(list)
+    for position in sorted(db.index_to_docstore_id):
+        docstore_id = db.index_to_docstore_id[position]
+        doc = db.docstore.search(docstore_id)
+        metadata = getattr(doc, "metadata", None) or {}
+        if "source" not in metadata or "page" not in metadata:
+            continue  # Text files have no page information
+        page_index[page_key(metadata["source"], metadata["page"])].append(docstore_id)
+
+    # A page whose chunk was dropped as a near-duplicate is served by the chunk that was kept
+    for docstore_id, duplicates in (getattr(db, "_dedup_provenance", None) or {}).items():
+        for duplicate in duplicates:
+            if duplicate.get("source") is not None and duplicate.get("page") is not None:
+                page_index[page_key(duplicate["source"], duplicate["page"])].append(docstore_id)
+
+    page_index = dict(page_index)
+    db._page_chunk_index = page_index
+    print(f"[INFO] Page join index covers {len(page_index)} pages.")
+    return page_index
+
+
+def get_colpali_file_names(docs_retrieval_model):
+    """Returns ColPali's doc_id -> file name mapping (empty if unavailable)."""
+    inner = getattr(docs_retrieval_model, "model", docs_retrieval_model)
+    mapping = getattr(inner, "doc_ids_to_file_names", None) or {}
+    return {int(doc_id): os.path.basename(str(name)) for doc_id, name in mapping.items()}
+
+
+def get_colpali_page_count(docs_retrieval_model):
+    """Number of pages in the loaded ColPali index, or None if it cannot be read."""
+    inner = getattr(docs_retrieval_model, "model", docs_retrieval_model)
+    embeddings = getattr(inner, "indexed_embeddings", None)
+    return len(embeddings) if embeddings else None
+
+
+def colpali_page_key(result, doc_id_to_file):
+    file_name = doc_id_to_file.get(int(result.doc_id))
+    if file_name is None:
+        return None
+    return (file_name, int(result.page_num) - 1)
+
+
+def join_cross_modal(text_docs, colpali_docs, db, doc_id_to_file, chunks_per_page=2, page_boost=0.5, max_chunks=8):
+    """
+    Joins text hits and page hits on (file name, page).
+
+    - ColPali pages are re-ranked: each text hit landing on a page adds
+      `page_boost` (relative to the best ColPali score) to that page's score.
+    - The text context is rebuilt as: text hits on a ColPali page first, then up
+      to `chunks_per_page` chunks pulled directly from each ColPali page, then
+      the remaining text hits. Duplicates are dropped.
+
+    Returns (joined_text_docs, reranked_colpali_docs).
+    """
+    page_index = build_page_chunk_index(db)
+
+    text_hits_per_page = defaultdict(int)
+    for doc in text_docs:
+        metadata = doc.metadata or {}
+        if "source" in metadata and "page" in metadata:
+            text_hits_per_page[page_key(metadata["source"], metadata["page"])] += 1
+
+    # --- Boost ColPali pages that text retrieval agrees with ---
+    top_score = max((float(getattr(r, "score", 0.0) or 0.0) for r in colpali_docs), default=0.0) or 1.0
+    page_keys = [colpali_page_key(r, doc_id_to_file) for r in colpali_docs]
+
+    def boosted_score(item):
+        result, key = item
+        base = float(getattr(result, "score", 0.0) or 0.0)
+        return base + page_boost * top_score * text_hits_per_page.get(key, 0)
+
+    ranked = sorted(zip(colpali_docs, page_keys), key=boosted_score, reverse=True)
+    reranked_colpali = [result for result, _ in ranked]
+    colpali_keys = [key for _, key in ranked if key is not None]
+
+    # --- Assemble the joined text context ---
+    joined = OrderedDict()
+
+    def add(doc):
+        metadata = doc.metadata or {}
+        key = (metadata.get("source"), metadata.get("page"), doc.page_content)
+        if key not in joined:
+            joined[key] = doc
+
+    colpali_key_set = set(colpali_keys)
+    for doc in text_docs:
+        metadata = doc.metadata or {}
+        if "page" in metadata and page_key(metadata.get("source", ""), metadata["page"]) in colpali_key_set:
+            add(doc)
+
+    for key in colpali_keys:
+        for docstore_id in page_index.get(key, [])[:chunks_per_page]:
+            add(db.docstore.search(docstore_id))
+
+    for doc in text_docs:
+        add(doc)
+
+    joined_docs = list(joined.values())[:max_chunks]
+    print(f"[INFO] Cross-modal join: {len(text_docs)} text hits + {len(colpali_keys)} pages -> {len(joined_docs)} chunks.")
+    return joined_docs, reranked_colpali
+
@@ -0,0 +1,114 @@
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+import fitz
+
+# ==================================================
+# Caption triage: which ColPali pages need the vision model
+# ==================================================
+# Many ColPali hits are pages of running text whose content the PDF text layer
+# already holds. PyMuPDF reports where the text blocks, embedded images and
+# vector drawings sit on a page. Pages whose figure area is small and whose
+# text blocks fill a fair share of the page are summarized extractively from
+# that text; only figure-, chart- or photo-heavy pages, pages with sparse text
+# (title slides, posters, labelled diagrams) and scans without a text layer go
+# to LLaVA.
+
+CAPTION_TRIAGE = os.getenv("CAPTION_TRIAGE", "1") != "0"
+VISUAL_MIN_COVERAGE = 0.2   # Images + drawings covering this much of the page -> vision model
+TEXT_MIN_CHARS = 300        # Less text than this is treated as a visual page (scans, slides)
+TEXT_MIN_COVERAGE = 0.15    # Text blocks covering less of the page than this -> vision model
+MIN_DRAWING_AREA = 0.005    # Drawings smaller than this fraction of the page (rules, underlines) are ignored
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"[a-z][a-z0-9'-]+")
+_STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+""".split())
+
+
+def _clipped_area(rect, page_rect):
+    rect = fitz.Rect(rect) & page_rect
+    return 0.0 if rect.is_empty else rect.width * rect.height
+
+
+@lru_cache(maxsize=1024)
+def _page_layout(pdf_path, page_index, mtime):
+    with fitz.open(pdf_path) as doc:
+        page = doc.load_page(page_index)
+        page_rect = page.rect
+        page_area = page_rect.width * page_rect.height or 1.0
+
+        blocks = page.get_text("blocks")
+        text = " ".join(b[4] for b in blocks if b[6] == 0)
+        text_area = sum(_clipped_area(b[:4], page_rect) for b in blocks if b[6] == 0)
+
+        image_area = sum(_clipped_area(info["bbox"], page_rect) for info in page.get_image_info())
+        drawing_area = 0.0
+        for drawing in page.get_drawings():
+            area = _clipped_area(drawing["rect"], page_rect)
+            if area / page_area >= MIN_DRAWING_AREA:
+                drawing_area += area
+
+    return {
+        "text": text.strip(),
+        "text_coverage": min(1.0, text_area / page_area),
+        "visual_coverage": min(1.0, (image_area + drawing_area) / page_area),
+    }
+
+
+def page_layout(pdf_path, page_index):
+    """Text, text-block coverage and image/drawing coverage of a 0-indexed page."""
+    return _page_layout(os.path.abspath(pdf_path), int(page_index), os.path.getmtime(pdf_path))
+
+
+def classify_page(layout, visual_min_coverage=VISUAL_MIN_COVERAGE, text_min_chars=TEXT_MIN_CHARS,
+                  text_min_coverage=TEXT_MIN_COVERAGE):
+    """Returns "visual" or "text"."""
+    if layout["visual_coverage"] >= visual_min_coverage or len(layout["text"]) < text_min_chars:
+        return "visual"
+    # Enough characters spread thinly over the page are labels or captions, not running text
+    if layout["text_coverage"] < text_min_coverage:
+        return "visual"
+    return "text"
+
+
+def extractive_summary(text, query=None, max_sentences=3):
+    """
+    Picks the `max_sentences` highest-scoring sentences, in page order.
+    Sentences score by the page frequency of their content words, with words
+    from `query` counted double.
+    """
+    sentences = [s.strip() for s in _SENTENCE_SPLIT.split(" ".join(text.split())) if len(s.split()) >= 4]
+    if not sentences:
+        return text[:500]
+    frequencies = Counter(w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS)
+    query_words = set(_WORD.findall((query or "").lower())) - _STOPWORDS
+
+    def score(sentence):
+        words = [w for w in _WORD.findall(sentence.lower()) if w not in _STOPWORDS]
+        if not words:
+            return 0.0
+        return sum(frequencies[w] * (2 if w in query_words else 1) for w in words) / len(words)
+
+    best = sorted(range(len(sentences)), key=lambda i: score(sentences[i]), reverse=True)[:max_sentences]
+    return " ".join(sentences[i] for i in sorted(best))
+
+
+def triage_page(pdf_path, page_index, query=None):
+    """
+    Returns ("text", summary) for text-dominant pages, or ("visual", None)
+    when the page should be captioned by the vision model. Pages that cannot
+    be read (missing file, bad page number) fall back to "visual".
+    """
+    if not CAPTION_TRIAGE or not pdf_path:
+        return "visual", None
+    try:
+        layout = page_layout(pdf_path, page_index)
+    except (OSError, ValueError, IndexError, RuntimeError) as e:
+        print(f"[WARN] Triage skipped for {pdf_path} page {page_index + 1}: {e}")
+        return "visual", None
+    if classify_page(layout) == "visual":
+        return "visual", None
+    return "text", extractive_summary(layout["text"], query=query)
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from job_checkpoint import JOBS_ROOT, JobCheckpoint
+from job_service import (
+    create_job, get_status, update_status, request_cancel, JobSubscription, job_dir, TERMINAL_STATES
+)
+from scheduler import submit_job, is_running
+from tenant_store import DEFAULT_TENANT
+
+# ==================================================
+# Speculative retrieval and captioning while the form is filled in
+# ==================================================
+# The app calls `speculate` on every rerun of a form. When the retrieval
+# input changed, the previous prefetch is cancelled and a new prefetch job
+# (retrieval + captions only) is queued with the scheduler, delayed by
+# PREFETCH_DEBOUNCE_S so bursts of edits only run the last one. On
+# "Generate", `adopt` hands the prefetch job id to the real job, which copies
+# the finished checkpoints instead of recomputing them.
+#
+#   session["prefetch_<mode>"] -> {"job_id": ..., "fingerprint": ...}
+#
+# Nothing is created when no scheduler is listening. Prefetch job folders that
+# outlived PREFETCH_TTL_S without being adopted are removed by
+# `clean_up_expired_prefetches`, which `speculate` runs now and then.
+
+PREFETCH_DEBOUNCE_S = float(os.getenv("PREFETCH_DEBOUNCE_S", "2.0"))
+PREFETCH_TTL_S = float(os.getenv("PREFETCH_TTL_S", "600"))   # Unused prefetches expire after this
+PREFETCH_WAIT_S = float(os.getenv("PREFETCH_WAIT_S", "120"))  # Longest a job waits for a running prefetch
+REUSED_STAGES = ["retrieval", "captions"]
+CLEANUP_INTERVAL_S = 300
+_last_cleanup = 0.0
+
+
+def retrieval_fingerprint(mode, payload):
+    """Hash of everything retrieval and captioning depend on."""
+    if mode == "slides":
+        query = [payload.get("category", ""), payload.get("subtype", ""), payload.get("answers", {})]
+    else:
+        query = [payload.get("template_name", ""), payload.get("fields", {})]
+    data = {
+        "mode": mode,
+        "tenant": payload.get("tenant", DEFAULT_TENANT),
+        "filters": payload.get("filters") or {},
+        "query": query,
+    }
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _has_input(mode, payload):
+    values = payload.get("answers" if mode == "slides" else "fields", {}).values()
+    return any(isinstance(v, str) and v.strip() for v in values)
+
+
+def _session_key(mode):
+    return f"prefetch_{mode}"
+
+
+def speculate(session, mode, payload, user="anonymous"):
+    """
+    Starts (or keeps) a prefetch for the current form input. Returns the
+    prefetch job id, or None when there is nothing to prefetch or no
+    scheduler is running.
+    """
+    if not _has_input(mode, payload):
+        return None
+    fingerprint = retrieval_fingerprint(mode, payload)
+    current = session.get(_session_key(mode))
+    if current and current["fingerprint"] == fingerprint:
+        return current["job_id"]
+    if current:
+        request_cancel(current["job_id"], "superseded by newer input")
+        session.pop(_session_key(mode), None)
+    # Without a scheduler (plain tmux deployment) there is nobody to run the
+    # prefetch, so no job folder is created on each rerun
+    if not is_running():
+        return None
+    _maybe_clean_up()
+
+    deadline = time.time() + PREFETCH_TTL_S
+    job_payload = dict(payload, prefetch=True, fingerprint=fingerprint, deadline=deadline)
+    job_id, payload_path = create_job(mode, job_payload)
+    try:
+        submit_job(job_id, mode, payload_path, user=user, template_type=payload.get("template_name"),
+                   priority="prefetch", deadline=deadline, delay=PREFETCH_DEBOUNCE_S)
+    except (OSError, ValueError) as e:
+        # Prefetching is best effort; the real job still runs everything itself
+        print(f"[WARN] Prefetch not queued: {e}")
+        shutil.rmtree(job_dir(job_id), ignore_errors=True)
+        return None
+    session[_session_key(mode)] = {"job_id": job_id, "fingerprint": fingerprint}
+    return job_id
+
+
+def clean_up_expired_prefetches(root=JOBS_ROOT, now=None):
+    """
+    Removes prefetch job folders past their deadline that have finished, or
+    that are still queued one TTL later (their scheduler went away). Returns
+    the ids removed.
+    """
+    now = now or time.time()
+    removed = []
+    if not os.path.isdir(root):
+        return removed
+    for job_id in os.listdir(root):
+        try:
+            with open(os.path.join(root, job_id, "payload.json"), "r") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not payload.get("prefetch") or (payload.get("deadline") or now) > now:
+            continue
+        state = (get_status(job_id, root) or {}).get("state")
+        if state in TERMINAL_STATES or (state == "queued" and payload["deadline"] + PREFETCH_TTL_S < now):
+            shutil.rmtree(os.path.join(root, job_id), ignore_errors=True)
+            removed.append(job_id)
+    if removed:
+        print(f"[INFO] Removed {len(removed)} expired prefetch job(s).")
+    return removed
+
+
+def _maybe_clean_up():
+    global _last_cleanup
+    if time.time() - _last_cleanup >= CLEANUP_INTERVAL_S:
+        _last_cleanup = time.time()
+        clean_up_expired_prefetches()
+
+
+def adopt(session, mode, payload):
+    """
+    Called on "Generate". Returns the id of a prefetch whose input matches
+    `payload` so the job can reuse it; cancels a prefetch that no longer matches.
+    """
+    current = session.pop(_session_key(mode), None)
+    if not current:
+        return None
+    if current["fingerprint"] != retrieval_fingerprint(mode, payload):
+        request_cancel(current["job_id"], "superseded by the final input")
+        return None
+    state = (get_status(current["job_id"]) or {}).get("state")
+    return None if state in ("failed", "cancelled") else current["job_id"]
+
+
+def reuse_prefetched_stages(checkpoint, mode, payload, cancel_token):
+    """
+    Copies the retrieval and captions checkpoints of `payload["prefetch_job_id"]`
+    into `checkpoint`. Waits for a prefetch that is still running; a prefetch
+    that has not started yet is cancelled, since this job will do the work
+    sooner. Returns the list of stages reused.
+    """
+    prefetch_id = payload.get("prefetch_job_id")
+    if not prefetch_id or checkpoint.has(REUSED_STAGES[0]):
+        return []
+    status = get_status(prefetch_id) or {}
+    if status.get("state") == "queued":
+        request_cancel(prefetch_id, "final job started first")
+        return []
+    if status.get("state") == "running":
+        update_status(checkpoint.job_id, "running", stage="waiting_for_prefetch")
+        remaining = cancel_token.remaining()
+        timeout = PREFETCH_WAIT_S if remaining is None else max(0.0, min(PREFETCH_WAIT_S, remaining))
+        with JobSubscription(prefetch_id) as subscription:
+            subscription.wait_for_completion(timeout)
+    cancel_token.check("retrieval")
+
+    prefetch = JobCheckpoint(prefetch_id)
+    try:
+        with open(prefetch.path("payload.json"), "r") as f:
+            prefetched_fingerprint = json.load(f).get("fingerprint")
+    except FileNotFoundError:
+        return []
+    if prefetched_fingerprint != retrieval_fingerprint(mode, payload):
+        return []
+    reused = []
+    for stage in REUSED_STAGES:
+        if not prefetch.has(stage):
+            break
+        checkpoint.save(stage, prefetch.load(stage))
+        reused.append(stage)
+    if reused:
+        print(f"[INFO] Job {checkpoint.job_id}: reused {', '.join(reused)} from prefetch {prefetch_id}.")
+    return reused
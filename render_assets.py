@@ -0,0 +1,70 @@
+import os
+import hashlib
+import threading
+from PIL import Image
+
+# ==================================================
+# Display-sized image cache for document rendering
+# ==================================================
+# Page renders are 200-DPI PNGs (several MB each). A picture placed 3 inches
+# wide on a slide needs far fewer pixels, so each source image is downscaled
+# and recompressed once and the result is reused by every deck that shows it.
+# Cache keys combine the source content hash, target size, format and quality.
+
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", os.path.join(".cache", "render_assets"))
+DISPLAY_DPI = 150  # Sharp on projectors and laptop screens at slide size
+_hash_cache = {}
+_lock = threading.Lock()
+
+
+def _file_hash(path):
+    # Hashes are remembered per (path, size, mtime) so repeated decks skip re-reading the file
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    with _lock:
+        if key in _hash_cache:
+            return _hash_cache[key]
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    with _lock:
+        _hash_cache[key] = digest.hexdigest()
+    return _hash_cache[key]
+
+
+def display_image_path(source_path, width_inches, dpi=DISPLAY_DPI, fmt="JPEG", quality=82, cache_dir=None):
+    """
+    Returns the path of a copy of `source_path` scaled to `width_inches` at
+    `dpi` and re-encoded as JPEG or WEBP, creating it on first use. Images
+    with transparency are flattened onto white for JPEG. Images already
+    smaller than the target are only re-encoded.
+    """
+    cache_dir = cache_dir or RENDER_CACHE_DIR
+    target_width = int(round(width_inches * dpi))
+    fmt = fmt.upper()
+    extension = {"JPEG": ".jpg", "WEBP": ".webp"}[fmt]
+    name = f"{_file_hash(source_path)}_{target_width}w_q{quality}{extension}"
+    cached_path = os.path.join(cache_dir, name)
+    if os.path.exists(cached_path):
+        return cached_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with Image.open(source_path) as img:
+        if img.width > target_width:
+            height = max(1, int(round(img.height * target_width / img.width)))
+            img = img.resize((target_width, height), Image.LANCZOS)
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        # Write then rename, so concurrent renders never read a partial file
+        tmp_path = f"{cached_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        save_kwargs = {"quality": quality, "optimize": True} if fmt == "JPEG" else {"quality": quality, "method": 4}
+        img.save(tmp_path, fmt, **save_kwargs)
+    os.replace(tmp_path, cached_path)
+    return cached_path
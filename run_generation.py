@@ -3,8 +3,13 @@ import json
 import os
 from create_documents import (
     generate_slides_from_headings,
-    generate_grant_from_inputs
+    generate_grant_from_inputs,
+    generate_slide_batch,
+    prefetch_context,
+    clean_up_cancelled_job
 )
+from job_checkpoint import STAGES, JobCheckpoint, new_job_id, validate_job_id
+from job_service import update_status, clear_cancel, job_dir, JobCancelled
 
 def main():
     parser = argparse.ArgumentParser(description="Generate content using GPU resources from tmux.")
@@ -14,10 +19,71 @@ def main():
                         help="Template name (e.g., 'IC-Grant-Application', 'Generic-Grant-Proposal')")
     parser.add_argument("--json_data", type=str, help="JSON string containing input")
     parser.add_argument("--json_file", type=str, help="Path to JSON file containing input")
+    parser.add_argument("--job_id", type=validate_job_id, help="Job id; rerunning an existing id resumes from its first missing checkpoint")
+    parser.add_argument("--restart_from", type=str, choices=STAGES,
+                        help="Discard this stage's checkpoint and every later one before resuming")
+    parser.add_argument("--no_deadline", action="store_true",
+                        help="Ignore the deadline stored in the payload and any cancel request (e.g. when resuming a job by hand)")
+    parser.add_argument("--prefetch", action="store_true",
+                        help="Only run retrieval and captioning (speculative job queued by the app)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Slides only: --json_file lists the queued jobs of a batch ({\"batch_jobs\": [...]}); "
+                             "their decks are rendered in one pass")
 
     args = parser.parse_args()
 
-    if args.mode == "slides":
+    try:
+        run(args)
+    except JobCancelled as e:
+        # Nobody is waiting for this result: drop the partial output and exit quickly.
+        # Finished checkpoints stay so the job can be resumed with --no_deadline.
+        clean_up_cancelled_job(JobCheckpoint(args.job_id))
+        update_status(args.job_id, "cancelled", error=str(e))
+        print(f"[INFO] Job {args.job_id} cancelled: {e}")
+    except Exception as e:
+        # A genuine error stays a failure, with its artifacts kept for debugging, even past the deadline
+        if not args.job_id:
+            raise
+        update_status(args.job_id, "failed", error=f"{type(e).__name__}: {e}")
+        raise
+
+
+def run(args):
+    if args.prefetch:
+        with open(args.json_file, "r") as f:
+            payload = json.load(f)
+        args.job_id = validate_job_id(args.job_id or payload.get("job_id") or new_job_id())
+        update_status(args.job_id, "running", mode=args.mode, stage="prefetch")
+        prefetch_context(args.mode, payload, args.job_id)
+        update_status(args.job_id, "succeeded", stage="prefetched")
+        print(f"[{args.mode}] Prefetched retrieval and captions for job {args.job_id}")
+
+    elif args.batch:
+        if args.mode != "slides":
+            raise ValueError("--batch is only supported for slides.")
+        with open(args.json_file, "r") as f:
+            group = json.load(f)
+        args.job_id = validate_job_id(args.job_id or group.get("job_id") or new_job_id())
+        update_status(args.job_id, "running", mode="slides", stage="batch")
+        jobs = []
+        for member in group["batch_jobs"]:
+            with open(os.path.join(job_dir(member), "payload.json"), "r") as f:
+                jobs.append((json.load(f), member))
+        results = generate_slide_batch(jobs)
+        failed = 0
+        for member, result in results.items():
+            if isinstance(result, JobCancelled):
+                clean_up_cancelled_job(JobCheckpoint(member))
+                update_status(member, "cancelled", error=str(result))
+            elif isinstance(result, Exception):
+                failed += 1
+                update_status(member, "failed", error=f"{type(result).__name__}: {result}")
+            else:
+                update_status(member, "succeeded", output_path=os.path.abspath(result))
+        update_status(args.job_id, "succeeded", stage="batch", jobs=len(results), failed=failed)
+        print(f"[batch] {len(results) - failed} of {len(results)} presentations generated")
+
+    elif args.mode == "slides":
         if not args.json_file:
             raise ValueError("--json_file is required for slides mode.")
         if not os.path.exists(args.json_file):
@@ -26,14 +92,18 @@ def main():
         with open(args.json_file, "r") as f:
             user_json = json.load(f)
 
-        ppt_path = generate_slides_from_headings(user_json)
+        args.job_id = validate_job_id(args.job_id or user_json.get("job_id") or new_job_id())
+        if args.no_deadline:
+            user_json.pop("deadline", None)
+            clear_cancel(args.job_id)
+        update_status(args.job_id, "running", mode="slides", stage="starting")
+        ppt_path = generate_slides_from_headings(user_json, job_id=args.job_id, restart_from=args.restart_from)
+        update_status(args.job_id, "succeeded", output_path=os.path.abspath(ppt_path))
         print(f"[slides] Presentation generated at: {ppt_path}")
 
 
     elif args.mode == "grant":
-        if not args.template_type:
-            raise ValueError("Template type is required for grant mode.")
-
+        # The job id comes first, so every later error is reported to the app as a failed status
         if args.json_file:
             if not os.path.exists(args.json_file):
                 raise FileNotFoundError(f"JSON file not found: {args.json_file}")
@@ -47,8 +117,16 @@ def main():
         else:
             raise ValueError("Either --json_file or --json_data must be provided for grant mode.")
 
+        args.job_id = validate_job_id(args.job_id or json_data.get("job_id") or new_job_id())
+        if args.no_deadline:
+            json_data.pop("deadline", None)
+            clear_cancel(args.job_id)
+        update_status(args.job_id, "running", mode="grant", stage="starting")
+        if not args.template_type:
+            raise ValueError("Template type is required for grant mode.")
         print(f"[grant] Generating DOCX using template: {args.template_type}")
-        docx_path = generate_grant_from_inputs(json_data)
+        docx_path = generate_grant_from_inputs(json_data, job_id=args.job_id, restart_from=args.restart_from)
+        update_status(args.job_id, "succeeded", output_path=os.path.abspath(docx_path))
         print(f"[grant] DOCX generated at: {docx_path}")
 
 if __name__ == "__main__":
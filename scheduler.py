@@ -0,0 +1,330 @@
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import argparse
+import threading
+import subprocess
+import socketserver
+from collections import OrderedDict, deque, defaultdict
+from job_service import create_job, update_status, request_cancel, CancellationToken, JobCancelled
+from llm_ledger import percentile
+
+# ==================================================
+# Fair-share scheduler in front of run_generation.py
+# ==================================================
+# Jobs are grouped into classes ("slides", "grant", "batch") and, inside a
+# class, into one FIFO per user. Classes are served by stride scheduling, so
+# over time each class gets dispatch slots in proportion to its weight, and
+# users inside a class take turns. At most `max_running` heavy-model jobs run
+# at once. A burst of nightly batch grants therefore cannot starve
+# interactive slide requests. Speculative prefetches (see prefetch.py) form
+# their own class, weighted below batch, and are held back for a debounce
+# delay first. They only take a slot nobody else is queued for, and a running
+# prefetch is stopped when a real job arrives and every slot is taken.
+
+SOCKET_PATH = os.getenv("SCHEDULER_SOCKET", os.path.join(tempfile.gettempdir(), "mmdoc-scheduler.sock"))
+DEFAULT_WEIGHTS = {"slides": 4, "grant": 2, "batch": 1, "prefetch": 0.5}
+
+
+def job_class(job):
+    priority = job.get("priority")
+    return priority if priority in ("batch", "prefetch") else job["mode"]
+
+
+class FairScheduler:
+    def __init__(self, weights=None, max_running=1):
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.max_running = max_running
+        self.queues = defaultdict(OrderedDict)  # class -> user -> deque of jobs
+        self.passes = defaultdict(float)         # stride-scheduling pass per class
+        self.running = {}
+        self.wait_times = defaultdict(lambda: deque(maxlen=500))
+        self.completed = defaultdict(int)
+        self.cond = threading.Condition()
+
+    # --- queueing ---
+    def submit(self, job):
+        with self.cond:
+            cls = job_class(job)
+            if cls not in self.weights:
+                raise ValueError(f"Unknown job class '{cls}'.")
+            job["enqueued_at"] = time.time()
+            if not any(self.queues[cls].values()):
+                # An idle class rejoins at the current minimum pass instead of
+                # cashing in the time it spent idle.
+                active = [self.passes[c] for c in self.queues if any(self.queues[c].values())]
+                self.passes[cls] = max(self.passes[cls], min(active) if active else 0.0)
+            self.queues[cls].setdefault(job.get("user", "anonymous"), deque()).append(job)
+            if cls != "prefetch" and len(self.running) >= self.max_running:
+                self._preempt_prefetch()
+            self.cond.notify_all()
+            return self.depth()
+
+    def _preempt_prefetch(self):
+        # Caller holds the lock. Frees a slot held by speculative work; the
+        # prefetch's slot is released when its process exits (see run_job).
+        for job in self.running.values():
+            if job_class(job) == "prefetch" and not job.get("preempted"):
+                job["preempted"] = True
+                request_cancel(job["job_id"], "preempted by a queued job")
+                process = job.get("process")
+                if process is not None:
+                    process.terminate()
+                return job
+        return None
+
+    def depth(self):
+        return sum(len(q) for users in self.queues.values() for q in users.values())
+
+    def _next_job(self):
+        # Caller holds the lock
+        candidates = [c for c, users in self.queues.items() if any(users.values())]
+        if any(c != "prefetch" for c in candidates):
+            candidates = [c for c in candidates if c != "prefetch"]  # Prefetches only fill idle slots
+        if not candidates:
+            return None
+        cls = min(candidates, key=lambda c: (self.passes[c], -self.weights[c]))
+        self.passes[cls] += 1.0 / self.weights[cls]
+
+        users = self.queues[cls]
+        while True:
+            user, queue = next(iter(users.items()))
+            users.move_to_end(user)  # Round-robin between users of the class
+            if queue:
+                job = queue.popleft()
+                if not queue:
+                    del users[user]
+                return job
+            del users[user]
+
+    def take(self):
+        """Blocks until a job may start; returns it."""
+        with self.cond:
+            while True:
+                if len(self.running) < self.max_running:
+                    job = self._next_job()
+                    if job is not None:
+                        wait = time.time() - job["enqueued_at"]
+                        self.wait_times[job_class(job)].append(wait)
+                        job["wait_s"] = wait
+                        self.running[job["job_id"]] = job
+                        return job
+                self.cond.wait()
+
+    def finish(self, job):
+        with self.cond:
+            self.running.pop(job["job_id"], None)
+            self.completed[job_class(job)] += 1
+            self.cond.notify_all()
+
+    # --- metrics ---
+    def metrics(self):
+        with self.cond:
+            classes = set(self.weights) | set(self.queues)
+            return {
+                "running": len(self.running),
+                "max_running": self.max_running,
+                "classes": {
+                    cls: {
+                        "weight": self.weights.get(cls),
+                        "queue_depth": sum(len(q) for q in self.queues[cls].values()),
+                        "users_waiting": sum(1 for q in self.queues[cls].values() if q),
+                        "wait_p50_s": percentile(list(self.wait_times[cls]), 50),
+                        "wait_p95_s": percentile(list(self.wait_times[cls]), 95),
+                        "completed": self.completed[cls],
+                    }
+                    for cls in sorted(classes)
+                },
+            }
+
+
+# ==================================================
+# Dispatching to run_generation.py
+# ==================================================
+def build_command(job):
+    cmd = [sys.executable, "run_generation.py", "--mode", job["mode"],
+           "--json_file", job["json_file"], "--job_id", job["job_id"]]
+    if job.get("template_type"):
+        cmd += ["--template_type", job["template_type"]]
+    if job.get("priority") == "prefetch":
+        cmd.append("--prefetch")
+    if job.get("batch"):
+        cmd.append("--batch")
+    return cmd
+
+
+def run_job(scheduler, job):
+    try:
+        try:
+            # A job cancelled or expired while queued never loads a model
+            CancellationToken(job["job_id"], deadline=job.get("deadline")).check("dispatch")
+        except JobCancelled as e:
+            update_status(job["job_id"], "cancelled", error=str(e))
+            return
+        update_status(job["job_id"], "running", stage="dispatched", queue_wait_s=round(job["wait_s"], 3))
+        with scheduler.cond:
+            # Checked under the lock so a preemption cannot slip in before the process is visible
+            if job.get("preempted"):
+                update_status(job["job_id"], "cancelled", error="preempted by a queued job")
+                return
+            job["process"] = subprocess.Popen(build_command(job))
+        if job["process"].wait() < 0 and job.get("preempted"):
+            # Killed by the preemption before it could record anything itself
+            update_status(job["job_id"], "cancelled", error="preempted by a queued job")
+    finally:
+        scheduler.finish(job)
+
+
+def submit_later(scheduler, job):
+    # Debounced submissions: a prefetch superseded during its delay never enters the queue
+    reason = CancellationToken(job["job_id"], deadline=job.get("deadline")).cancelled_reason()
+    if reason:
+        update_status(job["job_id"], "cancelled", error=reason)
+        return
+    scheduler.submit(job)
+
+
+def dispatch_loop(scheduler):
+    while True:
+        job = scheduler.take()
+        threading.Thread(target=run_job, args=(scheduler, job), daemon=True).start()
+
+
+# ==================================================
+# Local socket API (one JSON request per line)
+# ==================================================
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get("op") == "submit":
+                job = request["job"]
+                # Recorded before queueing so a fast dispatch cannot be overwritten
+                update_status(job["job_id"], "queued", queue_depth=self.server.scheduler.depth() + 1)
+                if job.get("delay_s"):
+                    timer = threading.Timer(job["delay_s"], submit_later, args=(self.server.scheduler, job))
+                    timer.daemon = True
+                    timer.start()
+                    depth = self.server.scheduler.depth()
+                else:
+                    depth = self.server.scheduler.submit(job)
+                reply = {"ok": True, "queue_depth": depth}
+            elif request.get("op") == "metrics":
+                reply = {"ok": True, "metrics": self.server.scheduler.metrics()}
+            else:
+                reply = {"ok": False, "error": f"Unknown op {request.get('op')!r}"}
+        except Exception as e:
+            reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(max_running=1, weights=None, socket_path=SOCKET_PATH):
+    scheduler = FairScheduler(weights=weights, max_running=max_running)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = _Server(socket_path, _Handler)
+    server.scheduler = scheduler
+    threading.Thread(target=dispatch_loop, args=(scheduler,), daemon=True).start()
+    print(f"[INFO] Scheduler listening on {socket_path} (max_running={max_running}, weights={scheduler.weights})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def _request(payload, socket_path=SOCKET_PATH, timeout=5):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data)
+
+
+def submit_job(job_id, mode, json_file, user="anonymous", template_type=None, priority="interactive",
+               deadline=None, delay=None, batch=False, socket_path=SOCKET_PATH):
+    """
+    Queues a job with the running scheduler, after `delay` seconds if given.
+    With `batch`, `json_file` lists several slide jobs run by one process.
+    Raises OSError if no scheduler is listening, so callers can fall back to
+    launching the job directly.
+    """
+    job = {"job_id": job_id, "mode": mode, "json_file": json_file, "user": user, "template_type": template_type,
+           "priority": priority, "deadline": deadline, "delay_s": delay, "batch": batch}
+    reply = _request({"op": "submit", "job": job}, socket_path)
+    if not reply.get("ok"):
+        raise ValueError(reply.get("error", "Scheduler rejected the job."))
+    return reply
+
+
+def is_running(socket_path=SOCKET_PATH, timeout=1):
+    """True if a scheduler answers on `socket_path`."""
+    try:
+        return bool(_request({"op": "metrics"}, socket_path, timeout=timeout).get("ok"))
+    except (OSError, ValueError):
+        return False
+
+
+def get_metrics(socket_path=SOCKET_PATH):
+    return _request({"op": "metrics"}, socket_path)["metrics"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fair-share scheduler for slide and grant jobs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="Run the scheduler (e.g. in the tmux pane used for generation)")
+    p_serve.add_argument("--max_running", type=int, default=int(os.getenv("SCHEDULER_MAX_RUNNING", "1")),
+                         help="Maximum concurrent heavy-model jobs")
+    p_serve.add_argument("--weights", type=str, help='JSON weights, e.g. \'{"slides": 4, "grant": 2, "batch": 1}\'')
+
+    p_submit = sub.add_parser("submit", help="Queue a job, e.g. from a nightly batch")
+    p_submit.add_argument("--mode", required=True, choices=["slides", "grant"])
+    p_submit.add_argument("--json_file", required=True, nargs="+",
+                          help="One or more payloads; several slide payloads run as one batch, rendered in one pass")
+    p_submit.add_argument("--template_type")
+    p_submit.add_argument("--user", default="batch")
+    p_submit.add_argument("--priority", default="batch", choices=["interactive", "batch"])
+
+    sub.add_parser("metrics", help="Print queue depth and wait-time metrics")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(max_running=args.max_running, weights=json.loads(args.weights) if args.weights else None)
+    elif args.command == "submit":
+        payloads = []
+        for json_file in args.json_file:
+            with open(json_file, "r") as f:
+                payloads.append(json.load(f))
+        if args.mode == "slides" and len(payloads) > 1:
+            # One process prepares every deck and renders them together from one cached template
+            members = [create_job("slides", payload)[0] for payload in payloads]
+            job_id, payload_path = create_job("slides", {"batch_jobs": members})
+            reply = submit_job(job_id, "slides", payload_path, user=args.user, priority=args.priority, batch=True)
+            print(f"Queued batch {job_id} with jobs {', '.join(members)} (queue depth {reply['queue_depth']})")
+            return
+        for payload in payloads:
+            job_id, payload_path = create_job(args.mode, payload)
+            reply = submit_job(job_id, args.mode, payload_path, user=args.user,
+                               template_type=args.template_type or payload.get("template_name"),
+                               priority=args.priority)
+            print(f"Queued job {job_id} (queue depth {reply['queue_depth']})")
+    elif args.command == "metrics":
+        print(json.dumps(get_metrics(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
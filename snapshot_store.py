@@ -0,0 +1,259 @@
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import argparse
+import itertools
+
+# ==================================================
+# Versioned vector store snapshots
+# ==================================================
+# Layout under a store root (FAISS_DB_PATH or a tenant folder):
+#
+#   <root>/CURRENT                      -> name of the live snapshot
+#   <root>/snapshots/<version>/         -> index.faiss, index.pkl, bm25.pkl, manifest.json
+#   <root>/snapshots/<version>/.leases/ -> one file per reader lease, named <pid>.<n>
+#
+# A rebuild writes into snapshots/<version>.building, renames it once complete
+# and only then replaces CURRENT with os.replace, which is atomic. Readers that
+# already opened a snapshot keep using it; new readers see the new version.
+# A root holding index.faiss directly (pre-snapshot layout) is read as is.
+
+POINTER_FILE = "CURRENT"
+SNAPSHOTS_DIR = "snapshots"
+MANIFEST_FILE = "manifest.json"
+LEASES_DIR = ".leases"
+BUILDING_SUFFIX = ".building"
+
+
+def _snapshots_root(db_root):
+    return os.path.join(db_root, SNAPSHOTS_DIR)
+
+
+def current_version(db_root):
+    """Name of the live snapshot, or None if the root has none."""
+    try:
+        with open(os.path.join(db_root, POINTER_FILE), "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_snapshot_path(db_root):
+    version = current_version(db_root)
+    if version:
+        return os.path.join(_snapshots_root(db_root), version)
+    if os.path.exists(os.path.join(db_root, "index.faiss")):
+        return db_root  # Pre-snapshot layout
+    return None
+
+
+def read_manifest(snapshot_path):
+    manifest_path = os.path.join(snapshot_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def _source_files(data_path):
+    files = []
+    if os.path.isdir(data_path):
+        for name in sorted(os.listdir(data_path)):
+            path = os.path.join(data_path, name)
+            if os.path.isfile(path) and name.endswith((".pdf", ".txt")):
+                stat = os.stat(path)
+                files.append({"name": name, "size": stat.st_size, "mtime": stat.st_mtime})
+    return files
+
+
+def _swap_pointer(db_root, version):
+    tmp_path = os.path.join(db_root, f"{POINTER_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(db_root, POINTER_FILE))
+
+
+def build_snapshot(data_path, db_root, builder, keep=2):
+    """
+    Builds a new snapshot with `builder(data_path, snapshot_dir)` (for example
+    text_retrieval.create_vector_db), publishes it atomically and garbage
+    collects older snapshots. Returns the path of the new snapshot.
+    """
+    snapshots_root = _snapshots_root(db_root)
+    os.makedirs(snapshots_root, exist_ok=True)
+    version = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+    staging = os.path.join(snapshots_root, version + BUILDING_SUFFIX)
+    final = os.path.join(snapshots_root, version)
+    os.makedirs(staging)
+
+    try:
+        builder(data_path, staging)
+        manifest = {
+            "version": version,
+            "created_at": time.time(),
+            "data_path": os.path.abspath(data_path),
+            "files": _source_files(data_path),
+        }
+        with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(staging, final)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    _swap_pointer(db_root, version)
+    print(f"[INFO] Published vector store snapshot {version}.")
+    gc_snapshots(db_root, keep=keep)
+    return final
+
+
+# ==================================================
+# Reader leases and garbage collection
+# ==================================================
+_held_leases = set()  # Lease files this process holds; released at exit
+_lease_ids = itertools.count(1)
+
+
+def acquire_lease(snapshot_path):
+    """
+    Marks the snapshot as in use so GC leaves it alone and returns the lease
+    to pass to release_lease (None for the pre-snapshot layout). Every call
+    is its own lease, so two holders in one process release independently.
+    Raises FileNotFoundError if the snapshot has already been removed.
+    """
+    if not os.path.basename(os.path.dirname(snapshot_path)) == SNAPSHOTS_DIR:
+        return None  # Pre-snapshot layout is never collected
+    leases = os.path.join(snapshot_path, LEASES_DIR)
+    try:
+        os.mkdir(leases)  # Not makedirs: a collected snapshot must not be recreated
+    except FileExistsError:
+        pass
+    lease = os.path.join(leases, f"{os.getpid()}.{next(_lease_ids)}")
+    with open(lease, "w") as f:
+        f.write(str(time.time()))
+    _held_leases.add(lease)
+    return lease
+
+
+def release_lease(lease):
+    if lease is None:
+        return
+    _held_leases.discard(lease)
+    try:
+        os.remove(lease)
+    except FileNotFoundError:
+        pass
+
+
+@atexit.register
+def release_all_leases():
+    for lease in list(_held_leases):
+        release_lease(lease)
+
+
+def lease_current_snapshot(db_root, attempts=5):
+    """
+    Leases the live snapshot and returns (snapshot path, lease), or
+    (None, None) if there is none. CURRENT is read again after the lease is
+    taken: a snapshot replaced and collected in between is released and the
+    new one leased instead.
+    """
+    for _ in range(attempts):
+        snapshot_path = current_snapshot_path(db_root)
+        if snapshot_path is None:
+            return None, None
+        try:
+            lease = acquire_lease(snapshot_path)
+        except FileNotFoundError:
+            continue
+        if current_snapshot_path(db_root) == snapshot_path and os.path.isdir(snapshot_path):
+            return snapshot_path, lease
+        release_lease(lease)
+    raise RuntimeError(f"Live snapshot under {db_root} kept changing; could not lease it.")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _has_live_lease(snapshot_path):
+    leases = os.path.join(snapshot_path, LEASES_DIR)
+    if not os.path.isdir(leases):
+        return False
+    for name in os.listdir(leases):
+        pid = name.split(".", 1)[0]  # Older leases are named by pid alone
+        if pid.isdigit() and _pid_alive(int(pid)):
+            return True
+    return False
+
+
+def gc_snapshots(db_root, keep=2, stale_build_seconds=6 * 3600):
+    """
+    Deletes snapshots beyond the `keep` newest, never touching the live one or
+    any snapshot a running process still holds a lease on. Abandoned
+    `.building` directories older than `stale_build_seconds` are removed too.
+    """
+    snapshots_root = _snapshots_root(db_root)
+    if not os.path.isdir(snapshots_root):
+        return []
+    live = current_version(db_root)
+    removed = []
+    names = sorted(os.listdir(snapshots_root), reverse=True)
+
+    for name in names:
+        path = os.path.join(snapshots_root, name)
+        if name.endswith(BUILDING_SUFFIX) and time.time() - os.path.getmtime(path) > stale_build_seconds:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(name)
+
+    finished = [n for n in names if not n.endswith(BUILDING_SUFFIX)]
+    for name in finished[keep:]:
+        path = os.path.join(snapshots_root, name)
+        if name == live or _has_live_lease(path):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(name)
+
+    if removed:
+        print(f"[INFO] Removed old snapshots: {', '.join(removed)}")
+    return removed
+
+
+# ==================================================
+# CLI
+# ==================================================
+def main():
+    parser = argparse.ArgumentParser(description="Manage versioned vector store snapshots.")
+    parser.add_argument("command", choices=["status", "rebuild", "gc"])
+    parser.add_argument("--db_root", required=True, help="Store root (FAISS_DB_PATH or a tenant folder)")
+    parser.add_argument("--data_path", help="Document folder (rebuild only)")
+    parser.add_argument("--keep", type=int, default=2, help="Number of snapshots to keep")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        path = current_snapshot_path(args.db_root)
+        print(f"Live snapshot: {path or 'none'}")
+        if path:
+            print(json.dumps(read_manifest(path), indent=2))
+    elif args.command == "rebuild":
+        if not args.data_path:
+            sys.exit("--data_path is required for rebuild.")
+        from text_retrieval import create_vector_db
+        build_snapshot(args.data_path, args.db_root, create_vector_db, keep=args.keep)
+    elif args.command == "gc":
+        gc_snapshots(args.db_root, keep=args.keep)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import os
+import re
+import json
+import hashlib
+import secrets
+import argparse
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# ==================================================
+# Per-tenant vector stores
+# ==================================================
+# Layout (one corpus and one FAISS store per organization):
+#
+#   <data_root>/tenants/<tenant_id>/*.pdf
+#   <db_root>/tenants/<tenant_id>/index.faiss, index.pkl, bm25.pkl
+#   <images_root>/tenants/<tenant_id>/       page images, ColPali index "<index>_<tenant_id>"
+#
+# The "default" tenant keeps using <data_root> and <db_root> directly so
+# existing single-corpus deployments work unchanged.
+
+DEFAULT_TENANT = "default"
+TENANT_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+def validate_tenant_id(tenant_id):
+    if not tenant_id or not TENANT_ID_PATTERN.match(tenant_id) or ".." in tenant_id:
+        raise ValueError(f"Invalid tenant id: {tenant_id!r}")
+    return tenant_id
+
+
+# ==================================================
+# Organization access keys
+# ==================================================
+# The app never takes a tenant id from the user. Each organization gets an
+# access key, and TENANT_KEYS_PATH (kept on the server, out of git) maps the
+# SHA-256 of every key to its tenant, so the file holds no usable keys.
+# Without the file the app serves only the default tenant.
+
+TENANT_KEYS_PATH = os.getenv("TENANT_KEYS_PATH", "tenant_keys.json")
+
+
+def hash_access_key(access_key):
+    return hashlib.sha256(access_key.strip().encode("utf-8")).hexdigest()
+
+
+def load_tenant_keys(path=TENANT_KEYS_PATH):
+    """Returns {key hash: tenant id}, or None when no key file exists."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return {digest: validate_tenant_id(tenant_id) for digest, tenant_id in json.load(f).items()}
+
+
+def tenant_for_access_key(access_key, tenant_keys):
+    """Returns the tenant an access key belongs to, or None for an unknown key."""
+    if not access_key or not access_key.strip():
+        return None
+    return tenant_keys.get(hash_access_key(access_key))
+
+
+def _write_tenant_keys(tenant_keys, path):
+    # Replaced in one step so the app never reads a half-written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(tenant_keys, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def add_access_key(tenant_id, path=TENANT_KEYS_PATH):
+    """Issues a new access key for a tenant; only its hash is stored. Returns the key."""
+    tenant_id = validate_tenant_id(tenant_id)
+    tenant_keys = load_tenant_keys(path) or {}
+    access_key = secrets.token_urlsafe(24)
+    tenant_keys[hash_access_key(access_key)] = tenant_id
+    _write_tenant_keys(tenant_keys, path)
+    return access_key
+
+
+def revoke_tenant_keys(tenant_id, path=TENANT_KEYS_PATH):
+    """Removes every access key of a tenant. Returns how many were removed."""
+    tenant_keys = load_tenant_keys(path) or {}
+    kept = {digest: tenant for digest, tenant in tenant_keys.items() if tenant != tenant_id}
+    _write_tenant_keys(kept, path)
+    return len(tenant_keys) - len(kept)
+
+
+def tenant_paths(tenant_id, data_root, db_root):
+    """Returns (data_path, faiss_db_path) for a tenant."""
+    tenant_id = validate_tenant_id(tenant_id or DEFAULT_TENANT)
+    if tenant_id == DEFAULT_TENANT:
+        return data_root, db_root
+    return (
+        os.path.join(data_root, "tenants", tenant_id),
+        os.path.join(db_root, "tenants", tenant_id),
+    )
+
+
+def tenant_image_paths(tenant_id, images_root, index_name="image_index"):
+    """Returns (images_folder, colpali_index_name) for a tenant."""
+    tenant_id = validate_tenant_id(tenant_id or DEFAULT_TENANT)
+    if tenant_id == DEFAULT_TENANT:
+        return images_root, index_name
+    return os.path.join(images_root, "tenants", tenant_id), f"{index_name}_{tenant_id}"
+
+
+def estimate_store_bytes(db):
+    """Rough resident size of a loaded FAISS store: float32 vectors plus chunk text."""
+    index = getattr(db, "index", None)
+    # Sharded stores keep their vectors in the shard workers
+    vector_bytes = index.ntotal * index.d * 4 if index is not None and not getattr(index, "is_sharded", False) else 0
+    text_bytes = sum(len(doc.page_content) for doc in getattr(db.docstore, "_dict", {}).values())
+    return vector_bytes + text_bytes
+
+
+class TenantStoreCache:
+    """
+    Bounded LRU of loaded tenant stores. Cold tenants are loaded lazily through
+    `loader(tenant_id)`; the least recently used stores are evicted once either
+    `max_stores` or `max_bytes` is exceeded. The most recently used store is
+    never evicted, even if it alone exceeds `max_bytes`.
+
+    If `version_fn(tenant_id)` is given, a cached store whose version no longer
+    matches is reloaded on the next `get` (hot reload after a snapshot swap).
+    Callers that already hold the old store keep using it.
+
+    `on_evict(db)` is called for every store that is evicted, invalidated or
+    replaced by a reload, outside the cache lock. Stores taken with `hold`
+    (or `acquire`) are counted: a held store that leaves the cache is only
+    passed to `on_evict` once its last holder releases it.
+    """
+
+    def __init__(self, loader, max_stores=4, max_bytes=None, version_fn=None, on_evict=None):
+        self.loader = loader
+        self.max_stores = max_stores
+        self.max_bytes = max_bytes
+        self.version_fn = version_fn
+        self.on_evict = on_evict
+        self._stores = OrderedDict()  # tenant_id -> (db, size_bytes, version)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._holders = {}  # id(db) -> number of holders
+        self._retired = {}  # id(db) -> db that left the cache while held
+        self.loads = 0
+        self.evictions = 0
+
+    def _lookup(self, tenant_id, version, hold):
+        # Caller holds the lock
+        entry = self._stores.get(tenant_id)
+        if entry is None or (self.version_fn is not None and entry[2] != version):
+            return None
+        self._stores.move_to_end(tenant_id)
+        if hold:
+            self._hold(entry[0])
+        return entry[0]
+
+    def _hold(self, db):
+        # Caller holds the lock
+        self._holders[id(db)] = self._holders.get(id(db), 0) + 1
+
+    def get(self, tenant_id):
+        """Returns the tenant's store without holding it; it may be closed once evicted."""
+        return self._get(tenant_id, hold=False)
+
+    def acquire(self, tenant_id):
+        """Returns the tenant's store, held until `release(db)`."""
+        return self._get(tenant_id, hold=True)
+
+    def release(self, db):
+        with self._lock:
+            count = self._holders.get(id(db), 0) - 1
+            if count > 0:
+                self._holders[id(db)] = count
+                return
+            self._holders.pop(id(db), None)
+            retired = self._retired.pop(id(db), None)
+        if retired is not None:
+            self._release([retired])
+
+    @contextmanager
+    def hold(self, tenant_id):
+        db = self.acquire(tenant_id)
+        try:
+            yield db
+        finally:
+            self.release(db)
+
+    def _get(self, tenant_id, hold):
+        tenant_id = validate_tenant_id(tenant_id or DEFAULT_TENANT)
+        version = self.version_fn(tenant_id) if self.version_fn else None
+        with self._lock:
+            db = self._lookup(tenant_id, version, hold)
+            if db is not None:
+                return db
+            load_lock = self._load_locks.setdefault(tenant_id, threading.Lock())
+
+        # Only one thread loads a given tenant; others wait and reuse the result.
+        with load_lock:
+            with self._lock:
+                db = self._lookup(tenant_id, version, hold)
+                if db is not None:
+                    return db
+
+            print(f"[INFO] Loading vector store for tenant '{tenant_id}'.")
+            try:
+                db = self.loader(tenant_id)
+            except BaseException:
+                with self._lock:
+                    if tenant_id not in self._stores:
+                        self._load_locks.pop(tenant_id, None)
+                raise
+            size = estimate_store_bytes(db)
+            if self.version_fn:
+                # The loader may have built the first snapshot itself; prefer
+                # the version it actually opened.
+                version = getattr(db, "_snapshot_version", self.version_fn(tenant_id))
+
+            with self._lock:
+                previous = self._stores.pop(tenant_id, None)
+                self._stores[tenant_id] = (db, size, version)
+                if hold:
+                    self._hold(db)
+                self.loads += 1
+                dropped = self._evict()
+            if previous is not None:
+                dropped.insert(0, previous[0])
+            self._release(dropped)
+            return db
+
+    def invalidate(self, tenant_id):
+        with self._lock:
+            entry = self._stores.pop(tenant_id, None)
+            self._load_locks.pop(tenant_id, None)
+        self._release([entry[0]] if entry else [])
+
+    def _release(self, dbs):
+        with self._lock:
+            # Held stores are released by their last holder instead
+            for db in dbs:
+                if self._holders.get(id(db)):
+                    self._retired[id(db)] = db
+            dbs = [db for db in dbs if id(db) not in self._retired]
+        if self.on_evict is None:
+            return
+        for db in dbs:
+            try:
+                self.on_evict(db)
+            except Exception as e:
+                print(f"[WARN] Releasing an evicted vector store failed: {e}")
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry[1] for entry in self._stores.values())
+
+    def _evict(self):
+        # Caller holds the lock
+        def over_budget():
+            if len(self._stores) > self.max_stores:
+                return True
+            if self.max_bytes is not None:
+                return sum(entry[1] for entry in self._stores.values()) > self.max_bytes
+            return False
+
+        dropped = []
+        while len(self._stores) > 1 and over_budget():
+            tenant_id, entry = self._stores.popitem(last=False)
+            self._load_locks.pop(tenant_id, None)  # One lock per tenant ever seen would grow without bound
+            dropped.append(entry[0])
+            self.evictions += 1
+            print(f"[INFO] Evicted vector store for tenant '{tenant_id}'.")
+        return dropped
+
+
+# ==================================================
+# CLI
+# ==================================================
+def main():
+    parser = argparse.ArgumentParser(description="Manage organization access keys for the app.")
+    parser.add_argument("command", choices=["add-key", "revoke", "list"])
+    parser.add_argument("--tenant", help="Tenant id (add-key and revoke)")
+    parser.add_argument("--keys_file", default=TENANT_KEYS_PATH, help="Key file read by the app")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        tenant_keys = load_tenant_keys(args.keys_file) or {}
+        counts = {}
+        for tenant_id in tenant_keys.values():
+            counts[tenant_id] = counts.get(tenant_id, 0) + 1
+        for tenant_id, count in sorted(counts.items()):
+            print(f"{tenant_id}: {count} key(s)")
+        return
+    if not args.tenant:
+        parser.error("--tenant is required for add-key and revoke.")
+    if args.command == "add-key":
+        print(f"Access key for '{args.tenant}' (shown once): {add_access_key(args.tenant, args.keys_file)}")
+    else:
+        print(f"Revoked {revoke_tenant_keys(args.tenant, args.keys_file)} key(s) for '{args.tenant}'.")
+
+
+if __name__ == "__main__":
+    main()
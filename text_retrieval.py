@@ -1,9 +1,14 @@
 import os
+import time
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
-from langchain_community.embeddings.huggingface import HuggingFaceEmbeddings
+from langchain_community.document_loaders import PyPDFLoader
 from langchain.schema import Document
+from bm25_index import BM25Index
+from metadata_filter import annotate_documents, load_metadata_sidecar
+from embedding_backend import get_embeddings
+from chunk_dedup import NearDuplicateFilter, DEDUP_THRESHOLD
+from vector_shards import write_shards, SHARD_COUNT
 
 # Custom class to load text files
 class TextFileLoader:
@@ -17,42 +22,108 @@ class TextFileLoader:
             text = file.read()
         return [Document(page_content=text, metadata={'source': self.file_path})]
 
+# Number of chunks embedded and added to the index at a time. Together with one
+# loaded file, this bounds how much text and how many vectors are held in flight.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+
+
+# Yields loaded documents one file (PDFs: one page) at a time instead of loading the whole folder
+def iter_documents(data_path):
+    sidecar = load_metadata_sidecar(data_path)
+    for name in sorted(os.listdir(data_path)):
+        path = os.path.join(data_path, name)
+        if name.endswith('.pdf'):
+            print("Retreiving PDF file: ", path)
+            pages = PyPDFLoader(path).lazy_load()
+        elif name.endswith('.txt'):
+            pages = TextFileLoader(path).load()
+        else:
+            continue
+        for doc in pages:
+            # Attach filterable metadata (file name, date, year, sidecar fields) before splitting
+            annotate_documents([doc], data_path, sidecar=sidecar)
+            yield doc
+
+
+# Splits each document as it arrives
+def iter_chunks(documents, text_splitter):
+    for doc in documents:
+        yield from text_splitter.split_documents([doc])
+
+
+# Groups an iterator into lists of at most `size` items
+def iter_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 # Function to create a vector database from documents
-def create_vector_db(data_path, Db_faiss_path):
+def create_vector_db(data_path, Db_faiss_path, batch_size=EMBED_BATCH_SIZE, dedup_threshold=DEDUP_THRESHOLD,
+                     shard_count=SHARD_COUNT):
     print("---------------------------------------------------------------")
-    
-    documents = []  # Initialize a list to hold all documents
-
-    # Load PDF documents from the specified directory using DirectoryLoader
-    pdf_loader = DirectoryLoader(data_path, glob='*.pdf', loader_cls=PyPDFLoader)
-    pdf_documents = pdf_loader.load()  # Load all PDFs into documents
-    [print("Retreiving PDF file: ", doc.metadata['source']) for doc in pdf_documents]
-    documents.extend(pdf_documents)
-    print(len(pdf_documents), "PDF files loaded.")
-
-    # Load all text files in the specified directory
-    txt_files = [f for f in os.listdir(data_path) if f.endswith('.txt')]
-    for txt_file in txt_files:
-        # Use the custom TextFileLoader to load text documents
-        txt_loader = TextFileLoader(os.path.join(data_path, txt_file))
-        txt_documents = txt_loader.load()
-        documents.extend(txt_documents)
-
-    # Split the loaded documents into smaller chunks using a text splitter
+
+    # Split the documents into smaller chunks using a text splitter as they are loaded
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    texts = text_splitter.split_documents(documents)
-    print(len(texts), "chunks created from the documents.")
-    # Create embeddings using a pre-trained HuggingFace model (GTR-T5-Large)
-    embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/gtr-t5-large', 
-                                        model_kwargs={'device': 'cuda'})
-    # Create a FAISS vector store from the document chunks and their embeddings
-    db = FAISS.from_documents(texts, embeddings)
+    chunks = iter_chunks(iter_documents(data_path), text_splitter)
+
+    # Drop near-duplicate chunks (repeated report versions, boilerplate) before they are embedded
+    dedup = NearDuplicateFilter(threshold=dedup_threshold) if dedup_threshold else None
+    if dedup is not None:
+        chunks = dedup.filter(chunks)
+
+    # Create embeddings using a pre-trained HuggingFace model (GTR-T5-Large) on the
+    # backend chosen by EMBEDDING_BACKEND (GPU, CPU or int8-quantized CPU)
+    embeddings = get_embeddings()
+
+    # Embed fixed-size batches and add each one to the FAISS store (and the BM25
+    # index, with the same docstore ids) as soon as it is ready
+    db = None
+    bm25 = BM25Index()
+    total = 0
+    start = time.perf_counter()
+    for batch in iter_batches(chunks, batch_size):
+        texts = [chunk.page_content for chunk in batch]
+        metadatas = [chunk.metadata for chunk in batch]
+        vectors = embeddings.embed_documents(texts)
+        if db is None:
+            db = FAISS.from_embeddings(list(zip(texts, vectors)), embeddings, metadatas=metadatas)
+            ids = [db.index_to_docstore_id[i] for i in range(len(texts))]
+        else:
+            ids = db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+        for docstore_id, text in zip(ids, texts):
+            bm25.add(docstore_id, text)
+
+        total += len(batch)
+        elapsed = time.perf_counter() - start
+        print(f"[INFO] {total} chunks embedded ({total / elapsed:.1f} chunks/sec)")
+
+    if db is None:
+        raise ValueError(f"No PDF or text documents found in {data_path}.")
+    elapsed = time.perf_counter() - start
+    print(total, f"chunks created from the documents in {elapsed:.1f}s ({total / elapsed:.1f} chunks/sec).")
 
     # Save the FAISS database to the specified local path
     db.save_local(Db_faiss_path)
 
+    # Save the lexical (BM25) index built from the same chunks so both stay in sync
+    bm25.save(Db_faiss_path)
+    print(len(bm25), "chunks added to the BM25 index.")
+
+    # Split the vectors for sharded search; each rebuild re-splits them evenly
+    if shard_count > 1:
+        write_shards(db.index, Db_faiss_path, shard_count)
+
+    if dedup is not None:
+        dedup.save(Db_faiss_path, db.index_to_docstore_id)
+        print(f"{dedup.dropped} of {dedup.seen} chunks dropped as near-duplicates (threshold {dedup_threshold}).")
+
     print("Data Retrived Successfully!")
     print("--------------------------------------")
     print(f"Saved Locally to : {Db_faiss_path}")
     print("--------------------------------------")
-
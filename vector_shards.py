@@ -0,0 +1,727 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import heapq
+import pickle
+import shutil
+import signal
+import socket
+import hashlib
+import weakref
+import tempfile
+import argparse
+import threading
+import subprocess
+import socketserver
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import faiss
+from llm_ledger import percentile
+
+# ==================================================
+# Sharded scatter-gather vector search
+# ==================================================
+# A snapshot built with SHARD_COUNT > 1 also holds its vectors split into
+# shards, round-robin by FAISS position:
+#
+#   <snapshot>/shards/shards.json     -> count, dimension, metric, vectors per shard
+#   <snapshot>/shards/shard_<i>.faiss -> IndexIDMap2 keyed by global FAISS position
+#
+# With SHARDED_SEARCH=1, `load_sharded_store` opens such a snapshot with only
+# the docstore in memory. Its index is a `ShardedIndex` that sends each query
+# to every shard worker in parallel and merges the per-shard top-k. Each shard
+# returns its own k best vectors, so the merged top-k matches a search over
+# the full index. Workers are either this host's shared worker pool or the
+# shard servers listed in SHARD_ADDRESSES (Unix socket paths or host:port).
+# Remote servers must see the snapshot folder (shared filesystem).
+#
+# The local pool (SHARD_WORKERS processes on Unix sockets under SHARD_POOL_DIR)
+# is started by the first store that needs it and then reused by every store,
+# tenant and process on the host; `python vector_shards.py stop` ends it.
+# A server only opens snapshots under its --db_root, and the protocol has no
+# authentication: bind TCP servers to a private interface only.
+#
+# Shards are rebuilt with every snapshot, so a rebuild also rebalances them.
+# `python vector_shards.py rebalance` re-splits the live snapshot into a new
+# snapshot without embedding again, for example to change the shard count.
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))           # Shards written per snapshot; 0 or 1 disables
+SHARDED_SEARCH = os.getenv("SHARDED_SEARCH", "0") == "1"   # Serve dense search from shards when present
+SHARD_ADDRESSES = [a.strip() for a in os.getenv("SHARD_ADDRESSES", "").split(",") if a.strip()]
+SHARD_TIMEOUT_S = float(os.getenv("SHARD_TIMEOUT_S", "10"))
+SHARD_SLOW_MS = float(os.getenv("SHARD_SLOW_MS", "250"))    # Slower shard round trips are logged
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "4"))        # Size of the local worker pool
+SHARD_DB_ROOT = os.getenv("SHARD_DB_ROOT")                  # Root the local pool may read; defaults to the store's root
+SHARD_POOL_DIR = os.getenv("SHARD_POOL_DIR", os.path.join(tempfile.gettempdir(), "mmdoc-shards"))
+SHARDS_DIR = "shards"
+SHARDS_MANIFEST = "shards.json"
+# A shard server keeps the shards of this many snapshots (old and new during a swap, for several tenants)
+LOADED_SNAPSHOTS = int(os.getenv("SHARD_LOADED_SNAPSHOTS", "8"))
+RECONSTRUCT_BLOCK = 65536  # Vectors copied out of the source index per reconstruct_n call
+
+
+def shards_path(snapshot_path):
+    return os.path.join(snapshot_path, SHARDS_DIR)
+
+
+def read_shards_manifest(snapshot_path):
+    path = os.path.join(shards_path(snapshot_path), SHARDS_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def has_shards(snapshot_path):
+    manifest = read_shards_manifest(snapshot_path)
+    return bool(manifest and manifest["count"] > 1)
+
+
+def store_root(snapshot_path):
+    """
+    Folder holding every store on this host that a snapshot belongs to:
+    <root>/snapshots/<version> and <root>/tenants/<id>/snapshots/<version>
+    both map to <root>.
+    """
+    path = os.path.abspath(snapshot_path)
+    if os.path.basename(os.path.dirname(path)) == "snapshots":
+        path = os.path.dirname(os.path.dirname(path))
+    if os.path.basename(os.path.dirname(path)) == "tenants":
+        path = os.path.dirname(os.path.dirname(path))
+    return path
+
+
+# ==================================================
+# Writing shards
+# ==================================================
+def write_shards(index, folder, count):
+    """
+    Splits the vectors of a flat FAISS `index` into `count` shards under
+    `folder`/shards, round-robin by position, so every shard holds an equal
+    share of each document. Vectors are copied in blocks of RECONSTRUCT_BLOCK
+    with one pass over the index. Returns the manifest.
+    """
+    count = max(1, min(count, index.ntotal))
+    target = shards_path(folder)
+    shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(target)
+
+    shard_indexes = [faiss.IndexIDMap2(faiss.index_factory(index.d, "Flat", index.metric_type)) for _ in range(count)]
+    for start in range(0, index.ntotal, RECONSTRUCT_BLOCK):
+        n = min(RECONSTRUCT_BLOCK, index.ntotal - start)
+        block = index.reconstruct_n(start, n)
+        for shard, shard_index in enumerate(shard_indexes):
+            # Position p goes to shard p % count
+            first = (shard - start) % count
+            if first < n:
+                shard_index.add_with_ids(np.ascontiguousarray(block[first::count]),
+                                         np.arange(start + first, start + n, count, dtype=np.int64))
+
+    shards = []
+    for shard, shard_index in enumerate(shard_indexes):
+        name = f"shard_{shard}.faiss"
+        faiss.write_index(shard_index, os.path.join(target, name))
+        shards.append({"file": name, "ntotal": int(shard_index.ntotal)})
+
+    manifest = {
+        "count": count,
+        "partition": "round-robin",
+        "ntotal": int(index.ntotal),
+        "d": int(index.d),
+        "metric": int(index.metric_type),
+        "shards": shards,
+    }
+    with open(os.path.join(target, SHARDS_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"[INFO] Wrote {count} vector shards ({', '.join(str(s['ntotal']) for s in shards)} vectors).")
+    return manifest
+
+
+def rebalance_builder(source_snapshot, count):
+    """
+    `build_snapshot` builder copying an existing snapshot (without its shards)
+    and splitting its vectors into `count` new shards.
+    """
+    def build(data_path, folder):
+        for name in os.listdir(source_snapshot):
+            path = os.path.join(source_snapshot, name)
+            if os.path.isfile(path) and name != "manifest.json":
+                shutil.copy2(path, os.path.join(folder, name))
+        if count > 1:
+            # Memory-mapped where the FAISS build supports it, so only the shards are held in memory
+            write_shards(faiss.read_index(os.path.join(folder, "index.faiss"), faiss.IO_FLAG_MMAP), folder, count)
+    return build
+
+
+# ==================================================
+# Shard server (one per worker process or node)
+# ==================================================
+class ShardServer:
+    """
+    Holds loaded shards, keyed by snapshot path and shard number. Only
+    snapshots under `db_root` are opened, whatever path a client sends.
+    """
+
+    def __init__(self, db_root):
+        self.root = os.path.realpath(db_root)
+        self.loaded = OrderedDict()  # snapshot path -> {shard: index}
+        self.lock = threading.Lock()
+
+    def _resolve(self, snapshot_path):
+        path = os.path.realpath(snapshot_path)
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise PermissionError(f"{snapshot_path} is outside {self.root}.")
+        return path
+
+    def get(self, snapshot_path, shard):
+        snapshot_path = self._resolve(snapshot_path)
+        with self.lock:
+            shards = self.loaded.get(snapshot_path)
+            if shards is not None and shard in shards:
+                self.loaded.move_to_end(snapshot_path)
+                return shards[shard]
+        manifest = read_shards_manifest(snapshot_path)
+        if manifest is None or shard >= manifest["count"]:
+            raise ValueError(f"No shard {shard} in {snapshot_path}.")
+        name = manifest["shards"][shard]["file"]
+        if os.path.basename(name) != name:
+            raise ValueError(f"Bad shard file name {name!r} in {snapshot_path}.")
+        index = faiss.read_index(os.path.join(shards_path(snapshot_path), name))
+        with self.lock:
+            self.loaded.setdefault(snapshot_path, {})[shard] = index
+            self.loaded.move_to_end(snapshot_path)
+            while len(self.loaded) > LOADED_SNAPSHOTS:
+                old_path, _ = self.loaded.popitem(last=False)
+                print(f"[INFO] Unloaded shards of {old_path}.")
+        return index
+
+    def search(self, snapshot_path, shard, vectors, k, allowed=None):
+        index = self.get(snapshot_path, shard)
+        start = time.perf_counter()
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, index.d)
+        params = None
+        if allowed is not None:
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.asarray(allowed, dtype=np.int64)))
+        k = min(k, index.ntotal)
+        if k == 0:
+            distances = np.zeros((len(queries), 0), dtype=np.float32)
+            ids = np.zeros((len(queries), 0), dtype=np.int64)
+        else:
+            distances, ids = index.search(queries, k, params=params)
+        return {
+            "distances": distances.tolist(),
+            "ids": ids.tolist(),
+            "search_ms": (time.perf_counter() - start) * 1000,
+        }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # One JSON request per line; a connection may send several
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                op = request.get("op")
+                if op == "search":
+                    reply = dict(self.server.shards.search(
+                        request["snapshot"], request["shard"], request["vectors"], request["k"],
+                        request.get("allowed")
+                    ), ok=True)
+                elif op == "load":
+                    index = self.server.shards.get(request["snapshot"], request["shard"])
+                    reply = {"ok": True, "ntotal": int(index.ntotal)}
+                elif op == "ping":
+                    reply = {"ok": True, "pid": os.getpid(), "loaded": {
+                        path: sorted(shards) for path, shards in self.server.shards.loaded.items()
+                    }}
+                else:
+                    reply = {"ok": False, "error": f"Unknown op {op!r}"}
+            except Exception as e:
+                reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _is_unix(address):
+    return ":" not in address
+
+
+def make_server(address, db_root):
+    if _is_unix(address):
+        if os.path.exists(address):
+            os.remove(address)
+        server = _UnixServer(address, _Handler)
+    else:
+        host, port = address.rsplit(":", 1)
+        server = _TCPServer((host, int(port)), _Handler)
+    server.shards = ShardServer(db_root)
+    return server
+
+
+def serve(address, db_root):
+    if not _is_unix(address) and address.rsplit(":", 1)[0] in ("", "0.0.0.0", "::", "[::]"):
+        print("[WARN] Shard server bound to every interface; it has no authentication, "
+              "so bind it to a private interface only.")
+    server = make_server(address, db_root)
+    # `stop` sends SIGTERM; exiting through `finally` removes the socket
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"[INFO] Shard server listening on {address} for snapshots under {server.shards.root}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if _is_unix(address) and os.path.exists(address):
+            os.remove(address)
+
+
+# ==================================================
+# Client side
+# ==================================================
+class ShardClient:
+    """Persistent connection to one shard server; one request at a time."""
+
+    def __init__(self, address, timeout=SHARD_TIMEOUT_S):
+        self.address = address
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if _is_unix(self.address):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            target = self.address
+        else:
+            host, port = self.address.rsplit(":", 1)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            target = (host, int(port))
+        sock.settimeout(self.timeout)
+        sock.connect(target)
+        self._sock, self._file = sock, sock.makefile("rb")
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    def request(self, payload):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._sock.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionError(f"Shard server {self.address} closed the connection.")
+                    break
+                except OSError:
+                    # A stale connection (server restarted) is retried once on a fresh one
+                    self.close()
+                    if attempt:
+                        raise
+        reply = json.loads(line)
+        if not reply.get("ok"):
+            raise RuntimeError(f"Shard server {self.address}: {reply.get('error')}")
+        return reply
+
+
+def ping(address, timeout=1):
+    """The server's ping reply, or None when nothing answers on `address`."""
+    client = ShardClient(address, timeout=timeout)
+    try:
+        return client.request({"op": "ping"})
+    except (OSError, RuntimeError):
+        return None
+    finally:
+        client.close()
+
+
+def _pool_addresses(db_root, workers):
+    key = hashlib.sha1(os.path.realpath(db_root).encode("utf-8")).hexdigest()[:12]
+    folder = os.path.join(SHARD_POOL_DIR, key)
+    return folder, [os.path.join(folder, f"worker_{i}.sock") for i in range(workers)]
+
+
+def local_worker_addresses(db_root, workers=SHARD_WORKERS, startup_timeout=60):
+    """
+    Socket addresses of this host's worker pool for `db_root`, starting the
+    workers that are not running. Workers are detached from the caller and
+    shared by every store under the root until `stop_local_workers`.
+    """
+    folder, addresses = _pool_addresses(db_root, workers)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "start.lock"), "w") as lock:
+        # One process starts the missing workers; the others wait here and reuse them
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        started = []
+        for address in addresses:
+            if ping(address) is None:
+                with open(address[:-len(".sock")] + ".log", "ab") as log:
+                    started.append((address, subprocess.Popen(
+                        [sys.executable, os.path.abspath(__file__), "serve", "--address", address, "--db_root", db_root],
+                        stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+                    )))
+        deadline = time.time() + startup_timeout
+        for address, process in started:
+            while ping(address) is None:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Shard worker for {address} exited with code {process.returncode}; "
+                                       f"see {address[:-len('.sock')]}.log.")
+                if time.time() > deadline:
+                    raise TimeoutError(f"Shard worker for {address} did not start within {startup_timeout:.0f}s.")
+                time.sleep(0.1)
+        if started:
+            print(f"[INFO] Started {len(started)} shard workers in {folder}.")
+    return addresses
+
+
+def stop_local_workers(db_root, workers=SHARD_WORKERS):
+    """Stops this host's worker pool for `db_root`; returns how many were running."""
+    stopped = 0
+    for address in _pool_addresses(db_root, workers)[1]:
+        reply = ping(address)
+        if reply is not None:
+            os.kill(reply["pid"], signal.SIGTERM)
+            stopped += 1
+    return stopped
+
+
+def merge_topk(distances, ids, k, metric):
+    """
+    Exact k-way merge of per-shard results for one query. `distances` and
+    `ids` hold one list per shard, each sorted best first. Ties are broken by
+    position so the order is deterministic.
+    """
+    larger_is_better = metric == faiss.METRIC_INNER_PRODUCT
+    hits = (
+        (-d if larger_is_better else d, i)
+        for shard_d, shard_i in zip(distances, ids)
+        for d, i in zip(shard_d, shard_i) if i != -1
+    )
+    best = heapq.nsmallest(k, hits)
+    return [(-d if larger_is_better else d) for d, _ in best], [i for _, i in best]
+
+
+class ShardedIndex:
+    """
+    Stands in for a FAISS index inside a LangChain FAISS store. `search`
+    scatters the queries to every shard and gathers the exact global top-k.
+    Per-shard round-trip and in-worker search times are kept for reporting.
+    """
+
+    is_sharded = True
+
+    def __init__(self, snapshot_path, addresses=None, timeout=SHARD_TIMEOUT_S):
+        manifest = read_shards_manifest(snapshot_path)
+        if manifest is None:
+            raise FileNotFoundError(f"No shards in {snapshot_path}; rebuild with SHARD_COUNT > 1.")
+        self.snapshot_path = os.path.abspath(snapshot_path)
+        self.manifest = manifest
+        self.count = manifest["count"]
+        self.ntotal = manifest["ntotal"]
+        self.d = manifest["d"]
+        self.metric_type = manifest["metric"]
+
+        local = not addresses
+        if local:
+            addresses = local_worker_addresses(SHARD_DB_ROOT or store_root(self.snapshot_path))
+        # With fewer servers than shards, servers take several shards each
+        self.clients = [ShardClient(addresses[shard % len(addresses)], timeout) for shard in range(self.count)]
+        self.latencies = [deque(maxlen=1000) for _ in range(self.count)]   # round trip, ms
+        self.search_times = [deque(maxlen=1000) for _ in range(self.count)]  # inside the worker, ms
+        self._pool = ThreadPoolExecutor(max_workers=self.count, thread_name_prefix="shard")
+        self._finalizer = weakref.finalize(self, ShardedIndex._shutdown, self._pool, self.clients)
+        try:
+            # Loads every shard up front so the first query does not pay for it
+            list(self._pool.map(self._load, range(self.count)))
+        except BaseException:
+            self.close()
+            raise
+        print(f"[INFO] Sharded index: {self.ntotal} vectors in {self.count} shards on "
+              f"{len(set(addresses))} {'local workers' if local else 'servers'}.")
+
+    def _load(self, shard):
+        self.clients[shard].request({"op": "load", "snapshot": self.snapshot_path, "shard": shard})
+
+    def _search_shard(self, shard, vectors, k, allowed):
+        start = time.perf_counter()
+        reply = self.clients[shard].request({
+            "op": "search", "snapshot": self.snapshot_path, "shard": shard,
+            "vectors": vectors, "k": k, "allowed": allowed
+        })
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.latencies[shard].append(elapsed_ms)
+        self.search_times[shard].append(reply["search_ms"])
+        if elapsed_ms > SHARD_SLOW_MS:
+            print(f"[WARN] Shard {shard} took {elapsed_ms:.0f} ms ({reply['search_ms']:.0f} ms searching).")
+        return reply
+
+    def search(self, x, k, params=None, allowed=None):
+        """
+        Same contract as faiss.Index.search: (distances, positions) arrays of
+        shape (len(x), k), padded with -1. `allowed` (global positions)
+        restricts the search like an IDSelector; FAISS `params` cannot be sent
+        to the workers and are rejected.
+        """
+        if params is not None:
+            raise ValueError("ShardedIndex.search takes `allowed` positions instead of FAISS params.")
+        vectors = np.asarray(x, dtype=np.float32).reshape(-1, self.d).tolist()
+        allowed = sorted(int(i) for i in allowed) if allowed is not None else None
+        replies = list(self._pool.map(lambda shard: self._search_shard(shard, vectors, k, allowed), range(self.count)))
+
+        fill = -np.inf if self.metric_type == faiss.METRIC_INNER_PRODUCT else np.finfo(np.float32).max
+        distances = np.full((len(vectors), k), fill, dtype=np.float32)
+        positions = np.full((len(vectors), k), -1, dtype=np.int64)
+        for q in range(len(vectors)):
+            best_d, best_i = merge_topk([r["distances"][q] for r in replies], [r["ids"][q] for r in replies],
+                                        k, self.metric_type)
+            distances[q, :len(best_d)] = best_d
+            positions[q, :len(best_i)] = best_i
+        return distances, positions
+
+    def latency_report(self):
+        """p50/p95/max round-trip and in-worker search time per shard, in ms."""
+        report = []
+        for shard in range(self.count):
+            rtt, inner = list(self.latencies[shard]), list(self.search_times[shard])
+            report.append({
+                "shard": shard,
+                "address": self.clients[shard].address,
+                "vectors": self.manifest["shards"][shard]["ntotal"],
+                "queries": len(rtt),
+                "p50_ms": percentile(rtt, 50),
+                "p95_ms": percentile(rtt, 95),
+                "max_ms": max(rtt) if rtt else None,
+                "search_p50_ms": percentile(inner, 50),
+            })
+        return report
+
+    def close(self):
+        """Closes the connections and threads; the workers keep running for other stores."""
+        self._finalizer()
+
+    @staticmethod
+    def _shutdown(pool, clients):
+        pool.shutdown(wait=False)
+        for client in clients:
+            client.close()
+
+
+def load_sharded_store(snapshot_path, embeddings, addresses=None):
+    """
+    Opens a sharded snapshot as a LangChain FAISS store whose index is a
+    ShardedIndex. Only the docstore is loaded here; vectors stay in the workers.
+    """
+    from langchain_community.vectorstores import FAISS
+    with open(os.path.join(snapshot_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    index = ShardedIndex(snapshot_path, addresses or SHARD_ADDRESSES)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+# ==================================================
+# CLI
+# ==================================================
+def _print_report(report):
+    print(f"{'shard':>5} {'vectors':>8} {'queries':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'search p50':>10}")
+    for row in report:
+        print(f"{row['shard']:>5} {row['vectors']:>8} {row['queries']:>7} {row['p50_ms'] or 0:>8.2f} "
+              f"{row['p95_ms'] or 0:>8.2f} {row['max_ms'] or 0:>8.2f} {row['search_p50_ms'] or 0:>10.2f}")
+
+
+def _compare(sharded, exact, label):
+    """Prints top-k agreement; returns False when the merged distances differ from the exact ones."""
+    (sharded_d, sharded_i), (exact_d, exact_i) = sharded, exact
+    k = exact_i.shape[1]
+    agree = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(sharded_i, exact_i)]))
+    exact_match = bool(np.array_equal(sharded_i == -1, exact_i == -1)
+                       and np.allclose(np.where(exact_i == -1, 0, sharded_d), np.where(exact_i == -1, 0, exact_d),
+                                       rtol=1e-4, atol=1e-4))
+    print(f"{label}: top-{k} agreement with the unsharded index {agree:.4f}, "
+          f"distances {'match' if exact_match else 'DIFFER'}")
+    return exact_match
+
+
+def check_merge_topk(trials=500, seed=0):
+    """
+    Compares `merge_topk` with a brute-force sort over random per-shard lists,
+    including ties, -1 padding and empty shards, for both metrics.
+    """
+    rng = np.random.default_rng(seed)
+    for trial in range(trials):
+        metric = faiss.METRIC_INNER_PRODUCT if trial % 2 else faiss.METRIC_L2
+        k = int(rng.integers(1, 12))
+        distances, ids, hits = [], [], []
+        next_id = 0
+        for _ in range(int(rng.integers(1, 6))):
+            n = int(rng.integers(0, k + 1))
+            # Few distinct values, so ties across shards are common
+            shard_d = sorted(rng.integers(0, 5, size=n).astype(float).tolist(),
+                             reverse=metric == faiss.METRIC_INNER_PRODUCT)
+            shard_i = list(range(next_id, next_id + n))
+            next_id += n
+            hits += list(zip(shard_d, shard_i))
+            distances.append(shard_d + [0.0] * (k - n))
+            ids.append(shard_i + [-1] * (k - n))
+        sign = -1 if metric == faiss.METRIC_INNER_PRODUCT else 1
+        expected = sorted(hits, key=lambda hit: (sign * hit[0], hit[1]))[:k]
+        got = merge_topk(distances, ids, k, metric)
+        if got != ([d for d, _ in expected], [i for _, i in expected]):
+            print(f"merge_topk: trial {trial} returned {got}, expected {expected}")
+            return False
+    print(f"merge_topk: {trials} random merges match a brute-force sort")
+    return True
+
+
+def _filtered_exact(full, x, k, allowed):
+    params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.asarray(allowed, dtype=np.int64)))
+    return full.search(x, k, params=params)
+
+
+def bench(snapshot_path, queries=200, k=10, seed=0, addresses=None):
+    """
+    Runs random queries against the shards, prints per-shard latency and
+    checks the merged results, with and without an `allowed` filter, against
+    the unsharded index. Returns False when they differ.
+    """
+    full = faiss.read_index(os.path.join(snapshot_path, "index.faiss"))
+    rng = np.random.default_rng(seed)
+    # Perturbed stored vectors look like real queries more than uniform noise does
+    picks = rng.integers(0, full.ntotal, size=queries)
+    x = np.vstack([full.reconstruct(int(p)) for p in picks])
+    x += rng.normal(scale=float(np.std(x)) * 0.1, size=x.shape).astype(np.float32)
+    # A filter keeping about a fifth of the positions, like a metadata filter on one source
+    allowed = np.flatnonzero(rng.random(full.ntotal) < 0.2)
+
+    index = ShardedIndex(snapshot_path, addresses or SHARD_ADDRESSES)
+    try:
+        start = time.perf_counter()
+        for q in range(queries):
+            index.search(x[q:q + 1], k)
+        elapsed = time.perf_counter() - start
+        _print_report(index.latency_report())
+        print(f"{queries} queries in {elapsed:.2f}s ({queries / elapsed:.1f} queries/sec)")
+        ok = _compare(index.search(x, k), full.search(x, k), "unfiltered")
+        ok &= _compare(index.search(x, k, allowed=allowed), _filtered_exact(full, x, k, allowed),
+                       f"filtered ({len(allowed)} of {full.ntotal} allowed)")
+    finally:
+        index.close()
+    return ok
+
+
+def check(count=4, vectors=5000, d=32, seed=0):
+    """
+    Self-check needing no store or running workers: `merge_topk` against a
+    brute-force sort, then a random snapshot split by `write_shards` and
+    searched through in-process servers, with and without a filter, for both
+    metrics. Also checks that servers refuse snapshots outside their root.
+    """
+    ok = check_merge_topk(seed=seed)
+    rng = np.random.default_rng(seed)
+    root = tempfile.mkdtemp(prefix="mmdoc-shard-check-")
+    servers = []
+    try:
+        addresses = []
+        for i in range(count):
+            server = make_server(os.path.join(root, f"worker_{i}.sock"), root)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            servers.append(server)
+            addresses.append(server.server_address)
+
+        for metric in (faiss.METRIC_L2, faiss.METRIC_INNER_PRODUCT):
+            snapshot_path = os.path.join(root, "snapshots", f"metric_{metric}")
+            os.makedirs(snapshot_path)
+            full = faiss.index_factory(d, "Flat", metric)
+            full.add(rng.normal(size=(vectors, d)).astype(np.float32))
+            faiss.write_index(full, os.path.join(snapshot_path, "index.faiss"))
+            write_shards(full, snapshot_path, count)
+            ok &= bench(snapshot_path, queries=50, k=10, seed=seed, addresses=addresses)
+
+        try:
+            ShardClient(addresses[0]).request({"op": "load", "snapshot": tempfile.gettempdir(), "shard": 0})
+            print("path check: a snapshot outside the root was opened")
+            ok = False
+        except RuntimeError as e:
+            print(f"path check: refused ({e})")
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(root, ignore_errors=True)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded vector search over a snapshot.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="Run a shard server (local worker or remote node)")
+    p_serve.add_argument("--address", required=True,
+                         help="Unix socket path or host:port on a private interface (no authentication)")
+    p_serve.add_argument("--db_root", required=True, help="Only snapshots under this folder are served")
+
+    p_stop = sub.add_parser("stop", help="Stop this host's local worker pool")
+    p_stop.add_argument("--db_root", required=True)
+
+    p_rebalance = sub.add_parser("rebalance", help="Re-split the live snapshot into a new snapshot")
+    p_rebalance.add_argument("--db_root", required=True, help="Store root (FAISS_DB_PATH or a tenant folder)")
+    p_rebalance.add_argument("--shards", type=int, required=True)
+
+    p_status = sub.add_parser("status", help="Show the shards of the live snapshot and ping the workers")
+    p_status.add_argument("--db_root", required=True)
+
+    p_bench = sub.add_parser("bench", help="Per-shard latency and exactness check on the live snapshot")
+    p_bench.add_argument("--db_root", required=True)
+    p_bench.add_argument("--queries", type=int, default=200)
+    p_bench.add_argument("--k", type=int, default=10)
+
+    sub.add_parser("check", help="Check merging and filtered search on a random index (no store needed)")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.address, args.db_root)
+        return
+    if args.command == "check":
+        sys.exit(0 if check() else 1)
+    pool_root = SHARD_DB_ROOT or store_root(args.db_root)
+    if args.command == "stop":
+        print(f"Stopped {stop_local_workers(pool_root)} shard workers.")
+        return
+
+    from snapshot_store import current_snapshot_path, read_manifest, build_snapshot
+    snapshot_path = current_snapshot_path(args.db_root)
+    if snapshot_path is None:
+        sys.exit(f"No vector store under {args.db_root}.")
+
+    if args.command == "rebalance":
+        data_path = read_manifest(snapshot_path).get("data_path", "")
+        build_snapshot(data_path, args.db_root, rebalance_builder(snapshot_path, args.shards))
+    elif args.command == "status":
+        manifest = read_shards_manifest(snapshot_path)
+        print(f"Live snapshot: {snapshot_path}")
+        print(json.dumps(manifest, indent=2) if manifest else "Not sharded.")
+        for address in SHARD_ADDRESSES or _pool_addresses(pool_root, SHARD_WORKERS)[1]:
+            reply = ping(address, timeout=2)
+            print(f"{address}: up (pid {reply['pid']}, loaded {reply['loaded']})" if reply else f"{address}: down")
+    elif args.command == "bench":
+        if not has_shards(snapshot_path):
+            sys.exit(f"{snapshot_path} has no shards; run `rebalance --shards N` first.")
+        sys.exit(0 if bench(snapshot_path, queries=args.queries, k=args.k) else 1)
+
+
+if __name__ == "__main__":
+    main()
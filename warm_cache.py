@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import argparse
+from types import SimpleNamespace
+from bm25_index import reciprocal_rank_fusion
+from catalog import slide_catalog_entries, grant_catalog_entries
+from job_checkpoint import serialize_documents, deserialize_documents
+from page_join import get_colpali_file_names
+
+# ==================================================
+# Precomputed retrieval for the fixed catalog
+# ==================================================
+# Every purpose/subtype (slides) and template (grants) offered by the app is
+# retrieved once per index snapshot by `python warm_cache.py build`. The top
+# text chunks and the top ColPali pages are stored in warm_cache.json inside the snapshot folder, so a new snapshot never serves
+# stale candidates and old ones are garbage collected with their snapshot.
+# At request time only the user's free-text answers are searched live; the
+# results are fused with the stored candidates for the chosen catalog entry.
+
+WARM_CACHE_FILENAME = "warm_cache.json"
+
+
+def warm_cache_path(snapshot_path):
+    return os.path.join(snapshot_path, WARM_CACHE_FILENAME)
+
+
+def catalog_entries(template_fields_path="template_fields.json"):
+    with open(template_fields_path, "r") as f:
+        template_fields = json.load(f)
+    yield from slide_catalog_entries()
+    yield from grant_catalog_entries(template_fields)
+
+
+def build_warm_cache(db, snapshot_path, retrieve_fn, colpali_model=None, page_k=3):
+    """
+    Retrieves every catalog entry against `db` and writes warm_cache.json into
+    `snapshot_path`. `retrieve_fn(text, db)` returns the ranked chunks; ColPali
+    pages are only stored when `colpali_model` is given. No query embedding is
+    kept: requests never search the catalog text itself, only the answers.
+    """
+    doc_id_to_file = get_colpali_file_names(colpali_model) if colpali_model else {}
+    entries = {}
+    start = time.perf_counter()
+    for key, text in catalog_entries():
+        entry = {
+            "text": text,
+            "chunks": serialize_documents(retrieve_fn(text, db)),
+            "pages": []
+        }
+        if colpali_model is not None:
+            # Pages are stored by file name; ColPali doc ids can change when the image index is rebuilt
+            entry["pages"] = [
+                {"file_name": doc_id_to_file.get(int(r.doc_id)), "page_num": r.page_num,
+                 "score": float(getattr(r, "score", 0.0) or 0.0)}
+                for r in colpali_model.search(text, k=page_k)
+            ]
+        entries[key] = entry
+
+    data = {
+        "snapshot": os.path.basename(os.path.normpath(snapshot_path)),
+        "built_at": time.time(),
+        "entries": entries
+    }
+    path = warm_cache_path(snapshot_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+    print(f"[INFO] Warm cache: {len(entries)} catalog entries in {time.perf_counter() - start:.1f}s -> {path}")
+    return data
+
+
+def load_warm_cache(snapshot_path):
+    if not snapshot_path or not os.path.exists(warm_cache_path(snapshot_path)):
+        return {}
+    with open(warm_cache_path(snapshot_path), "r", encoding="utf-8") as f:
+        return json.load(f).get("entries", {})
+
+
+def get_warm_entry(db, key):
+    """
+    Stored candidates for a catalog key in the snapshot `db` was loaded from,
+    or None. A warm-up finishing after the store was loaded is picked up.
+    """
+    snapshot_path = getattr(db, "_snapshot_path", None)
+    if not snapshot_path:
+        return None
+    path = warm_cache_path(snapshot_path)
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    cached = getattr(db, "_warm_cache", None)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, load_warm_cache(snapshot_path))
+        db._warm_cache = cached
+    return cached[1].get(key)
+
+
+def warm_candidates(entry, doc_id_to_file, allowed_files=None):
+    """
+    Returns (documents, colpali-style page results) from a warm entry, limited
+    to `allowed_files` when a metadata filter is active.
+    """
+    docs = deserialize_documents(entry.get("chunks", []))
+    if allowed_files is not None:
+        docs = [d for d in docs if os.path.basename(d.metadata.get("source", "")) in allowed_files]
+
+    file_to_doc_id = {name: doc_id for doc_id, name in doc_id_to_file.items()}
+    pages = []
+    for page in entry.get("pages", []):
+        name = page.get("file_name")
+        if name not in file_to_doc_id or (allowed_files is not None and name not in allowed_files):
+            continue
+        pages.append(SimpleNamespace(doc_id=file_to_doc_id[name], page_num=page["page_num"], score=page.get("score", 0.0)))
+    return docs, pages
+
+
+def merge_candidates(live_docs, warm_docs, k=5):
+    """Fuses live free-text hits with precomputed catalog hits by reciprocal rank."""
+    if not warm_docs:
+        return live_docs[:k]
+    if not live_docs:
+        return warm_docs[:k]
+    return reciprocal_rank_fusion([live_docs, warm_docs], k)
+
+
+def merge_pages(live_pages, warm_pages, k=3):
+    """Alternates live and precomputed pages, dropping repeats, up to k."""
+    merged, seen = [], set()
+    for i in range(max(len(live_pages), len(warm_pages))):
+        for pages in (live_pages, warm_pages):
+            if i < len(pages):
+                key = (int(pages[i].doc_id), int(pages[i].page_num))
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(pages[i])
+    return merged[:k]
+
+
+# ==================================================
+# CLI
+# ==================================================
+def main():
+    parser = argparse.ArgumentParser(description="Precompute retrieval for the app's fixed catalog.")
+    parser.add_argument("command", choices=["build", "status"])
+    parser.add_argument("--tenant", default="default", help="Organization whose live snapshot is warmed")
+    parser.add_argument("--pages", action="store_true", help="Also store ColPali pages (loads the image index)")
+    args = parser.parse_args()
+
+    import create_documents
+    from snapshot_store import current_snapshot_path
+    from tenant_store import tenant_paths, tenant_image_paths
+    _, db_root = tenant_paths(args.tenant, create_documents.DATA_PATH, create_documents.FAISS_DB_PATH)
+
+    if args.command == "status":
+        snapshot_path = current_snapshot_path(db_root)
+        entries = load_warm_cache(snapshot_path) if snapshot_path else {}
+        print(f"Live snapshot: {snapshot_path or 'none'}; warm entries: {len(entries)}")
+        return
+
+    from Chatbot.retrieval import retrieve_context
+    db = create_documents.load_tenant_db(args.tenant)
+    colpali_model = None
+    if args.pages:
+        from byaldi import RAGMultiModalModel
+        _, image_index_name = tenant_image_paths(args.tenant, create_documents.IMAGES_FOLDER)
+        colpali_model = RAGMultiModalModel.from_index(image_index_name)
+    build_warm_cache(
+        db, db._snapshot_path,
+        retrieve_fn=lambda text, store: retrieve_context(text, store),
+        colpali_model=colpali_model
+    )
+
+
+if __name__ == "__main__":
+    main()